@@ -34,6 +34,11 @@ def _build_parser():
 
     workflowgroup = parser.add_argument_group("workflow", "")
     workflowgroup.add_argument("--nipype-omp-nthreads", type=int)
+    workflowgroup.add_argument(
+        "--precision",
+        choices=["float64", "float32"],
+        help="floating point precision of intermediate arrays and images, overrides the spec file",
+    )
     chunkinggroup = workflowgroup.add_mutually_exclusive_group(required=False)
     chunkinggroup.add_argument(
         "--n-chunks", type=int, help="number of subject-level workflow chunks to generate"
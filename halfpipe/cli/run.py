@@ -78,7 +78,7 @@ def run(opts, should_run):
 
         from ..workflow import init_workflow, init_execgraph
 
-        workflow = init_workflow(workdir)
+        workflow = init_workflow(workdir, precision=opts.precision)
 
         execgraphs = init_execgraph(
             workdir,
@@ -99,14 +99,19 @@ def run(opts, should_run):
         logger.info("Stage: run")
 
         if execgraphs is None:
-            from ..io import loadpicklelzma
-
             assert (
                 opts.execgraph_file is not None
             ), "Missing required --execgraph-file input for step run"
-            execgraphs = loadpicklelzma(opts.execgraph_file)
-            if not isinstance(execgraphs, list):
-                execgraphs = [execgraphs]
+            if opts.execgraph_file.endswith(".json"):  # manifest, chunks are loaded on demand
+                from ..io import CachedChunks
+
+                execgraphs = CachedChunks(opts.execgraph_file)
+            else:
+                from ..io import loadpicklelzma
+
+                execgraphs = loadpicklelzma(opts.execgraph_file)
+                if not isinstance(execgraphs, list):
+                    execgraphs = [execgraphs]
             logger.info(f'Using execgraphs defined in file "{opts.execgraph_file}"')
         else:
             logger.info("Using execgraphs from previous step")
@@ -151,14 +156,14 @@ def run(opts, should_run):
 
         logger.debug(f'Using plugin arguments\n{pformat(plugin_args)}')
 
-        execgraphstorun = []
+        execgraphstorun = []  # indices, so that chunks are only loaded when they are run
 
         if len(execgraphs) > 1:
             n_subjectlevel_chunks = len(execgraphs) - 1
             if opts.only_model_chunk:
                 logger.info("Will not run subject level chunks")
                 logger.info("Will run model chunk")
-                execgraphstorun.append(execgraphs[-1])
+                execgraphstorun.append(len(execgraphs) - 1)
 
             elif opts.only_chunk_index is not None:
                 zerobasedchunkindex = opts.only_chunk_index - 1
@@ -167,23 +172,25 @@ def run(opts, should_run):
                     f"Will run subject level chunk {opts.only_chunk_index} of {n_subjectlevel_chunks}"
                 )
                 logger.info("Will not run model chunk")
-                execgraphstorun.append(execgraphs[zerobasedchunkindex])
+                execgraphstorun.append(zerobasedchunkindex)
 
             else:
                 logger.info(f"Will run all {n_subjectlevel_chunks} subject level chunks")
                 logger.info("Will run model chunk")
-                execgraphstorun.extend(execgraphs)
+                execgraphstorun.extend(range(len(execgraphs)))
 
         elif len(execgraphs) == 1:
-            execgraphstorun.append(execgraphs[0])
+            execgraphstorun.append(0)
 
         else:
             raise ValueError("No execgraphs")
 
         n_execgraphstorun = len(execgraphstorun)
-        for i, execgraph in enumerate(execgraphstorun):
+        for i, chunkindex in enumerate(execgraphstorun):
             from ..utils import first
 
+            execgraph = execgraphs[chunkindex]
+
             if len(execgraphs) > 1:
                 logger.info(f"Running chunk {i+1} of {n_execgraphstorun}")
 
@@ -198,6 +205,10 @@ def run(opts, should_run):
                 else:
                     logger.warning(f"Ignoring exception in chunk {i+1}", exc_info=True)
 
+            from ..workflow import materialize_reports
+
+            materialize_reports(workdir)
+
             if len(execgraphs) > 1:
                 logger.info(f"Completed chunk {i+1} of {n_execgraphstorun}")
 
@@ -9,7 +9,7 @@ from math import ceil
 import logging
 
 from .utils import first
-from .io import make_cachefilepath
+from .io import make_chunksdirpath
 
 script_template = """#!/bin/bash
 #SBATCH --job-name=halfpipe
@@ -41,7 +41,7 @@ def create_example_script(workdir, execgraphs):
     uuid = first(execgraphs).uuid
     n_chunks = len(execgraphs) - 1  # omit model chunk
     assert n_chunks > 1
-    execgraph_file = make_cachefilepath(f"execgraph.{n_chunks:d}_chunks", uuid)
+    execgraph_file = Path(make_chunksdirpath(f"execgraph.{n_chunks:d}_chunks", uuid)) / "manifest.json"
 
     n_cpus = 2
     mem_gb = max(node.mem_gb for execgraph in execgraphs for node in execgraph.nodes)
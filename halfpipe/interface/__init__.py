@@ -2,12 +2,14 @@
 # emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
 # vi: set ft=python sts=4 ts=4 sw=4 et:
 
+from .alff import ALFF
 from .conditions import ParseConditionFile
 from .connectivity import ConnectivityMeasure
-from .fixes import ApplyTransforms, FLAMEO, ReHo
-from .fslnumpy import FLAME1, FilterRegressor, TemporalFilter
+from .fixes import ApplyTransforms, FLAMEO
+from .fslnumpy import FixedEffects, FirstLevelGLM, FLAME1, DualRegression, FilterRegressor, TemporalFilter
 from .imagemaths import AddMeans, BlurInMask, MaskCoverage, MaxIntensity, Merge, MergeMask, Resample, ZScore
 from .preprocessing import GrandMeanScaling
+from .reho import ReHo
 from .report import PlotEpi, PlotRegistration, Vals, CalcMean
 from .resultdict import (
     MakeResultdicts,
@@ -32,12 +34,16 @@ from .utility import (
 )
 
 __all__ = [
+    ALFF,
     ParseConditionFile,
     ConnectivityMeasure,
     ApplyTransforms,
     FLAMEO,
     ReHo,
+    FixedEffects,
+    FirstLevelGLM,
     FLAME1,
+    DualRegression,
     FilterRegressor,
     TemporalFilter,
     AddMeans,
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""
+Amplitude of low frequency fluctuations from the power spectrum of the unfiltered time
+series, so that the band-limited and the full variance are computed in one pass
+"""
+
+from pathlib import Path
+from tempfile import TemporaryDirectory, NamedTemporaryFile
+
+import numpy as np
+import nibabel as nib
+
+from nipype.interfaces.base import (
+    SimpleInterface,
+    TraitedSpec,
+    File,
+    traits,
+    isdefined,
+)
+
+from ..utils import nvol
+
+block_nbytes = 2 ** 26  # size of the blocks of voxels that are processed at once
+
+
+def band_weights(n, repetition_time, low=None, high=None):
+    """
+    weights of the frequencies of a real fft of length n, such that the weighted sum of
+    the power is the variance in the band by parseval's theorem
+
+    the mean is never part of the band, like for a standard deviation
+    """
+    frequencies = np.fft.rfftfreq(n, d=repetition_time)
+
+    weights = np.full(frequencies.size, 2.0)
+    weights[0] = 0.0  # mean
+    if n % 2 == 0:
+        weights[-1] = 1.0  # nyquist frequency is not mirrored
+
+    full_weights = weights / (n * n)
+
+    is_in_band = np.ones(frequencies.size, dtype=bool)
+    if low is not None and low > 0:
+        is_in_band &= frequencies >= low
+    if high is not None and high > 0:
+        is_in_band &= frequencies <= high
+    band_weights = np.where(is_in_band, full_weights, 0.0)
+
+    return band_weights, full_weights
+
+
+def alff(time_series, repetition_time, low=None, high=None, block_nbytes=block_nbytes):
+    """
+    time_series are voxels by time points, returns the standard deviation of the
+    band-limited signal and its fraction of the standard deviation of the full signal
+    """
+    m, n = time_series.shape
+    band, full = band_weights(n, repetition_time, low, high)
+
+    amplitude = np.zeros(m, dtype=np.float64)
+    fraction = np.zeros(m, dtype=np.float64)
+
+    block_size = max(1, block_nbytes // (n * 16))
+    for start in range(0, m, block_size):
+        stop = min(m, start + block_size)
+        spectrum = np.fft.rfft(np.asarray(time_series[start:stop]), axis=1)
+        power = spectrum.real ** 2 + spectrum.imag ** 2
+
+        band_power = power @ band
+        full_power = power @ full
+
+        amplitude[start:stop] = np.sqrt(band_power)
+        np.divide(amplitude[start:stop], np.sqrt(full_power), out=fraction[start:stop], where=full_power > 0)
+
+    return amplitude, fraction
+
+
+class ALFFInputSpec(TraitedSpec):
+    in_file = File(desc="unfiltered input dataset", exists=True, mandatory=True)
+    mask = File(desc="mask of voxels to include", exists=True)
+    repetition_time = traits.Float(desc="repetition time in seconds", mandatory=True)
+    low = traits.Float(0.01, usedefault=True, desc="lower edge of the band in Hz, zero for none")
+    high = traits.Float(0.1, usedefault=True, desc="upper edge of the band in Hz, zero for none")
+    dtype = traits.Enum("float64", "float32", usedefault=True, desc="precision of the time series")
+    stream_mem_gb = traits.Float(
+        desc="read the time series volume by volume to a memory-mapped file and process blocks of voxels"
+    )
+
+
+class ALFFOutputSpec(TraitedSpec):
+    alff = File(desc="standard deviation of the band-limited signal")
+    falff = File(desc="fraction of the standard deviation in the band")
+
+
+class ALFF(SimpleInterface):
+    input_spec = ALFFInputSpec
+    output_spec = ALFFOutputSpec
+
+    def _load_mask(self, in_img):
+        if isdefined(self.inputs.mask):
+            mask_img = nib.load(self.inputs.mask)
+            assert nvol(mask_img) == 1
+            assert np.allclose(mask_img.affine, in_img.affine)
+            return np.asanyarray(mask_img.dataobj).astype(bool).reshape(in_img.shape[:3])
+        return np.ones(in_img.shape[:3], dtype=bool)
+
+    def _open(self, in_img, mask, scratch_dir):
+        """
+        copy the masked voxels volume by volume to a memory-mapped array of time points by
+        voxels, so that the whole image is never in memory, and return it as voxels by
+        time points
+        """
+        n = nvol(in_img)
+        with NamedTemporaryFile(dir=scratch_dir, suffix=".npy", delete=False) as file_handle:
+            array = np.lib.format.open_memmap(
+                file_handle.name, mode="w+", dtype=self.inputs.dtype, shape=(n, int(mask.sum()))
+            )
+        for i in range(n):
+            volume = in_img.dataobj[..., i] if in_img.ndim > 3 else in_img.dataobj[...]
+            array[i, :] = np.asanyarray(volume)[mask]
+        return array.T
+
+    def _run_interface(self, runtime):
+        in_img = nib.load(self.inputs.in_file, keep_file_open=True)  # read compressed files sequentially
+        mask = self._load_mask(in_img)
+
+        low = self.inputs.low if self.inputs.low > 0 else None
+        high = self.inputs.high if self.inputs.high > 0 else None
+
+        if isdefined(self.inputs.stream_mem_gb):
+            stream_nbytes = max(1, int(self.inputs.stream_mem_gb * 2 ** 30) // 4)  # block, spectrum and power
+            with TemporaryDirectory(dir=Path.cwd()) as scratch_dir:
+                time_series = self._open(in_img, mask, scratch_dir)
+                out = alff(
+                    time_series, self.inputs.repetition_time, low, high, block_nbytes=min(block_nbytes, stream_nbytes)
+                )
+                del time_series
+        else:
+            data = np.asanyarray(in_img.dataobj, dtype=self.inputs.dtype)
+            out = alff(data[mask], self.inputs.repetition_time, low, high)
+            del data
+
+        for key, values in zip(["alff", "falff"], out):
+            out_array = np.zeros(mask.shape, dtype=np.float32)
+            out_array[mask] = values
+
+            out_img = nib.Nifti1Image(out_array, in_img.affine, in_img.header)
+            out_img.header.set_data_shape(out_array.shape)
+            out_img.header.set_data_dtype(np.float32)
+            out_img.header.set_slope_inter(1, 0)
+
+            out_file = Path(f"{key}.nii.gz").resolve()
+            nib.save(out_img, out_file)
+            self._results[key] = str(out_file)
+
+        return runtime
@@ -15,71 +15,115 @@ from nipype.interfaces.base import (
     TraitedSpec,
     BaseInterfaceInputSpec,
     traits,
-    File
+    File,
+    Directory,
+    InputMultiObject,
+    isdefined,
 )
 
 from ..io import meansignals
 
 
+def cov_corr(time_series):
+    """
+    covariance and correlation of the columns with one matrix product, columns that
+    are all nan give nan rows and columns like in pandas
+    """
+    n, _ = time_series.shape
+
+    is_empty = np.all(np.isnan(time_series), axis=0)
+    is_complete = np.all(np.isfinite(time_series), axis=0)
+
+    if n < 2 or not np.all(is_empty | is_complete):  # need pairwise complete observations
+        df = pd.DataFrame(time_series)
+        return np.asarray(df.cov()), np.asarray(df.corr())
+
+    x = time_series - time_series.mean(axis=0)
+    cov_mat = (x.T @ x) / (n - 1)
+
+    std = np.sqrt(np.diag(cov_mat))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        corr_mat = cov_mat / np.outer(std, std)
+    corr_mat = np.clip(corr_mat, -1, 1)
+
+    return cov_mat, corr_mat
+
+
 class ConnectivityMeasureInputSpec(BaseInterfaceInputSpec):
     in_file = File(
         desc="Image file(s) from where to extract the data", exists=True, mandatory=True
     )
     mask_file = File(desc="Mask file", exists=True, mandatory=True)
-    atlas_file = File(
-        desc="Atlas image file defining the connectivity ROIs", exists=True, mandatory=True,
+    atlas_files = InputMultiObject(
+        File(exists=True), desc="Atlas image files defining the connectivity ROIs", mandatory=True,
     )
 
     background_label = traits.Int(desc="", default=0, usedefault=True)
     min_region_coverage = traits.Float(desc="", default=0.8, usedefault=True)
 
+    dtype = traits.Enum("float64", "float32", usedefault=True, desc="precision of the image data in memory")
+    cache_dir = Directory(desc="directory to cache the label matrices in", nohash=True)
+
 
 class ConnectivityMeasureOutputSpec(TraitedSpec):
-    time_series = File(desc="Numpy text file with the timeseries matrix")
-    covariance = File(desc="Numpy text file with the connectivity matrix")
-    correlation = File(desc="Numpy text file with the connectivity matrix")
-    region_coverage = traits.List(traits.Float)
+    time_series = traits.List(File(desc="Numpy text file with the timeseries matrix"))
+    covariance = traits.List(File(desc="Numpy text file with the connectivity matrix"))
+    correlation = traits.List(File(desc="Numpy text file with the connectivity matrix"))
+    region_coverage = traits.List(traits.List(traits.Float))
 
 
 class ConnectivityMeasure(BaseInterface):
+    """
+    extracts the time series for all atlases with a single read of the image data, the
+    matrices are also saved as npy files next to the text files
+    """
+
     input_spec = ConnectivityMeasureInputSpec
     output_spec = ConnectivityMeasureOutputSpec
 
     def _run_interface(self, runtime):
-        self._time_series, self._region_coverage = meansignals(
+        cache_dir = None
+        if isdefined(self.inputs.cache_dir):
+            cache_dir = self.inputs.cache_dir
+
+        self._results = meansignals(
             self.inputs.in_file,
-            self.inputs.atlas_file,
+            list(self.inputs.atlas_files),
             mask_file=self.inputs.mask_file,
             background_label=self.inputs.background_label,
             min_region_coverage=self.inputs.min_region_coverage,
-            output_coverage=True
+            output_coverage=True,
+            dtype=self.inputs.dtype,
+            cache_dir=cache_dir,
         )
 
-        df = pd.DataFrame(self._time_series)
-
-        self._cov_mat = np.asarray(df.cov())
-        self._corr_mat = np.asarray(df.corr())
-
         return runtime
 
     def _list_outputs(self):
         outputs = self.output_spec().get()
 
+        for key in ["time_series", "covariance", "correlation", "region_coverage"]:
+            outputs[key] = list()
+
         argdict = dict(fmt="%.10f", delimiter="\t")
 
-        time_series_file = op.abspath("timeseries.tsv")
-        np.savetxt(time_series_file, self._time_series, **argdict)
+        for i, (time_series, region_coverage) in enumerate(self._results):
+            cov_mat, corr_mat = cov_corr(time_series)
+
+            for key, stem, mat in [
+                ("time_series", "timeseries", time_series),
+                ("covariance", "covariance", cov_mat),
+                ("correlation", "correlation", corr_mat),
+            ]:
+                stem = f"{stem}_{i + 1}"
 
-        covariance_file = op.abspath("covariance.tsv")
-        np.savetxt(covariance_file, self._cov_mat, **argdict)
+                np.save(op.abspath(f"{stem}.npy"), mat)
 
-        correlation_file = op.abspath("correlation.tsv")
-        np.savetxt(correlation_file, self._corr_mat, **argdict)
+                out_file = op.abspath(f"{stem}.tsv")
+                np.savetxt(out_file, mat, **argdict)
 
-        outputs["time_series"] = time_series_file
-        outputs["covariance"] = covariance_file
-        outputs["correlation"] = correlation_file
+                outputs[key].append(out_file)
 
-        outputs["region_coverage"] = self._region_coverage
+            outputs["region_coverage"].append(region_coverage)
 
         return outputs
@@ -2,8 +2,11 @@
 # emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
 # vi: set ft=python sts=4 ts=4 sw=4 et:
 
+from .fe import FixedEffects
+from .film import FirstLevelGLM
 from .flame1 import FLAME1
+from .glm import DualRegression
 from .regfilt import FilterRegressor
 from .tempfilt import TemporalFilter
 
-__all__ = [FLAME1, FilterRegressor, TemporalFilter]
+__all__ = [FixedEffects, FirstLevelGLM, FLAME1, DualRegression, FilterRegressor, TemporalFilter]
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""
+Fixed effects and ordinary least squares group models, which unlike FLAME1 have a
+closed form solution, so that all voxels with the same missing data pattern are
+estimated with a few matrix operations
+"""
+
+import numpy as np
+import nibabel as nib
+
+from nipype.interfaces.base import (
+    traits,
+    isdefined,
+    File,
+    InputMultiPath,
+    SimpleInterface
+)
+
+from ...io import parse_design
+from ..stats import DesignSpec
+from .flame1 import (
+    FLAME1OutputSpec,
+    allocate_voxel_results,
+    convert_voxel_results,
+    flame1_contrast_batched,
+    load_inputs,
+    missing_data_groups,
+    write_voxel_results,
+)
+
+
+def ols_batched(y, z):
+    """
+    returns the parameter estimates and their covariance for every voxel
+    as well as a boolean array indicating for which voxels these are valid
+
+    the design is shared by all voxels, so it only needs to be inverted once
+    """
+    npts, nevs = z.shape
+    nvox, _ = y.shape
+
+    ztz = z.T @ z
+    sign, _ = np.linalg.slogdet(ztz)
+    if not sign > 0:  # the design is rank deficient
+        return np.zeros((nvox, nevs)), np.zeros((nvox, nevs, nevs)), np.zeros(nvox, dtype=bool)
+
+    ztz_inv = np.linalg.inv(ztz)
+    mn = y @ (z @ ztz_inv)
+
+    residuals = y - mn @ z.T
+    sigmasq = np.einsum("vi,vi->v", residuals, residuals) / (npts - nevs)
+
+    covariance = sigmasq[:, np.newaxis, np.newaxis] * ztz_inv
+
+    return mn, covariance, np.ones(nvox, dtype=bool)
+
+
+def fe_batched(y, z, s):
+    """
+    like ols_batched, but weighted by the inverse of the lower level variances,
+    which are also taken to be the variance of the estimates, like flameo --runmode=fe
+    """
+    _, nevs = z.shape
+
+    w = 1.0 / s
+
+    ztwz = np.einsum("vi,ij,ik->vjk", w, z, z)
+    ztwy = np.einsum("vi,ij,vi->vj", w, z, y)
+
+    sign, _ = np.linalg.slogdet(ztwz)
+    valid = sign > 0
+
+    ztwz[np.logical_not(valid)] = np.eye(nevs)  # avoid linalg errors, result is discarded
+    covariance = np.linalg.inv(ztwz)
+    mn = (covariance @ ztwy[:, :, np.newaxis])[:, :, 0]
+
+    return mn, covariance, valid
+
+
+def fixed_effects(cope_files, mask_files, regressors, contrasts, var_cope_files=None, dtype=np.float64):
+    """
+    fixed effects if variances are given, otherwise ordinary least squares
+    """
+    dmat, cmatdict = parse_design(regressors, contrasts)
+
+    nevs = dmat.columns.size
+    design = dmat.to_numpy(dtype=np.float64)
+
+    copes, var_copes, masks = load_inputs(cope_files, mask_files, dmat, var_cope_files=var_cope_files, dtype=dtype)
+    if var_cope_files is not None:
+        masks = np.logical_and(masks, var_copes > 0)  # the variances are used as weights
+
+    shape = copes[..., 0].shape
+
+    ref_img = nib.load(cope_files[0])
+
+    copes = copes.reshape((-1, copes.shape[-1]))
+    var_copes = var_copes.reshape((-1, var_copes.shape[-1]))
+    masks = masks.reshape((-1, masks.shape[-1]))
+
+    npts = np.count_nonzero(masks, axis=1)
+    (voxels,) = np.nonzero(npts >= nevs + 1)  # need at least one degree of freedom
+
+    voxel_results = allocate_voxel_results(cmatdict, voxels.size, dtype=dtype)
+
+    for group in missing_data_groups(masks, voxels):
+        m = masks[voxels[group[0]]]
+        z = design[m, :]
+
+        group_voxels = voxels[group]
+        y = copes[group_voxels][:, m].astype(np.float64)
+
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            if var_cope_files is not None:
+                s = var_copes[group_voxels][:, m].astype(np.float64)
+                mn, covariance, valid = fe_batched(y, z, s)
+            else:
+                mn, covariance, valid = ols_batched(y, z)
+
+            for name, cmat in cmatdict.items():
+                r, contrast_valid = flame1_contrast_batched(mn, covariance, np.count_nonzero(m), cmat)
+                contrast_valid = np.logical_and(valid, contrast_valid)
+
+                for map_name, values in r.items():
+                    voxel_results[name][map_name][group[contrast_valid]] = values[contrast_valid]
+
+    convert_voxel_results(voxel_results)
+
+    return write_voxel_results(voxel_results, voxels, cmatdict, shape, ref_img, dtype=dtype)
+
+
+class FixedEffectsInputSpec(DesignSpec):
+    cope_files = InputMultiPath(
+        File(exists=True),
+        mandatory=True,
+    )
+    var_cope_files = InputMultiPath(
+        File(exists=True),
+        mandatory=False,
+    )
+    mask_files = InputMultiPath(
+        File(exists=True),
+        mandatory=True,
+    )
+
+    dtype = traits.Enum("float64", "float32", usedefault=True, desc="precision of input arrays and output images")
+
+
+class FixedEffects(SimpleInterface):
+    """
+    runs ordinary least squares if there are no var_cope_files
+    """
+
+    input_spec = FixedEffectsInputSpec
+    output_spec = FLAME1OutputSpec
+
+    def _run_interface(self, runtime):
+        var_cope_files = self.inputs.var_cope_files
+
+        if not isdefined(var_cope_files) or len(var_cope_files) == 0:
+            var_cope_files = None
+
+        self._results.update(
+            fixed_effects(
+                cope_files=self.inputs.cope_files,
+                var_cope_files=var_cope_files,
+                mask_files=self.inputs.mask_files,
+                regressors=self.inputs.regressors,
+                contrasts=self.inputs.contrasts,
+                dtype=np.dtype(self.inputs.dtype),
+            )
+        )
+
+        return runtime
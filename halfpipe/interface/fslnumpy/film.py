@@ -0,0 +1,428 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""
+First level model like feat_model and film_gls, where the design is convolved in numpy
+and the prewhitened models are solved for groups of voxels with the same quantised
+autoregressive parameters, so that one QR decomposition serves many voxels
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import nibabel as nib
+from scipy import linalg, ndimage, stats
+
+from nipype.interfaces.base import (
+    traits,
+    TraitedSpec,
+    isdefined,
+    File,
+    SimpleInterface
+)
+
+from ...io import loadspreadsheet
+from ...utils import nvol
+from .glm import OLS
+from .tempfilt import bandpass_temporal_filter
+
+block_nbytes = 2 ** 26  # size of the blocks of voxels that are processed at once
+
+
+def double_gamma_hrf(dt, duration=32.0):
+    """
+    difference of gammas with the delays and widths of feat, scaled so that the response
+    to a long block has a height of one
+    """
+    t = np.arange(0, duration, dt)
+    hrf = stats.gamma.pdf(t, 6) - stats.gamma.pdf(t, 16) / 6
+    return hrf / (hrf.sum() * dt)
+
+
+def make_design(
+    n, repetition_time, conditions, onsets, durations, condition_units="secs", confounds_df=None,
+    derivs=False, high_pass_filter_cutoff=np.inf, oversampling=16
+):
+    """
+    convolved, filtered and demeaned design matrix as a data frame with one column per
+    condition (and temporal derivative), followed by one column per confound
+    """
+    dt = repetition_time / oversampling
+    m = n * oversampling
+
+    scale = repetition_time if condition_units == "scans" else 1.0
+
+    hrf = double_gamma_hrf(dt)
+
+    columns = dict()
+    for condition, condition_onsets, condition_durations in zip(conditions, onsets, durations):
+        boxcar = np.zeros(m)
+        for onset, duration in zip(condition_onsets, condition_durations):
+            start = int(round(onset * scale / dt))
+            stop = max(start + 1, int(round((onset + duration) * scale / dt)))
+            boxcar[max(0, start):max(0, min(m, stop))] += 1.0
+
+        response = np.convolve(boxcar, hrf)[:m] * dt
+        regressor = response[::oversampling]
+        columns[condition] = regressor
+
+        if derivs:
+            derivative = np.gradient(response, dt)[::oversampling]
+            centered = regressor - regressor.mean()
+            norm = centered @ centered
+            if norm > 0:  # orthogonalize with respect to the original regressor like feat
+                derivative = derivative - (derivative @ centered) / norm * centered
+            columns[f"{condition}TD"] = derivative
+
+    design_df = pd.DataFrame(columns, index=pd.RangeIndex(n), dtype=np.float64)
+
+    if confounds_df is not None and confounds_df.size > 0:
+        confounds = np.nan_to_num(confounds_df.to_numpy(dtype=np.float64), posinf=0.0, neginf=0.0)
+        confounds_df = pd.DataFrame(confounds, columns=list(map(str, confounds_df.columns)))
+        design_df = pd.concat([design_df, confounds_df], axis=1)
+
+    array = design_df.to_numpy(dtype=np.float64).T.copy()  # columns by time points
+    if np.isfinite(high_pass_filter_cutoff) and high_pass_filter_cutoff > 0 and array.size > 0:
+        hp_sigma = high_pass_filter_cutoff / (2.0 * repetition_time)
+        array = bandpass_temporal_filter(array, hp_sigma, -1.0, method="direct")
+    array -= array.mean(axis=1, keepdims=True)
+
+    return pd.DataFrame(array.T, columns=design_df.columns)
+
+
+def tukey_taper(max_lag, tukey_window):
+    lags = np.arange(max_lag + 1)
+    return np.where(lags < tukey_window, 0.5 * (1 + np.cos(np.pi * lags / tukey_window)), 0.0)
+
+
+def autocorrelation(residuals, max_lag):
+    """
+    residuals are time points by voxels, returns voxels by lags from zero to max_lag
+    """
+    n, v = residuals.shape
+    out = np.zeros((v, max_lag + 1))
+    variance = np.einsum("ij,ij->j", residuals, residuals)
+    is_valid = variance > 0
+    out[:, 0] = 1.0
+    for lag in range(1, max_lag + 1):
+        if lag >= n:
+            break
+        covariance = np.einsum("ij,ij->j", residuals[lag:], residuals[:-lag])
+        np.divide(covariance, variance, out=out[:, lag], where=is_valid)
+    return out
+
+
+def yule_walker(rho):
+    """
+    autoregressive parameters from the autocorrelation of each voxel
+    """
+    v, k = rho.shape
+    p = k - 1
+    if p == 0:
+        return np.zeros((v, 0))
+
+    lags = np.abs(np.subtract.outer(np.arange(p), np.arange(p)))
+    matrices = rho[:, lags]  # toeplitz matrices for each voxel
+
+    phi = np.zeros((v, p))
+    try:
+        phi[:] = np.linalg.solve(matrices, rho[:, 1:, np.newaxis])[..., 0]
+    except np.linalg.LinAlgError:
+        for i in range(v):
+            phi[i], _, _, _ = np.linalg.lstsq(matrices[i], rho[i, 1:], rcond=None)
+
+    return phi
+
+
+class Whitener:
+    """
+    exact prewhitening of a stationary autoregressive process, where the first p time
+    points are decorrelated with the cholesky factor of their covariance and the others
+    with the autoregressive filter
+    """
+
+    def __init__(self, phi):
+        phi = np.asarray(phi, dtype=np.float64)
+        p = phi.size
+
+        if p == 0:  # white noise
+            self.phi, self.scale, self.cholesky = phi, 1.0, np.eye(0)
+            return
+
+        try:
+            rho = self._autocorrelation(phi)
+            innovation_variance = 1.0 - phi @ rho[1:]
+            if not innovation_variance > 1e-6:
+                raise ValueError("Process is not stationary")
+            cholesky = linalg.cholesky(linalg.toeplitz(rho[:p]), lower=True)
+        except (ValueError, np.linalg.LinAlgError, linalg.LinAlgError):
+            phi = np.zeros(p)  # fall back to ordinary least squares
+            innovation_variance = 1.0
+            cholesky = np.eye(p)
+
+        self.phi = phi
+        self.scale = 1.0 / np.sqrt(innovation_variance)
+        self.cholesky = cholesky
+
+    @staticmethod
+    def _autocorrelation(phi):
+        """
+        solve the yule walker equations for the autocorrelation at lags zero to p
+        """
+        p = phi.size
+        a = np.eye(p)
+        b = np.zeros(p)
+        for k in range(1, p + 1):
+            for j in range(1, p + 1):
+                lag = abs(k - j)
+                if lag == 0:
+                    b[k - 1] += phi[j - 1]
+                else:
+                    a[k - 1, lag - 1] -= phi[j - 1]
+        return np.concatenate([[1.0], np.linalg.solve(a, b)])
+
+    def apply(self, array):
+        """
+        array has time points in the first dimension
+        """
+        p = self.phi.size
+        out = np.empty(array.shape, dtype=np.float64)
+        if p > 0:
+            out[:p] = linalg.solve_triangular(self.cholesky, array[:p], lower=True)
+        out[p:] = array[p:]
+        for k in range(1, p + 1):
+            out[p:] -= self.phi[k - 1] * array[p - k:array.shape[0] - k]
+        out[p:] *= self.scale
+        return out
+
+
+def film_gls(
+    data, design, contrasts, ar_order=1, ar_precision=0.01, tukey_window=None, smooth=None, num_threads=1
+):
+    """
+    data are time points by voxels, design is time points by regressors and contrasts are
+    one per row
+
+    returns the statistics for each contrast, the degrees of freedom and the quantised
+    autoregressive parameters of each voxel
+    """
+    n, v = data.shape
+    _, p = design.shape
+    contrasts = np.atleast_2d(contrasts)
+
+    if tukey_window is None:
+        tukey_window = int(np.floor(np.sqrt(n)))
+    tukey_window = max(tukey_window, ar_order + 1)
+
+    data_mean = data.mean(axis=0)
+
+    # autocorrelation of the residuals of the ordinary least squares fit
+    ols = OLS(design, demean=False)
+    rho = np.empty((v, ar_order + 1))
+    block_size = max(1, block_nbytes // (n * 8))
+    for start in range(0, v, block_size):
+        stop = min(v, start + block_size)
+        y = np.asarray(data[:, start:stop], dtype=np.float64) - data_mean[start:stop]
+        beta = ols.r_pinv @ (ols.q.T @ y)
+        rho[start:stop] = autocorrelation(y - ols.x @ beta, ar_order)
+
+    if smooth is not None:
+        rho[:, 1:] = smooth(rho[:, 1:])
+    rho[:, 1:] *= tukey_taper(ar_order, tukey_window)[1:]
+
+    phi = yule_walker(rho)
+    phi = np.round(phi / ar_precision) * ar_precision
+
+    if ar_order > 0:
+        groups, group_indices = np.unique(phi, axis=0, return_inverse=True)
+        group_indices = np.ravel(group_indices)
+    else:
+        groups, group_indices = np.zeros((1, 0)), np.zeros(v, dtype=int)
+
+    c, _ = contrasts.shape
+    result = {key: np.full((c, v), np.nan) for key in ["effect", "variance", "t", "z"]}
+
+    def fit_group(i):
+        (voxels,) = np.nonzero(group_indices == i)
+
+        whitener = Whitener(groups[i])
+        model = OLS(whitener.apply(design), demean=False)
+
+        for start in range(0, voxels.size, block_size):
+            block = voxels[start:start + block_size]
+            y = whitener.apply(np.asarray(data[:, block], dtype=np.float64) - data_mean[block])
+            beta, residual_ss = model.fit(y)
+            for key, value in zip(["effect", "variance", "t", "z"], model.t_contrasts(beta, residual_ss, contrasts)):
+                result[key][:, block] = value
+
+        return model.dof
+
+    if num_threads > 1:
+        with ThreadPoolExecutor(max_workers=num_threads) as executor:
+            dofs = list(executor.map(fit_group, range(groups.shape[0])))
+    else:
+        dofs = list(map(fit_group, range(groups.shape[0])))
+
+    dof = min(dofs) if len(dofs) > 0 else n - np.linalg.matrix_rank(design)
+
+    return result, dof, groups[group_indices]
+
+
+def smooth_in_mask(mask, mask_size):
+    """
+    box filter of voxel values that only averages over voxels in the mask, an adaptation
+    of the susan smoothing of the autocorrelation in film_gls
+    """
+    weights = ndimage.uniform_filter(mask.astype(np.float64), size=mask_size, mode="constant")[mask]
+
+    def smooth(values):
+        out = np.empty(values.shape)
+        volume = np.zeros(mask.shape)
+        for i in range(values.shape[1]):
+            volume[mask] = values[:, i]
+            out[:, i] = ndimage.uniform_filter(volume, size=mask_size, mode="constant")[mask] / weights
+        return out
+
+    return smooth
+
+
+class FirstLevelGLMInputSpec(TraitedSpec):
+    in_file = File(desc="input dataset", exists=True, mandatory=True)
+    mask = File(desc="mask of voxels to include", exists=True, mandatory=True)
+    repetition_time = traits.Float(desc="repetition time in seconds", mandatory=True)
+    subject_info = traits.Any(desc="bunch of conditions, onsets and durations", mandatory=True)
+    condition_units = traits.Enum("secs", "scans", usedefault=True)
+    confounds = File(desc="table of confounds to add to the design", exists=True)
+    contrasts = traits.List(
+        traits.List(traits.Any()), desc="list of name, type, condition names and values", mandatory=True
+    )
+    high_pass_filter_cutoff = traits.Float(np.inf, usedefault=True, desc="in seconds, applied to the design")
+    derivs = traits.Bool(False, usedefault=True, desc="add temporal derivatives of the conditions")
+
+    ar_order = traits.Range(low=0, value=1, usedefault=True, desc="order of the autoregressive model")
+    ar_precision = traits.Float(0.01, usedefault=True, desc="voxels with the same rounded parameters share a model")
+    tukey_window = traits.Int(desc="default is the square root of the number of volumes")
+    smooth_autocorr = traits.Bool(True, usedefault=True, desc="smooth the autocorrelation in the mask")
+    mask_size = traits.Int(5, usedefault=True, desc="width of the smoothing in voxels")
+    num_threads = traits.Int(1, usedefault=True, desc="fit groups of voxels concurrently")
+
+
+class FirstLevelGLMOutputSpec(TraitedSpec):
+    design_matrix = File(exists=True)
+    contrast_matrix = File(exists=True)
+    contrast_names = traits.List(traits.Str())
+    copes = traits.List(File(exists=True))
+    varcopes = traits.List(File(exists=True))
+    zstats = traits.List(File(exists=True))
+    tstats = traits.List(File(exists=True))
+    dof_file = File(exists=True)
+
+
+class FirstLevelGLM(SimpleInterface):
+    input_spec = FirstLevelGLMInputSpec
+    output_spec = FirstLevelGLMOutputSpec
+
+    def _save(self, in_img, mask, values, out_file):
+        out_array = np.zeros(mask.shape, dtype=np.float32)
+        out_array[mask] = np.nan_to_num(values)
+
+        out_img = nib.Nifti1Image(out_array, in_img.affine, in_img.header)
+        out_img.header.set_data_shape(out_array.shape)
+        out_img.header.set_data_dtype(np.float32)
+        out_img.header.set_slope_inter(1, 0)
+
+        out_file = Path(out_file).resolve()
+        nib.save(out_img, out_file)
+        return str(out_file)
+
+    def _run_interface(self, runtime):
+        in_img = nib.load(self.inputs.in_file)
+        n = nvol(in_img)
+
+        mask_img = nib.load(self.inputs.mask)
+        assert nvol(mask_img) == 1
+        assert np.allclose(mask_img.affine, in_img.affine)
+        mask = np.asanyarray(mask_img.dataobj).astype(bool).reshape(in_img.shape[:3])
+
+        data = np.asanyarray(in_img.dataobj, dtype=np.float64).reshape((*in_img.shape[:3], n))
+        data = np.nan_to_num(data[mask].T, copy=False)  # time points by voxels
+        is_constant = np.all(data == data[:1], axis=0)
+        if np.any(is_constant):  # like the brightness threshold of film_gls
+            mask[mask] = np.logical_not(is_constant)
+            data = data[:, np.logical_not(is_constant)]
+
+        # design
+        confounds_df = None
+        if isdefined(self.inputs.confounds) and Path(self.inputs.confounds).read_text().strip() != "":
+            confounds_df = loadspreadsheet(self.inputs.confounds)
+            non_finite_count = np.logical_not(np.isfinite(confounds_df.values)).sum()
+            if non_finite_count > 0:
+                logging.getLogger("halfpipe").warning(
+                    f'Replacing {non_finite_count:d} non-finite values with 0 in file "{self.inputs.confounds}"'
+                )
+
+        subject_info = self.inputs.subject_info
+        design_df = make_design(
+            n, self.inputs.repetition_time,
+            subject_info.conditions, subject_info.onsets, subject_info.durations,
+            condition_units=self.inputs.condition_units,
+            confounds_df=confounds_df,
+            derivs=self.inputs.derivs,
+            high_pass_filter_cutoff=self.inputs.high_pass_filter_cutoff,
+        )
+
+        contrast_names = list()
+        contrast_rows = list()
+        for name, contrast_type, condition_names, values in self.inputs.contrasts:
+            if contrast_type.upper() != "T":
+                continue  # only t contrasts are estimated, like the tcon_file of film_gls
+            row = pd.Series(0.0, index=design_df.columns)
+            for condition_name, value in zip(condition_names, values):
+                if condition_name in row.index:
+                    row[condition_name] = value
+            contrast_names.append(str(name))
+            contrast_rows.append(row)
+        contrast_df = pd.DataFrame(contrast_rows, index=contrast_names, columns=design_df.columns)
+
+        kwargs = dict(sep="\t", na_rep="n/a")
+        design_matrix = Path.cwd() / "design_matrix.tsv"
+        design_df.to_csv(design_matrix, index=False, header=True, **kwargs)
+        contrast_matrix = Path.cwd() / "contrast_matrix.tsv"
+        contrast_df.to_csv(contrast_matrix, index=True, header=True, quoting=csv.QUOTE_NONNUMERIC, **kwargs)
+
+        # model
+        smooth = None
+        if self.inputs.smooth_autocorr and self.inputs.mask_size > 1:
+            smooth = smooth_in_mask(mask, self.inputs.mask_size)
+
+        tukey_window = self.inputs.tukey_window if isdefined(self.inputs.tukey_window) else None
+
+        result, dof, _ = film_gls(
+            data, design_df.to_numpy(dtype=np.float64), contrast_df.to_numpy(dtype=np.float64),
+            ar_order=self.inputs.ar_order,
+            ar_precision=self.inputs.ar_precision,
+            tukey_window=tukey_window,
+            smooth=smooth,
+            num_threads=self.inputs.num_threads,
+        )
+
+        self._results["design_matrix"] = str(design_matrix)
+        self._results["contrast_matrix"] = str(contrast_matrix)
+        self._results["contrast_names"] = contrast_names
+
+        for key, prefix in [("copes", "effect"), ("varcopes", "variance"), ("zstats", "z"), ("tstats", "t")]:
+            self._results[key] = [
+                self._save(in_img, mask, values, f"{prefix}_{i:d}.nii.gz")
+                for i, values in enumerate(result[prefix], start=1)
+            ]
+
+        everywhere = np.ones(mask.shape, dtype=bool)  # like MakeDofVolume
+        self._results["dof_file"] = self._save(
+            in_img, everywhere, np.full(mask.size, dof, dtype=np.float64), "dof.nii.gz"
+        )
+
+        return runtime
@@ -7,17 +7,14 @@
 import os
 from pathlib import Path
 from multiprocessing import get_context
-from contextlib import nullcontext
+from tempfile import TemporaryDirectory
 
 import numpy as np
-import pandas as pd
 import nibabel as nib
 from scipy import optimize
 
 from tqdm import tqdm
 
-from nilearn.image import new_img_like
-
 from nipype.interfaces.base import (
     traits,
     TraitedSpec,
@@ -29,7 +26,7 @@ from nipype.interfaces.base import (
 
 from ...io import parse_design
 from ..stats import DesignSpec
-from .miscmaths import t2z_convert, f2z_convert
+from .miscmaths import t2z_convert_array, f2z_convert_array
 
 ctx = get_context("forkserver")
 
@@ -98,7 +95,7 @@ def flame_stage1_onvoxel(y, z, s):
     return gam, gamcovariance
 
 
-def t_ols_contrast(mn, covariance, dof, tcontrast):
+def t_ols_contrast(mn, covariance, tcontrast):
     varcope = float(
         tcontrast @ covariance @ tcontrast.T
     )
@@ -111,17 +108,13 @@ def t_ols_contrast(mn, covariance, dof, tcontrast):
     else:
         t = cope / np.sqrt(varcope)
 
-    z = t2z_convert(t, dof)
-
-    return cope, varcope, t, z
+    return cope, varcope, t
 
 
-def f_ols_contrast(mn, covariance, dof1, dof2, fcontrast):
+def f_ols_contrast(mn, covariance, dof1, fcontrast):
     f = float(mn.T @ fcontrast.T @ np.linalg.inv(fcontrast @ covariance @ fcontrast.T) @ fcontrast @ mn / dof1)
 
-    z = f2z_convert(f, dof1, dof2)
-
-    return f, z
+    return f
 
 
 def flame1_contrast(mn, covariance, npts, cmat):
@@ -131,27 +124,21 @@ def flame1_contrast(mn, covariance, npts, cmat):
 
     if n == 1:
         tdoflower = npts - nevs
-        cope, varcope, t, z = t_ols_contrast(mn, covariance, tdoflower, cmat)
-
-        mask = np.isfinite(z)
+        cope, varcope, t = t_ols_contrast(mn, covariance, cmat)
 
-        return dict(cope=cope, var_cope=varcope, tdof=tdoflower, tstat=t, zstat=z, mask=mask)
+        return dict(cope=cope, var_cope=varcope, tdof=tdoflower, tstat=t)
 
     elif n > 1:
         fdof1 = n
 
         fdof2lower = npts - nevs
 
-        f, z = f_ols_contrast(mn, covariance, fdof1, fdof2lower, cmat)
+        f = f_ols_contrast(mn, covariance, fdof1, cmat)
 
-        mask = np.isfinite(z)
+        return dict(fstat=f, fdof1=fdof1, fdof2=fdof2lower)
 
-        return dict(fstat=f, fdof1=fdof1, fdof2=fdof2lower, zstat=z, mask=mask)
-
-
-def voxel_calc(voxel_data):
-    c, y, z, s, cmatdict = voxel_data
 
+def voxel_calc(i, y, z, s, cmatdict, voxel_results):
     npts = y.size
 
     try:
@@ -159,27 +146,456 @@ def voxel_calc(voxel_data):
     except np.linalg.LinAlgError:
         return
 
-    voxel_result = dict()
-
     for name, cmat in cmatdict.items():
         try:
             r = flame1_contrast(mn, covariance, npts, cmat)
-
-            if name not in voxel_result:
-                voxel_result[name] = dict()
-
-            voxel_result[name][c] = r
         except np.linalg.LinAlgError:
             continue
 
-    return voxel_result
+        for map_name, value in r.items():
+            voxel_results[name][map_name][i] = value
+
+
+def voxel_chunk_calc(voxel_data, start, stop):
+    """
+    run voxel_calc for a contiguous chunk of voxel indices
+    """
+    copes, var_copes, masks, design, voxels, cmatdict, voxel_results = voxel_data
+
+    for i in range(start, stop):
+        c = voxels[i]
+        m = masks[c]
+
+        y = copes[c, m][:, np.newaxis].astype(np.float64)
+        s = var_copes[c, m][:, np.newaxis].astype(np.float64)
+        z = design[m, :]
+
+        voxel_calc(i, y, z, s, cmatdict, voxel_results)
+
+    return stop - start
+
+
+worker_voxel_data = None
+
+
+def init_voxel_worker(input_paths, design, cmatdict, result_paths):
+    """
+    attach a pool worker to the memory-mapped inputs and outputs
+    """
+    global worker_voxel_data
+
+    copes, var_copes, masks, voxels = (
+        np.load(input_paths[k], mmap_mode="r") for k in ["copes", "var_copes", "masks", "voxels"]
+    )
+    voxel_results = {
+        name: {map_name: np.load(path, mmap_mode="r+") for map_name, path in paths.items()}
+        for name, paths in result_paths.items()
+    }
+
+    worker_voxel_data = copes, var_copes, masks, design, voxels, cmatdict, voxel_results
+
+
+def voxel_chunk_worker(chunk):
+    start, stop = chunk
+    return voxel_chunk_calc(worker_voxel_data, start, stop)
+
+
+def contrast_map_names(cmat):
+    n, _ = cmat.shape
+
+    if n == 1:
+        return ["cope", "var_cope", "tdof", "tstat", "zstat", "mask"]
+
+    else:
+        return ["fstat", "fdof1", "fdof2", "zstat", "mask"]
+
+
+def allocate_voxel_results(cmatdict, size, dtype=np.float64, scratch_dir=None):
+    """
+    allocate flat output arrays for all contrasts that are indexed by position
+    in the list of voxels, optionally as memory-mapped files that can be shared
+    with pool workers
+    """
+    voxel_results = dict()
+
+    for i, (name, cmat) in enumerate(cmatdict.items()):
+        voxel_results[name] = dict()
+
+        for map_name in contrast_map_names(cmat):
+            if map_name == "mask":
+                map_dtype, fill_value = np.bool_, False
+            else:
+                map_dtype, fill_value = dtype, np.nan
+
+            if scratch_dir is None:
+                arr = np.full(size, fill_value, dtype=map_dtype)
+            else:
+                arr = np.lib.format.open_memmap(
+                    Path(scratch_dir) / f"{map_name}_{i+1}.npy", mode="w+", dtype=map_dtype, shape=(size,)
+                )
+                arr[:] = fill_value
+
+            voxel_results[name][map_name] = arr
+
+    return voxel_results
+
+
+def convert_voxel_results(voxel_results):
+    """
+    convert to z statistics for whole maps at once, which is much faster than
+    converting one voxel at a time
+    """
+    for r in voxel_results.values():
+        if "tstat" in r:
+            r["zstat"] = t2z_convert_array(r["tstat"], r["tdof"])
+        else:
+            r["zstat"] = f2z_convert_array(r["fstat"], r["fdof1"], r["fdof2"])
+        r["mask"] = np.isfinite(r["zstat"])
+
+
+def write_voxel_results(voxel_results, voxels, cmatdict, shape, ref_img, dtype=np.float64):
+    """
+    scatter the flat results into volumes one map at a time, so that only one
+    volume needs to be held in memory in addition to the flat results
+    """
+    header = ref_img.header.copy()  # same as nilearn new_img_like
+    for field in ["scl_slope", "scl_inter", "glmax"]:
+        if field in header:
+            header[field] = 0.0
+    if np.dtype(dtype) == np.float32:
+        header.set_data_dtype(np.float32)
+
+    volumes = dict()
+
+    output_files = dict()
+
+    for output_name in ["copes", "var_copes", "tdof", "zstats", "tstats", "fstats", "masks"]:
+        output_files[output_name] = [False for _ in range(len(voxel_results))]
+
+    for i, contrast_name in enumerate(cmatdict.keys()):  # cmatdict is ordered
+        for map_name, values in voxel_results[contrast_name].items():
+            if map_name == "mask":
+                volume_dtype, fill_value = np.dtype(np.uint8), 0
+            else:
+                volume_dtype, fill_value = values.dtype, np.nan
+
+            if volume_dtype not in volumes:
+                volumes[volume_dtype] = np.empty(int(np.prod(shape)), dtype=volume_dtype)
+
+            volume = volumes[volume_dtype]
+            volume.fill(fill_value)
+            volume[voxels] = values
+
+            if "cal_max" in header:
+                header["cal_max"] = volume.max() if volume.size > 0 else 0.0
+            if "cal_min" in header:
+                header["cal_min"] = volume.min() if volume.size > 0 else 0.0
+
+            img = ref_img.__class__(volume.reshape(shape), ref_img.affine, header=header)
+
+            fname = Path.cwd() / f"{map_name}_{i+1}_{contrast_name}.nii.gz"
+            nib.save(img, fname)
+
+            if map_name in ["tdof"]:
+                output_name = map_name
+
+            else:
+                output_name = f"{map_name}s"
+
+            if output_name in output_files:
+                output_files[output_name][i] = fname
+
+    return output_files
+
+
+def calcgam_batched(beta, y, z, s):
+    """
+    vectorized version of calcgam for many voxels that share the same design
+
+    instead of a dense diagonal matrix, the inverse weights are kept as an
+    array of shape (voxels, points) and applied elementwise
+    """
+    weights = s + beta[:, np.newaxis]
+
+    iu = 1.0 / weights
+
+    tmp = iu[:, :, np.newaxis] * z[np.newaxis, :, :]
+    ziuz = np.swapaxes(tmp, 1, 2) @ z
+    ziuy = np.einsum("vij,vi->vj", tmp, y)
+
+    return iu, ziuz, ziuy
+
+
+def marg_posterior_energy_batched(x, y, z, s):
+    ex = np.exp(x)  # ex is variance
+
+    _, nevs = z.shape
+
+    iu, ziuz, ziuy = calcgam_batched(ex, y, z, s)
+
+    sign, ziuz_logdet = np.linalg.slogdet(ziuz)
+    singular = np.logical_not(sign > 0)
+
+    ziuz[singular] = np.eye(nevs)  # avoid linalg errors, result is discarded below
+    gam = np.linalg.solve(ziuz, ziuy[:, :, np.newaxis])[:, :, 0]
+
+    iu_logdet = np.log(iu).sum(axis=1)
+
+    ret = -(
+        0.5 * iu_logdet - 0.5 * ziuz_logdet
+        - 0.5 * ((iu * np.square(y)).sum(axis=1) - (gam * ziuy).sum(axis=1))
+    )
+
+    invalid = np.logical_or(ex < 0, np.isclose(ex, 0))
+    invalid = np.logical_or(invalid, singular)
+
+    ret[invalid] = 1e32  # very large value
+
+    return ret
+
+
+golden_ratio = (1 + np.sqrt(5)) / 2
+golden_section = 2 - golden_ratio
+
+
+def bracket_batched(func, n, xa=0.0, xb=1.0, maxiter=1000):
+    """
+    vectorized downhill search for a bracket (xa, xb, xc) with fb < fa and fb <= fc
+    starting from the same initial points as scipy.optimize.bracket
+    """
+    xa = np.full(n, xa, dtype=np.float64)
+    xb = np.full(n, xb, dtype=np.float64)
+
+    index = np.arange(n)
+    fa = func(xa, index)
+    fb = func(xb, index)
+
+    swap = fa < fb  # go downhill
+    xa[swap], xb[swap] = xb[swap], xa[swap]
+    fa[swap], fb[swap] = fb[swap], fa[swap]
+
+    xc = xb + golden_ratio * (xb - xa)
+    fc = func(xc, index)
+
+    for _ in range(maxiter):
+        index = np.flatnonzero(fc < fb)
+
+        if index.size == 0:
+            break
+
+        xa[index], fa[index] = xb[index], fb[index]
+        xb[index], fb[index] = xc[index], fc[index]
+
+        xc[index] = xb[index] + golden_ratio * (xb[index] - xa[index])
+        fc[index] = func(xc[index], index)
+
+    return xa, xb, xc, fb
+
+
+def golden_batched(func, xa, xb, xc, fb, tol=1.48e-8, maxiter=500):
+    """
+    vectorized golden section search inside the brackets found by bracket_batched
+    uses the same convergence criterion as the brent method in scipy.optimize
+    """
+    a = np.minimum(xa, xc)
+    c = np.maximum(xa, xc)
+    b = xb.copy()
+    fb = fb.copy()
+
+    for _ in range(maxiter):
+        tol1 = tol * np.abs(b) + 1e-11
+        index = np.flatnonzero((c - a) > 2 * tol1)
+
+        if index.size == 0:
+            break
+
+        ai, bi, ci = a[index], b[index], c[index]
+
+        right = (ci - bi) > (bi - ai)  # probe the larger interval
+        x = np.where(right, bi + golden_section * (ci - bi), bi - golden_section * (bi - ai))
+        fx = func(x, index)
+
+        better = fx < fb[index]
+
+        a[index] = np.where(better, np.where(right, bi, ai), np.where(right, ai, x))
+        c[index] = np.where(better, np.where(right, ci, bi), np.where(right, x, ci))
+
+        b[index] = np.where(better, x, bi)
+        fb[index] = np.where(better, fx, fb[index])
+
+    return b
+
 
+def solveforbeta_batched(y, z, s):
+    def func(x, index):
+        return marg_posterior_energy_batched(x, y[index], z, s[index])
 
-def flame1(cope_files, mask_files, regressors, contrasts, var_cope_files=None, num_threads=1):
+    n, _ = y.shape
 
-    # load data
+    xa, xb, xc, fb = bracket_batched(func, n)
+    fu = golden_batched(func, xa, xb, xc, fb)
+
+    beta = np.maximum(1e-10, np.exp(fu))
+
+    return beta
+
+
+def flame_stage1_batched(y, z, s):
+    """
+    returns the parameter estimates and their covariance for every voxel
+    as well as a boolean array indicating for which voxels these are valid
+    """
+    _, nevs = z.shape
+
+    norm = np.std(y, axis=1)
+    y = y / norm[:, np.newaxis]
+    s = s / np.square(norm)[:, np.newaxis]
+
+    assert not np.any(s < 0), "Variance needs to be non-negative"
+
+    beta = solveforbeta_batched(y, z, s)
+
+    _, ziuz, ziuy = calcgam_batched(beta, y, z, s)
+
+    sign, _ = np.linalg.slogdet(ziuz)
+    valid = sign > 0
+
+    ziuz[np.logical_not(valid)] = np.eye(nevs)
+    gamcovariance = np.linalg.inv(ziuz)
+    gam = (gamcovariance @ ziuy[:, :, np.newaxis])[:, :, 0]
+
+    gam *= norm[:, np.newaxis]
+    gamcovariance *= np.square(norm)[:, np.newaxis, np.newaxis]
+
+    return gam, gamcovariance, valid
+
+
+def flame1_contrast_batched(mn, covariance, npts, cmat):
+    nvox, nevs = mn.shape
+
+    n, _ = cmat.shape
+
+    if n == 1:
+        tdoflower = npts - nevs
+
+        (tcontrast,) = cmat
+
+        cope = mn @ tcontrast
+        varcope = np.einsum("j,vjk,k->v", tcontrast, covariance, tcontrast)
+
+        t = np.full(nvox, np.nan)  # avoid warnings
+        valid = np.logical_and(np.isfinite(cope), np.isfinite(varcope))
+        valid = np.logical_and(valid, np.logical_not(np.isclose(varcope, 0)))
+        valid[valid] = varcope[valid] > 0
+        t[valid] = cope[valid] / np.sqrt(varcope[valid])
+
+        result = dict(cope=cope, var_cope=varcope, tdof=np.full(nvox, tdoflower), tstat=t)
+
+        return result, np.ones(nvox, dtype=bool)
+
+    elif n > 1:
+        fdof1 = n
+
+        fdof2lower = npts - nevs
+
+        cmn = mn @ cmat.T
+        ccc = cmat @ covariance @ cmat.T
+
+        sign, _ = np.linalg.slogdet(ccc)
+        valid = sign != 0  # corresponds to a LinAlgError in the voxelwise code
+
+        ccc[np.logical_not(valid)] = np.eye(n)
+        f = np.einsum("vi,vi->v", cmn, np.linalg.solve(ccc, cmn[:, :, np.newaxis])[:, :, 0]) / fdof1
+
+        result = dict(fstat=f, fdof1=np.full(nvox, fdof1), fdof2=np.full(nvox, fdof2lower))
+
+        return result, valid
+
+
+def batch_calc(y, z, s, cmatdict):
+    """
+    batched equivalent of voxel_calc for voxels that share the same missing data
+    mask and therefore the same design matrix
+    """
+    _, npts = y.shape
+
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        mn, covariance, valid = flame_stage1_batched(y, z, s)
+
+        batch_result = dict()
+
+        for name, cmat in cmatdict.items():
+            r, contrast_valid = flame1_contrast_batched(mn, covariance, npts, cmat)
+
+            batch_result[name] = r, np.logical_and(valid, contrast_valid)
+
+    return batch_result
+
+
+def missing_data_groups(masks, voxels):
+    """
+    group voxels by missing data pattern, so that voxels in a group share
+    the same design matrix
+
+    returns a list of arrays of positions in voxels
+    """
+    patterns, pattern_indices = np.unique(
+        np.packbits(masks[voxels], axis=1), axis=0, return_inverse=True
+    )
+    pattern_indices = np.ravel(pattern_indices)
+
+    order = np.argsort(pattern_indices, kind="stable")
+    boundaries = np.flatnonzero(np.diff(pattern_indices[order])) + 1
+    return np.split(order, boundaries)
+
+
+def flame1_batched(
+    copes, var_copes, masks, dmat, cmatdict, shape, ref_img, max_batch_size=2 ** 22, dtype=np.float64
+):
+    nevs = dmat.columns.size
+    design = dmat.to_numpy(dtype=np.float64)
+
+    copes = copes.reshape((-1, copes.shape[-1]))
+    var_copes = var_copes.reshape((-1, var_copes.shape[-1]))
+    masks = masks.reshape((-1, masks.shape[-1]))
+
+    npts = np.count_nonzero(masks, axis=1)
+    (voxels,) = np.nonzero(npts >= nevs + 1)  # need at least one degree of freedom
+
+    # prepare outputs
+    voxel_results = allocate_voxel_results(cmatdict, voxels.size, dtype=dtype)
+
+    # run batches
+    for group in tqdm(missing_data_groups(masks, voxels), unit="patterns"):
+        m = masks[voxels[group[0]]]
+        z = design[m, :]
+
+        batch_size = max(1, max_batch_size // np.count_nonzero(m))
+        for start in range(0, group.size, batch_size):
+            batch = group[start:start + batch_size]
+            batch_voxels = voxels[batch]
+
+            y = copes[batch_voxels][:, m].astype(np.float64)
+            s = var_copes[batch_voxels][:, m].astype(np.float64)
+
+            batch_result = batch_calc(y, z, s, cmatdict)
+
+            for name, (r, valid) in batch_result.items():
+                for map_name, values in r.items():
+                    voxel_results[name][map_name][batch[valid]] = values[valid]
+
+    convert_voxel_results(voxel_results)
+
+    return write_voxel_results(voxel_results, voxels, cmatdict, shape, ref_img, dtype=dtype)
+
+
+def load_inputs(cope_files, mask_files, dmat, var_cope_files=None, dtype=np.float64):
+    """
+    read the images directly into arrays with the inputs along the last axis, and
+    exclude missing values from the masks
+    """
     cope_data = [
-        nib.load(f).get_fdata()[:, :, :, np.newaxis] for f in cope_files
+        nib.load(f).get_fdata(dtype=dtype)[:, :, :, np.newaxis] for f in cope_files
     ]
     copes = np.concatenate(cope_data, axis=3)
 
@@ -191,115 +607,106 @@ def flame1(cope_files, mask_files, regressors, contrasts, var_cope_files=None, n
 
     if var_cope_files is not None:
         var_cope_data = [
-            nib.load(f).get_fdata()[:, :, :, np.newaxis] for f in var_cope_files
+            nib.load(f).get_fdata(dtype=dtype)[:, :, :, np.newaxis] for f in var_cope_files
         ]
         var_copes = np.concatenate(var_cope_data, axis=3)
     else:
         var_copes = np.zeros_like(copes)
 
-    shape = copes[..., 0].shape
-
-    dmat, cmatdict = parse_design(regressors, contrasts)
-
-    nevs = dmat.columns.size
-
     masks = np.logical_and(masks, np.isfinite(copes))
     masks = np.logical_and(masks, np.isfinite(var_copes))
     masks = np.logical_and(masks, dmat.notna().all(axis=1))
 
-    # prepare voxelwise
-    def gen_voxel_data():
-        def ensure_row_vector(x):
-            return np.ravel(x)[:, np.newaxis]
-
-        for c in np.ndindex(*shape):
-            m = masks[c]
-            npts = np.count_nonzero(m)
-
-            if npts < nevs + 1:  # need at least one degree of freedom
-                continue
-
-            y = ensure_row_vector(copes[c][m])
-            s = ensure_row_vector(var_copes[c][m])
-            z = dmat.loc[m, :].to_numpy(dtype=np.float64)
+    return copes, var_copes, masks
 
-            yield c, y, z, s, cmatdict
 
-    prev_os_environ = os.environ.copy()
-    os.environ.update({
-        "MKL_NUM_THREADS": "1",
-        "NUMEXPR_NUM_THREADS": "1",
-        "OMP_NUM_THREADS": "1",
-    })
+def flame1(
+    cope_files, mask_files, regressors, contrasts, var_cope_files=None, num_threads=1, engine="voxelwise",
+    dtype=np.float64
+):
 
-    voxel_data = gen_voxel_data()
-    if num_threads < 2:
-        cm = nullcontext()
-        it = map(voxel_calc, voxel_data)
-    else:
-        cm = ctx.Pool(processes=num_threads)
-        it = cm.imap_unordered(voxel_calc, voxel_data)
+    dmat, cmatdict = parse_design(regressors, contrasts)
 
-    # run voxelwise
-    voxel_results = dict()
-    with cm:
-        for x in tqdm(it, unit="voxels"):
-            if x is None:
-                continue
+    nevs = dmat.columns.size
 
-            for k, v in x.items():
-                if k not in voxel_results:
-                    voxel_results[k] = dict()
+    copes, var_copes, masks = load_inputs(cope_files, mask_files, dmat, var_cope_files=var_cope_files, dtype=dtype)
 
-                voxel_results[k].update(v)
+    shape = copes[..., 0].shape
 
-    os.environ.update(prev_os_environ)
+    ref_img = nib.load(cope_files[0])
 
-    output_files = dict()
+    if engine == "batched":
+        return flame1_batched(copes, var_copes, masks, dmat, cmatdict, shape, ref_img, dtype=dtype)
 
-    # write outputs
-    for output_name in ["copes", "var_copes", "tdof", "zstats", "tstats", "fstats", "masks"]:
-        output_files[output_name] = [False for _ in range(len(voxel_results))]
+    elif engine != "voxelwise":
+        raise ValueError(f'Unknown FLAME1 engine "{engine}"')
 
-    ref_img = nib.load(cope_files[0])
+    # prepare voxelwise
+    design = dmat.to_numpy(dtype=np.float64)
 
-    for i, contrast_name in enumerate(cmatdict.keys()):  # cmatdict is ordered
-        contrast_results = voxel_results[contrast_name]
+    copes = copes.reshape((-1, copes.shape[-1]))
+    var_copes = var_copes.reshape((-1, var_copes.shape[-1]))
+    masks = masks.reshape((-1, masks.shape[-1]))
 
-        rdf = pd.DataFrame.from_records(contrast_results)
+    npts = np.count_nonzero(masks, axis=1)
+    (voxels,) = np.nonzero(npts >= nevs + 1)  # need at least one degree of freedom
 
-        if "mask" not in rdf.index:  # ensure that we always output a mask
-            rdf = rdf.append(pd.Series(data=False, index=rdf.columns, name="mask"))
+    if num_threads < 2:
+        voxel_results = allocate_voxel_results(cmatdict, voxels.size, dtype=dtype)
+        voxel_data = copes, var_copes, masks, design, voxels, cmatdict, voxel_results
 
-        if "zstat" not in rdf.index:  # ensure that we always output a zstat
-            rdf = rdf.append(pd.Series(data=np.nan, index=rdf.columns, name="zstat"))
+        for start in tqdm(range(voxels.size), unit="voxels"):
+            voxel_chunk_calc(voxel_data, start, start + 1)
 
-        for map_name, series in rdf.iterrows():
-            coordinates = series.index.tolist()
-            values = series.values
+        convert_voxel_results(voxel_results)
 
-            if map_name == "mask":
-                arr = np.zeros(shape, dtype=np.bool)
+        return write_voxel_results(voxel_results, voxels, cmatdict, shape, ref_img, dtype=dtype)
 
-            else:
-                arr = np.full(shape, np.nan)
+    prev_os_environ = os.environ.copy()
+    os.environ.update({
+        "MKL_NUM_THREADS": "1",
+        "NUMEXPR_NUM_THREADS": "1",
+        "OMP_NUM_THREADS": "1",
+    })
 
-            if len(coordinates) > 0:
-                arr[(*zip(*coordinates),)] = values
+    with TemporaryDirectory() as scratch_dir:
+        # place the inputs and outputs in memory-mapped files once, so that
+        # workers only need to receive voxel index ranges
+        input_paths = dict()
+        for name, arr in [("copes", copes), ("var_copes", var_copes), ("masks", masks), ("voxels", voxels)]:
+            input_paths[name] = Path(scratch_dir) / f"{name}.npy"
+            np.save(input_paths[name], arr)
+
+        voxel_results = allocate_voxel_results(cmatdict, voxels.size, dtype=dtype, scratch_dir=scratch_dir)
+        result_paths = {
+            name: {map_name: arr.filename for map_name, arr in r.items()}
+            for name, r in voxel_results.items()
+        }
+
+        # use a few chunks per worker for load balancing
+        chunk_size = max(1, min(1024, -(-voxels.size // (8 * num_threads))))
+        chunks = [
+            (start, min(start + chunk_size, voxels.size))
+            for start in range(0, voxels.size, chunk_size)
+        ]
 
-            img = new_img_like(ref_img, arr, copy_header=True)
+        # run voxelwise
+        with ctx.Pool(
+            processes=num_threads,
+            initializer=init_voxel_worker,
+            initargs=(input_paths, design, cmatdict, result_paths),
+        ) as pool:
+            with tqdm(total=voxels.size, unit="voxels") as progress_bar:
+                for n in pool.imap_unordered(voxel_chunk_worker, chunks):
+                    progress_bar.update(n)
 
-            fname = Path.cwd() / f"{map_name}_{i+1}_{contrast_name}.nii.gz"
-            nib.save(img, fname)
+        os.environ.update(prev_os_environ)
 
-            if map_name in ["tdof"]:
-                output_name = map_name
+        convert_voxel_results(voxel_results)
 
-            else:
-                output_name = f"{map_name}s"
+        output_files = write_voxel_results(voxel_results, voxels, cmatdict, shape, ref_img, dtype=dtype)
 
-            if output_name in output_files:
-                output_files[output_name][i] = fname
+        del voxel_results  # release the memory maps before cleanup
 
     return output_files
 
@@ -319,6 +726,8 @@ class FLAME1InputSpec(DesignSpec):
     )
 
     num_threads = traits.Int(1, usedefault=True)
+    engine = traits.Enum("voxelwise", "batched", usedefault=True)
+    dtype = traits.Enum("float64", "float32", usedefault=True, desc="precision of input arrays and output images")
 
 
 class FLAME1OutputSpec(TraitedSpec):
@@ -363,6 +772,8 @@ class FLAME1(SimpleInterface):
                 regressors=self.inputs.regressors,
                 contrasts=self.inputs.contrasts,
                 num_threads=self.inputs.num_threads,
+                engine=self.inputs.engine,
+                dtype=np.dtype(self.inputs.dtype),
             )
         )
 
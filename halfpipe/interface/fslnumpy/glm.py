@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""
+Ordinary least squares with a single QR decomposition of the design for all voxels,
+and dual regression as two such models, like in fsl_glm and dual_regression
+"""
+
+import csv
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import nibabel as nib
+
+from nipype.interfaces.base import (
+    traits,
+    TraitedSpec,
+    isdefined,
+    File,
+    InputMultiPath,
+    SimpleInterface
+)
+
+from ...io import loadspreadsheet
+from ...utils import nvol
+from .miscmaths import t2z_convert_array
+
+block_nbytes = 2 ** 26  # size of the blocks of voxels that are processed at once
+
+
+class OLS:
+    """
+    least squares fit of design x (observations by regressors) to data y (observations
+    by voxels), where the mean of the columns is removed like fsl_glm --demean
+    """
+
+    def __init__(self, x, demean=True):
+        x = np.asarray(x, dtype=np.float64)
+        if demean:
+            x = x - x.mean(axis=0)
+        self.x = x
+        self.demean = demean
+
+        n, p = x.shape
+
+        q, r = np.linalg.qr(x)
+        self.q = q
+        self.r_pinv = np.linalg.pinv(r)  # also works for rank deficient designs
+        self.rank = np.linalg.matrix_rank(r)
+        self.dof = n - self.rank
+
+        self.xtx_inv = self.r_pinv @ self.r_pinv.T  # unscaled covariance of the estimates
+
+    def fit(self, y, y_mean=None):
+        """
+        y may be a view or have a lower precision, as it is never modified or copied whole
+        """
+        n, v = y.shape
+        if self.demean and y_mean is None:
+            y_mean = y.mean(axis=0, dtype=np.float64)
+
+        beta = np.empty((self.x.shape[1], v))
+        residual_ss = np.empty(v)
+
+        block_size = max(1, block_nbytes // (n * 8))
+        for start in range(0, v, block_size):
+            stop = min(v, start + block_size)
+            y_block = np.asarray(y[:, start:stop], dtype=np.float64)
+            if self.demean:
+                y_block = y_block - y_mean[start:stop]
+
+            beta_block = self.r_pinv @ (self.q.T @ y_block)
+            residuals = y_block - self.x @ beta_block
+
+            beta[:, start:stop] = beta_block
+            residual_ss[start:stop] = np.einsum("ij,ij->j", residuals, residuals)
+
+        return beta, residual_ss
+
+    def t_contrasts(self, beta, residual_ss, contrasts):
+        """
+        contrasts are one per row, returns cope, varcope, t and z with one row
+        per contrast
+        """
+        contrasts = np.atleast_2d(contrasts)
+
+        sigmasq = residual_ss / self.dof if self.dof > 0 else np.full(residual_ss.shape, np.nan)
+
+        cope = contrasts @ beta
+        varcope = np.einsum("ij,jk,ik->i", contrasts, self.xtx_inv, contrasts)[:, np.newaxis] * sigmasq
+
+        t = np.full(cope.shape, np.nan)
+        np.divide(cope, np.sqrt(varcope), out=t, where=varcope > 0)
+        z = t2z_convert_array(t, self.dof)
+
+        return cope, varcope, t, z
+
+
+def dual_regression(data, maps, confounds=None):
+    """
+    data is time points by voxels, maps are voxels by components and confounds are time
+    points by regressors
+
+    returns the time series of the components and the results of the temporal regression
+    """
+    # the spatial regression of the maps on each volume
+    spatial = OLS(maps)
+    timeseries, _ = spatial.fit(data.T)
+    timeseries = timeseries.T
+
+    # the temporal regression of the time series and the confounds on each voxel
+    design = timeseries
+    if confounds is not None and confounds.size > 0:
+        design = np.hstack([timeseries, confounds])
+    _, m = timeseries.shape
+
+    temporal = OLS(design)
+    beta, residual_ss = temporal.fit(data)
+
+    contrasts = np.eye(m, design.shape[1])
+    cope, varcope, t, z = temporal.t_contrasts(beta, residual_ss, contrasts)
+
+    return timeseries, dict(effect=cope, variance=varcope, t=t, z=z, dof=temporal.dof)
+
+
+class DualRegressionInputSpec(TraitedSpec):
+    in_file = File(desc="input dataset", exists=True, mandatory=True)
+    mask = File(desc="mask of voxels to include", exists=True, mandatory=True)
+    map_files = InputMultiPath(File(exists=True), desc="one or more images of component maps", mandatory=True)
+    confounds = File(desc="table of confounds for the temporal regression", exists=True)
+
+    dtype = traits.Enum("float64", "float32", usedefault=True, desc="precision of the time series")
+
+
+class DualRegressionOutputSpec(TraitedSpec):
+    design_matrix = traits.List(File(exists=True), desc="design of the temporal regression for each map file")
+    contrast_matrix = traits.List(File(exists=True), desc="contrasts for each map file")
+    component_names = traits.List(traits.List(traits.Str()))
+    effect = traits.List(traits.List(File(exists=True)))
+    variance = traits.List(traits.List(File(exists=True)))
+    z = traits.List(traits.List(File(exists=True)))
+    dof = traits.List(File(exists=True))
+
+
+class DualRegression(SimpleInterface):
+    """
+    the image is read once for any number of map files
+    """
+
+    input_spec = DualRegressionInputSpec
+    output_spec = DualRegressionOutputSpec
+
+    def _load_confounds(self):
+        if not isdefined(self.inputs.confounds):
+            return None
+        if Path(self.inputs.confounds).read_text().strip() == "":
+            return None  # no columns were selected
+
+        confounds_df = loadspreadsheet(self.inputs.confounds)
+        if confounds_df.size == 0:
+            return None
+
+        non_finite_count = np.logical_not(np.isfinite(confounds_df.values)).sum()
+        if non_finite_count > 0:
+            logging.getLogger("halfpipe").warning(
+                f'Replacing {non_finite_count:d} non-finite values with 0 in file "{self.inputs.confounds}"'
+            )
+
+        return confounds_df
+
+    def _save(self, in_img, mask, values, out_file):
+        out_array = np.zeros(mask.shape, dtype=np.float32)
+        out_array[mask] = values
+
+        out_img = nib.Nifti1Image(out_array, in_img.affine, in_img.header)
+        out_img.header.set_data_shape(out_array.shape)
+        out_img.header.set_data_dtype(np.float32)
+        out_img.header.set_slope_inter(1, 0)
+
+        out_file = Path(out_file).resolve()
+        nib.save(out_img, out_file)
+        return str(out_file)
+
+    def _run_interface(self, runtime):
+        in_img = nib.load(self.inputs.in_file)
+
+        mask_img = nib.load(self.inputs.mask)
+        assert nvol(mask_img) == 1
+        assert np.allclose(mask_img.affine, in_img.affine)
+        mask = np.asanyarray(mask_img.dataobj).astype(bool).reshape(in_img.shape[:3])
+
+        data = np.asanyarray(in_img.dataobj, dtype=self.inputs.dtype)
+        data = data.reshape((*in_img.shape[:3], -1))[mask].T  # time points by voxels
+        data = np.nan_to_num(data, copy=False)
+
+        confounds_df = self._load_confounds()
+        confounds = None
+        if confounds_df is not None:
+            confounds = np.nan_to_num(confounds_df.to_numpy(dtype=np.float64), posinf=0.0, neginf=0.0)
+
+        kwargs = dict(sep="\t", na_rep="n/a")
+
+        for key in ["design_matrix", "contrast_matrix", "component_names", "effect", "variance", "z", "dof"]:
+            self._results[key] = list()
+
+        for i, map_file in enumerate(self.inputs.map_files, start=1):
+            map_img = nib.load(map_file)
+            assert map_img.shape[:3] == in_img.shape[:3]
+            maps = np.asanyarray(map_img.dataobj, dtype=np.float64)
+            maps = np.nan_to_num(maps.reshape((*map_img.shape[:3], -1))[mask], copy=False)
+
+            timeseries, stats = dual_regression(data, maps, confounds)
+            _, m = timeseries.shape
+
+            leading_zeros = int(np.ceil(np.log10(m)))
+            component_names = [f"{j:0{leading_zeros}d}" for j in range(1, m + 1)]
+
+            design_df = pd.DataFrame(timeseries, columns=component_names)
+            if confounds_df is not None:
+                design_df = pd.concat([design_df, confounds_df.reset_index(drop=True)], axis=1)
+            design_matrix = Path.cwd() / f"design_matrix_{i:d}.tsv"
+            design_df.to_csv(design_matrix, index=False, header=True, **kwargs)
+
+            contrast_df = pd.DataFrame(
+                np.eye(m, design_df.shape[1]), index=component_names, columns=design_df.columns
+            )
+            contrast_matrix = Path.cwd() / f"contrast_matrix_{i:d}.tsv"
+            contrast_df.to_csv(
+                contrast_matrix, index=True, header=True, quoting=csv.QUOTE_NONNUMERIC, **kwargs
+            )
+
+            self._results["design_matrix"].append(str(design_matrix))
+            self._results["contrast_matrix"].append(str(contrast_matrix))
+            self._results["component_names"].append(component_names)
+
+            for key in ["effect", "variance", "z"]:
+                self._results[key].append(
+                    [
+                        self._save(in_img, mask, values, f"{key}_{i:d}_{component_name}.nii.gz")
+                        for values, component_name in zip(stats[key], component_names)
+                    ]
+                )
+
+            everywhere = np.ones(mask.shape, dtype=bool)  # like MakeDofVolume
+            dof = np.full(mask.size, stats["dof"], dtype=np.float64)
+            self._results["dof"].append(self._save(in_img, everywhere, dof, f"dof_{i:d}.nii.gz"))
+
+        return runtime
@@ -8,6 +8,9 @@ import math
 import logging
 from pprint import pformat
 
+import numpy as np
+from scipy import special
+
 from mpmath import mpf, workdps, sqrt, erfinv, gamma, hyper, pi, power, betainc
 
 logger = logging.getLogger("halfpipe")
@@ -95,3 +98,88 @@ def f2z_convert(x, d1, d2):
     )
 
     return z
+
+
+def _fallback(func, z, where, *args):
+    """
+    run the scalar adaptive precision code only where float64 is not sufficient
+    """
+    for i in map(tuple, np.argwhere(where)):  # also works for 0-d arrays
+        z[i] = func(*(float(a[i]) for a in args))
+
+
+def t2z_convert_array(t, nu):
+    """
+    vectorized version of t2z_convert that computes the tail probability in
+    float64 and only falls back to mpmath for elements where it underflows
+    """
+    t, nu = np.broadcast_arrays(
+        np.asarray(t, dtype=np.float64), np.asarray(nu, dtype=np.float64)
+    )
+
+    z = np.full(t.shape, np.nan)
+
+    with np.errstate(invalid="ignore"):
+        finite = np.isfinite(t) & np.isfinite(nu)
+        infinite = np.isinf(t) & np.logical_not(np.isnan(nu))
+
+    z[infinite] = t[infinite]
+
+    # use the smaller tail for precision, and symmetry for the sign
+    p = special.stdtr(nu[finite], -np.abs(t[finite]))
+    zf = -np.sign(t[finite]) * special.ndtri(p)
+
+    underflow = np.zeros(t.shape, dtype=bool)
+    underflow[finite] = p < np.finfo(np.float64).tiny
+
+    z[finite] = zf
+    _fallback(t2z_convert, z, underflow, t, nu)
+
+    if z.ndim == 0:
+        return float(z)
+    return z
+
+
+def f2z_convert_array(x, d1, d2):
+    """
+    vectorized version of f2z_convert that computes the cumulative distribution
+    function or its complement in float64 and only falls back to mpmath for
+    elements where these underflow
+    """
+    x, d1, d2 = np.broadcast_arrays(
+        np.asarray(x, dtype=np.float64),
+        np.asarray(d1, dtype=np.float64),
+        np.asarray(d2, dtype=np.float64),
+    )
+
+    z = np.full(x.shape, np.nan)
+
+    with np.errstate(invalid="ignore"):
+        isnan = np.isnan(x) | np.isnan(d1) | np.isnan(d2)
+        infinite = np.isinf(x) & np.logical_not(isnan)
+        outside = (x < 0) | (d1 < 0) | (d2 < 0)
+        outside &= np.logical_not(isnan | infinite)
+        finite = np.logical_not(isnan | infinite | outside)
+
+    z[infinite] = x[infinite]
+    z[outside] = 0.0
+
+    xf, d1f, d2f = x[finite], d1[finite], d2[finite]
+
+    # use the smaller tail for precision
+    cdf = special.fdtr(d1f, d2f, xf)
+    sf = special.fdtrc(d1f, d2f, xf)
+
+    lower = cdf < sf
+    p = np.where(lower, cdf, sf)
+    zf = np.where(lower, special.ndtri(p), -special.ndtri(p))
+
+    underflow = np.zeros(x.shape, dtype=bool)
+    underflow[finite] = (p < np.finfo(np.float64).tiny) & (xf > 0)
+
+    z[finite] = zf
+    _fallback(f2z_convert, z, underflow, x, d1, d2)
+
+    if z.ndim == 0:
+        return float(z)
+    return z
@@ -36,7 +36,7 @@ def regfilt(array, design, comps, calculate_mask=True, aggressive=False):
 
     data = array.copy()
     if calculate_mask is True:
-        mean = data.mean(axis=0)
+        mean = data.mean(axis=0, dtype=np.float64)
         mmin = mean.min()
         mmax = mean.max()
         mask = binarise(mean, mmin + 0.01 * (mmax - mmin), mmax)
@@ -45,7 +45,7 @@ def regfilt(array, design, comps, calculate_mask=True, aggressive=False):
 
     m, n = data.shape
 
-    mean_r = data.mean(axis=0)
+    mean_r = data.mean(axis=0, dtype=np.float64)
     data -= mean_r[None, :]
     mean_c = design.mean(axis=0)
     design -= mean_c[None, :]
@@ -93,6 +93,11 @@ class FilterRegressor(Transformer):
 
     suffix = "regfilt"
 
+    @property
+    def voxel_separable(self):
+        # the automatic mask is calculated from all voxels
+        return not (isdefined(self.inputs.mask) and self.inputs.mask is True)
+
     def _transform(self, array):
         design = np.loadtxt(self.inputs.design_file, dtype=np.float64, ndmin=2)
 
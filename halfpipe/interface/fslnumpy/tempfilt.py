@@ -5,6 +5,7 @@
 """
 
 import numpy as np
+from scipy import ndimage, signal
 
 from nipype.interfaces.base import (
     traits
@@ -12,90 +13,88 @@ from nipype.interfaces.base import (
 
 from ..transformer import Transformer, TransformerInputSpec
 
+block_nbytes = 2 ** 22  # process voxels in blocks that fit in the cache
 
-def bandpass_temporal_filter(array, hp_sigma, lp_sigma):
+
+def gaussian_kernel(sigma, mask_size):
+    t = np.arange(-mask_size, mask_size + 1, dtype=np.float64)
+    return np.exp(-0.5 * np.square(t) / (sigma * sigma)), t
+
+
+def correlate(array, weights, method):
     """
-    numpy translation of fsl newimagefuns.h bandpass_temporal_filter
+    correlate along the time axis with zero padding, which corresponds to
+    truncating the kernel at the edges of the time series
     """
+    if method == "fft":
+        return signal.fftconvolve(array, weights[np.newaxis, ::-1].astype(array.dtype), mode="same", axes=1)
 
-    if hp_sigma <= 0:
-        hp_mask_size_minus = 0
-    else:
-        hp_mask_size_minus = int(np.floor(hp_sigma * 3))
+    elif method == "direct":
+        return ndimage.correlate1d(array, weights, axis=1, mode="constant", cval=0.0)
 
-    hp_mask_size_plus = hp_mask_size_minus
+    raise ValueError(f'Unknown method "{method}"')
 
-    if lp_sigma <= 0:
-        lp_mask_size_minus = 0
-    else:
-        lp_mask_size_minus = int(np.floor(lp_sigma * 20)) + 2
 
-    lp_mask_size_plus = lp_mask_size_minus
+def bandpass_temporal_filter(array, hp_sigma, lp_sigma, method="fft", dtype=None):
+    """
+    numpy translation of fsl newimagefuns.h bandpass_temporal_filter
 
-    if hp_sigma > 0:
-        hp_exp = np.zeros(hp_mask_size_minus + hp_mask_size_plus + 1)
-        for t in range(-hp_mask_size_minus, hp_mask_size_plus + 1):
-            hp_exp[t] = np.exp(-0.5 * (float(t * t)) / (hp_sigma * hp_sigma))
+    the kernel sums are computed as correlations over the whole time axis,
+    so the cost per voxel no longer depends on a python loop over time points.
+    edge handling is the same as in fsl, where the kernel is truncated at the
+    start and end of the time series. method "direct" sums the truncated kernel
+    directly, whereas "fft" uses fft convolution, which is faster for wide
+    kernels but differs from fsl by floating point rounding
+    """
 
-    if lp_sigma > 0:
-        total = 0.0
-        lp_exp = np.zeros(lp_mask_size_minus + lp_mask_size_plus + 1)
-        for t in range(-lp_mask_size_minus, lp_mask_size_plus + 1):
-            lp_exp[t] = np.exp(-0.5 * (float(t * t)) / (lp_sigma * lp_sigma))
-            total += lp_exp[t]
-        for t in range(-lp_mask_size_minus, lp_mask_size_plus + 1):
-            lp_exp[t] /= total
+    if dtype is not None and np.dtype(dtype) != array.dtype:
+        array = array.astype(dtype)
 
     m, sourcetsize = array.shape
-    array2 = np.zeros_like(array)
 
     if hp_sigma > 0:
-        c0 = None
-        for t in range(sourcetsize):
-
-            A = 0
-            B = np.zeros((m,), dtype=array.dtype)
-            C = 0
-            D = np.zeros((m,), dtype=array.dtype)
-            N = 0
-
-            for tt in range(max(t - hp_mask_size_minus, 0), min(t + hp_mask_size_plus, sourcetsize - 1) + 1):
-                dt = tt - t
-                w = hp_exp[dt]
-                A += w * dt
-                B += w * array[:, tt]
-                C += w * dt * dt
-                D += w * dt * array[:, tt]
-                N += w
-
-            tmpdenom = C * N - A * A
-            if not np.isclose(tmpdenom, 0):
-                c = (B * C - A * D) / tmpdenom
-                if c0 is None:
-                    c0 = c
-                array2[:, t] = c0 + array[:, t] - c
-            else:
-                array2[:, t] = array[:, t]
-
-        array2 -= array2.mean(axis=1)[:, None]
-
-        np.copyto(array, array2)  # destination, then source
+        hp_mask_size = int(np.floor(hp_sigma * 3))
+        hp_exp, dt = gaussian_kernel(hp_sigma, hp_mask_size)
+
+        # the local linear fit only depends on the voxel data through B and D,
+        # the other sums only depend on the truncation at the edges
+        ones = np.ones((1, sourcetsize))
+        A = correlate(ones, hp_exp * dt, "direct")[0]
+        C = correlate(ones, hp_exp * dt * dt, "direct")[0]
+        N = correlate(ones, hp_exp, "direct")[0]
+
+        tmpdenom = C * N - A * A
+        valid = np.logical_not(np.isclose(tmpdenom, 0))
+        (valid_indices,) = np.nonzero(valid)
 
     if lp_sigma > 0:
-        for t in range(sourcetsize):
-            total = np.zeros((m,), dtype=array.dtype)
-            sum = 0
+        lp_mask_size = int(np.floor(lp_sigma * 20)) + 2
+        lp_exp, _ = gaussian_kernel(lp_sigma, lp_mask_size)
+        lp_exp /= lp_exp.sum()
+
+        ones = np.ones((1, sourcetsize))
+        lp_sum = correlate(ones, lp_exp, "direct")[0]
+        lp_sum[lp_sum <= 0] = 1
+
+    block_size = max(1, block_nbytes // (sourcetsize * array.itemsize))
 
-            for tt in range(max(t - lp_mask_size_minus, 0), min(t + lp_mask_size_plus, sourcetsize - 1) + 1):
-                total += array[:, tt] * lp_exp[tt - t]
-                sum += lp_exp[tt - t]
+    for start in range(0, m, block_size):
+        block = array[start:start + block_size]
 
-            if sum > 0:
-                array2[:, t] = total / sum
-            else:
-                array2[:, t] = total
+        if hp_sigma > 0 and valid_indices.size > 0:
+            B = correlate(block, hp_exp, method)
+            D = correlate(block, hp_exp * dt, method)
 
-        np.copyto(array, array2)
+            c = (B[:, valid] * C[valid] - A[valid] * D[:, valid]) / tmpdenom[valid]
+            c0 = c[:, :1]  # the first valid time point
+
+            block[:, valid] += c0 - c
+
+        if hp_sigma > 0:
+            block -= block.mean(axis=1, dtype=np.float64)[:, np.newaxis]
+
+        if lp_sigma > 0:
+            block[:] = correlate(block, lp_exp, method) / lp_sum
 
     return array
 
@@ -110,6 +109,8 @@ class TemporalFilter(Transformer):
 
     suffix = "bptf"
 
+    voxel_separable = True
+
     def _transform(self, array):
         lowpass_sigma = self.inputs.lowpass_sigma
         highpass_sigma = self.inputs.highpass_sigma
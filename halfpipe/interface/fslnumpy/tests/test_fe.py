@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""
+"""
+
+import os
+
+import pytest
+
+import numpy as np
+import nibabel as nib
+from scipy import stats
+
+from ..fe import FixedEffects, fe_batched, ols_batched
+
+
+def test_ols_batched():
+    rng = np.random.default_rng(0x01a)
+    z = np.hstack([np.ones((20, 1)), rng.normal(size=(20, 2))])
+    y = rng.normal(size=(30, 20))
+
+    mn, covariance, valid = ols_batched(y, z)
+    assert np.all(valid)
+
+    for i in range(y.shape[0]):
+        beta, residual_ss, _, _ = np.linalg.lstsq(z, y[i], rcond=None)
+        assert np.allclose(mn[i], beta)
+        assert np.allclose(covariance[i], np.linalg.inv(z.T @ z) * residual_ss / (20 - 3))
+
+    _, _, valid = ols_batched(y, np.hstack([z, z[:, :1]]))
+    assert not np.any(valid)
+
+
+def test_fe_batched():
+    rng = np.random.default_rng(0xfe0)
+    z = np.hstack([np.ones((20, 1)), rng.normal(size=(20, 1))])
+    y = rng.normal(size=(30, 20))
+    s = rng.uniform(0.5, 2, size=(30, 20))
+
+    mn, covariance, valid = fe_batched(y, z, s)
+    assert np.all(valid)
+
+    for i in range(y.shape[0]):
+        w = np.diag(1 / s[i])
+        expected_covariance = np.linalg.inv(z.T @ w @ z)
+        assert np.allclose(covariance[i], expected_covariance)
+        assert np.allclose(mn[i], expected_covariance @ z.T @ w @ y[i])
+
+
+@pytest.mark.parametrize("use_var_cope", [False, True])
+def test_FixedEffects(tmp_path, use_var_cope):
+    os.chdir(str(tmp_path))
+
+    rng = np.random.default_rng(0xfe1)
+    shape, n = (5, 6, 7), 12
+
+    regressors = dict(intercept=[1.0] * n, age=list(rng.normal(size=n)))
+    regressors["age"][3] = np.nan  # missing for one input everywhere
+    contrasts = [
+        ("intercept", "T", ["intercept", "age"], [1.0, 0.0]),
+        ("age", "T", ["intercept", "age"], [0.0, 1.0]),
+        ("both", "F", [
+            ("both_intercept", "T", ["intercept", "age"], [1.0, 0.0]),
+            ("both_age", "T", ["intercept", "age"], [0.0, 1.0]),
+        ]),
+    ]
+
+    affine = np.eye(4)
+    cope_files, var_cope_files, mask_files = list(), list(), list()
+    copes = rng.normal(loc=1, size=(*shape, n))
+    var_copes = rng.uniform(0.5, 2, size=(*shape, n))
+    masks = rng.uniform(size=(*shape, n)) > 0.1  # missing data differs between voxels
+    masks[0, 0, 0, :] = False
+    for i in range(n):
+        for prefix, files, data in [
+            ("cope", cope_files, copes), ("varcope", var_cope_files, var_copes), ("mask", mask_files, masks)
+        ]:
+            files.append(f"{prefix}_{i:d}.nii.gz")
+            nib.Nifti1Image(data[..., i].astype(np.float64), affine).to_filename(files[-1])
+
+    instance = FixedEffects(
+        cope_files=cope_files, mask_files=mask_files, regressors=regressors, contrasts=contrasts
+    )
+    if use_var_cope:
+        instance.inputs.var_cope_files = var_cope_files
+    result = instance.run()
+    outputs = result.outputs
+
+    assert len(outputs.zstats) == 3
+    assert outputs.fstats[0] is False and outputs.copes[2] is False
+
+    cope = nib.load(outputs.copes[1]).get_fdata()
+    var_cope = nib.load(outputs.var_copes[1]).get_fdata()
+    z = nib.load(outputs.zstats[1]).get_fdata()
+    fz = nib.load(outputs.zstats[2]).get_fdata()
+    mask = nib.load(outputs.masks[1]).get_fdata().astype(bool)
+
+    assert not mask[0, 0, 0]
+    assert np.all(np.isnan(cope[~mask]))
+
+    design = np.column_stack([regressors["intercept"], regressors["age"]])
+    for index in zip(*np.nonzero(mask)):
+        m = masks[index].copy()
+        m[3] = False
+        x, y = design[m], copes[index][m]
+
+        dof = np.count_nonzero(m) - 2
+        if use_var_cope:
+            w = np.diag(1 / var_copes[index][m])
+            covariance = np.linalg.inv(x.T @ w @ x)
+            beta = covariance @ x.T @ w @ y
+        else:
+            beta, residual_ss, _, _ = np.linalg.lstsq(x, y, rcond=None)
+            covariance = np.linalg.inv(x.T @ x) * residual_ss / dof
+
+        assert np.isclose(cope[index], beta[1])
+        assert np.isclose(var_cope[index], covariance[1, 1])
+
+        t = beta[1] / np.sqrt(covariance[1, 1])
+        assert np.isclose(z[index], stats.norm.isf(stats.t.sf(t, dof)), atol=1e-4)
+
+        f = beta @ np.linalg.inv(covariance) @ beta / 2
+        assert np.isclose(fz[index], stats.norm.isf(stats.f.sf(f, 2, dof)), atol=1e-4)
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""
+"""
+
+import logging
+import os
+from shutil import which
+from time import time
+
+import pytest
+
+import numpy as np
+import pandas as pd
+import nibabel as nib
+from scipy import linalg
+
+from nipype.interfaces.base import Bunch
+from nipype.interfaces import fsl
+import nipype.algorithms.modelgen as model
+
+from ..film import FirstLevelGLM, Whitener, film_gls, make_design
+
+
+def ar_covariance(phi, n):
+    """
+    reference covariance of an autoregressive process with unit variance, from the
+    autocorrelation recursion
+    """
+    p = len(phi)
+    rho = np.zeros(n)
+    rho[:p + 1] = Whitener._autocorrelation(np.asarray(phi))
+    for k in range(p + 1, n):
+        rho[k] = sum(phi[j] * rho[k - j - 1] for j in range(p))
+    return linalg.toeplitz(rho)
+
+
+def simulate_ar(rng, phi, n, v):
+    p = len(phi)
+    noise = rng.normal(size=(n + 100, v))
+    for t in range(p, n + 100):
+        for j in range(p):
+            noise[t] += phi[j] * noise[t - j - 1]
+    return noise[100:]
+
+
+@pytest.mark.parametrize("phi", [[0.4], [0.5, -0.2], [0.3, 0.1, 0.05]])
+def test_whitener(phi):
+    n = 30
+    covariance = ar_covariance(phi, n)
+
+    whitener = Whitener(np.asarray(phi))
+    assert np.allclose(whitener.phi, phi)
+
+    w = whitener.apply(np.eye(n))
+    whitened = w @ covariance @ w.T
+    assert np.allclose(whitened, np.eye(n) * whitened[0, 0])
+
+
+def test_make_design():
+    repetition_time = 2.0
+    n = 120
+
+    conditions = ["a", "b"]
+    onsets = [[10.0, 90.0, 170.0], [50.0, 130.0]]
+    durations = [[30.0], [20.0, 20.0]]
+    durations[0] *= 3
+
+    confounds_df = pd.DataFrame(dict(c=np.linspace(-1, 1, n)))
+
+    design_df = make_design(
+        n, repetition_time, conditions, onsets, durations, confounds_df=confounds_df, derivs=True
+    )
+    assert list(design_df.columns) == ["a", "aTD", "b", "bTD", "c"]
+    assert np.allclose(design_df.mean(), 0)
+
+    a = design_df["a"].to_numpy()
+    assert np.isclose(a[19] - a[0], 1, atol=0.02)  # long blocks reach the plateau
+    assert np.isclose(a @ design_df["aTD"].to_numpy(), 0)
+
+    # the high pass filter removes the linear trend
+    design_df = make_design(
+        n, repetition_time, conditions, onsets, durations, confounds_df=confounds_df, high_pass_filter_cutoff=50.0
+    )
+    assert np.abs(design_df["c"]).max() < 0.5
+
+
+def test_film_gls():
+    rng = np.random.default_rng(0xf11)
+
+    n, v = 200, 400
+    design_df = make_design(n, 2.0, ["a"], [np.arange(10, 400, 40)], [[20.0]])
+    design = design_df.to_numpy()
+
+    data = simulate_ar(rng, [0.3], n, v) + design @ rng.normal(size=(1, v)) + 100
+
+    contrasts = np.array([[1.0]])
+    result, dof, phi = film_gls(data, design, contrasts, ar_order=1, tukey_window=1000)
+    assert dof == n - 1
+    assert np.isclose(np.mean(phi), 0.3, atol=0.05)
+
+    # generalized least squares with the quantised parameters of each voxel
+    for i in range(0, v, 40):
+        (a,) = phi[i]  # the inverse covariance of an ar(1) process is tridiagonal
+        covariance_inv = (
+            np.diag(np.r_[1, np.full(n - 2, 1 + a * a), 1]) - a * np.eye(n, k=1) - a * np.eye(n, k=-1)
+        ) / (1 - a * a)
+        x = design
+        y = data[:, i] - data[:, i].mean()
+        xtx_inv = np.linalg.inv(x.T @ covariance_inv @ x)
+        beta = xtx_inv @ x.T @ covariance_inv @ y
+        residuals = y - x @ beta
+        sigmasq = residuals @ covariance_inv @ residuals / dof
+        assert np.isclose(result["effect"][0, i], beta[0])
+        assert np.isclose(result["variance"][0, i], xtx_inv[0, 0] * sigmasq)
+
+    # threads and the order of the model
+    result2, _, _ = film_gls(data, design, contrasts, ar_order=1, tukey_window=1000, num_threads=4)
+    assert np.allclose(result["z"], result2["z"])
+
+    result3, _, phi = film_gls(data, design, contrasts, ar_order=0)
+    assert phi.shape == (v, 0)
+    assert np.all(np.isfinite(result3["z"]))
+
+
+def make_task_data(rng, shape, n, repetition_time):
+    conditions = ["a", "b"]
+    onsets = [list(np.arange(10, n * repetition_time - 30, 60)), list(np.arange(40, n * repetition_time - 30, 60))]
+    durations = [[15.0] * len(onsets[0]), [15.0] * len(onsets[1])]
+    design = make_design(n, repetition_time, conditions, onsets, durations).to_numpy()
+
+    data = simulate_ar(rng, [0.3], n, int(np.prod(shape)))
+    data += design @ rng.normal(size=(2, data.shape[1])) + 1000
+    data = data.T.reshape((*shape, n)).astype(np.float32)
+
+    subject_info = Bunch(conditions=conditions, onsets=onsets, durations=durations)
+    contrasts = [
+        ["a", "T", conditions, [1.0, 0.0]],
+        ["a-b", "T", conditions, [1.0, -1.0]],
+    ]
+    return data, subject_info, contrasts
+
+
+def test_FirstLevelGLM(tmp_path):
+    os.chdir(str(tmp_path))
+
+    rng = np.random.default_rng(0xf12)
+    shape, n, repetition_time = (8, 9, 10), 120, 2.0
+    data, subject_info, contrasts = make_task_data(rng, shape, n, repetition_time)
+    mask = rng.uniform(size=shape) > 0.2
+    data[0, 0, 0, :] = 0  # constant
+
+    nib.Nifti1Image(data, np.eye(4)).to_filename("bold.nii.gz")
+    nib.Nifti1Image(mask.astype(np.uint8), np.eye(4)).to_filename("mask.nii.gz")
+
+    confounds_df = pd.DataFrame(dict(c=rng.normal(size=n)))
+    confounds_df.loc[0, "c"] = np.nan
+    confounds_file = str(tmp_path / "confounds.tsv")  # spreadsheets are cached by path
+    confounds_df.to_csv(confounds_file, sep="\t", index=False, na_rep="n/a")
+
+    instance = FirstLevelGLM(
+        in_file="bold.nii.gz",
+        mask="mask.nii.gz",
+        repetition_time=repetition_time,
+        subject_info=subject_info,
+        confounds=confounds_file,
+        contrasts=contrasts,
+        high_pass_filter_cutoff=125.0,
+    )
+    result = instance.run()
+    outputs = result.outputs
+
+    assert outputs.contrast_names == ["a", "a-b"]
+
+    design_df = pd.read_csv(outputs.design_matrix, sep="\t")
+    assert list(design_df.columns) == ["a", "b", "c"]
+    contrast_df = pd.read_csv(outputs.contrast_matrix, sep="\t", index_col=0)
+    assert np.allclose(contrast_df.to_numpy(), [[1, 0, 0], [1, -1, 0]])
+
+    dof = nib.load(outputs.dof_file).get_fdata()
+    assert np.all(dof == n - 3)
+
+    for key in ["copes", "varcopes", "zstats", "tstats"]:
+        files = getattr(outputs, key)
+        assert len(files) == 2
+        for file in files:
+            out_data = nib.load(file).get_fdata()
+            assert out_data.shape == shape
+            assert np.all(out_data[~mask] == 0)
+            assert np.all(np.isfinite(out_data))
+
+    z = nib.load(outputs.zstats[0]).get_fdata()
+    assert np.mean(np.abs(z[mask])) > 2  # the simulated effects are detected
+
+
+@pytest.mark.skipif(which("film_gls") is None, reason="fsl is not installed")
+@pytest.mark.timeout(1200)
+def test_FirstLevelGLM_film_gls(tmp_path):
+    """
+    compare to feat_model and film_gls and log how long each takes
+    """
+    os.chdir(str(tmp_path))
+
+    rng = np.random.default_rng(0xf13)
+    shape, n, repetition_time = (40, 48, 40), 200, 2.0
+    data, subject_info, contrasts = make_task_data(rng, shape, n, repetition_time)
+    mask = np.zeros(shape, dtype=np.uint8)
+    mask[4:-4, 4:-4, 4:-4] = 1
+
+    nib.Nifti1Image(data, np.eye(4)).to_filename("bold.nii.gz")
+    nib.Nifti1Image(mask, np.eye(4)).to_filename("mask.nii.gz")
+
+    start = time()
+    instance = FirstLevelGLM(
+        in_file="bold.nii.gz",
+        mask="mask.nii.gz",
+        repetition_time=repetition_time,
+        subject_info=subject_info,
+        contrasts=contrasts,
+        high_pass_filter_cutoff=125.0,
+        num_threads=4,
+    )
+    result = instance.run()
+    duration = time() - start
+    logging.getLogger("halfpipe").info(f"FirstLevelGLM took {duration:.3f}s")
+
+    start = time()
+    modelspec = model.SpecifyModel(
+        functional_runs=["bold.nii.gz"],
+        input_units="secs",
+        time_repetition=repetition_time,
+        high_pass_filter_cutoff=125.0,
+        subject_info=subject_info,
+    ).run()
+    level1design = fsl.Level1Design(
+        contrasts=contrasts,
+        interscan_interval=repetition_time,
+        model_serial_correlations=True,
+        bases={"dgamma": {"derivs": False}},
+        session_info=modelspec.outputs.session_info,
+    ).run()
+    modelgen = fsl.FEATModel(
+        fsf_file=level1design.outputs.fsf_files, ev_files=level1design.outputs.ev_files
+    ).run()
+    modelestimate = fsl.FILMGLS(
+        in_file="bold.nii.gz",
+        design_file=modelgen.outputs.design_file,
+        tcon_file=modelgen.outputs.con_file,
+        threshold=float(data.min()),
+        smooth_autocorr=True,
+        mask_size=5,
+    ).run()
+    duration = time() - start
+    logging.getLogger("halfpipe").info(f"FILMGLS took {duration:.3f}s")
+
+    is_in_mask = mask.astype(bool)
+    for z0_file, z1_file in zip(result.outputs.zstats, modelestimate.outputs.zstats):
+        z0 = nib.load(z0_file).get_fdata()[is_in_mask]
+        z1 = nib.load(z1_file).get_fdata()[is_in_mask]
+        assert np.corrcoef(z0, z1)[0, 1] > 0.95
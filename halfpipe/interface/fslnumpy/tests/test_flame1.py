@@ -8,6 +8,7 @@ import pytest
 
 import os
 import tarfile
+from itertools import product
 from pathlib import Path
 
 import nibabel as nib
@@ -223,3 +224,69 @@ def test_FLAME1(tmp_path, wakemandg_hensonrn_downsampled, use_var_cope):
 
         # mean error average needs to be below 0.05
         assert np.abs(a0 - a1).mean() < 0.05, f"Too high mean error average for {k}"
+
+
+@pytest.mark.timeout(600)
+@pytest.mark.parametrize("use_var_cope", [False, True])
+def test_flame1_batched(tmp_path, use_var_cope):
+    os.chdir(str(tmp_path))
+
+    rng = np.random.default_rng(0x1f3b)
+
+    n = 12
+    shape = (4, 4, 4)
+
+    cope_files, var_cope_files, mask_files = list(), list(), list()
+    for i in range(n):
+        for prefix, array, files in [
+            ("cope", rng.normal(loc=0.5, size=shape), cope_files),
+            ("var_cope", rng.uniform(low=0.1, high=1.0, size=shape), var_cope_files),
+            ("mask", (rng.uniform(size=shape) > 0.05).astype(np.uint8), mask_files),
+        ]:
+            fname = str(tmp_path / f"{prefix}_{i:02d}.nii.gz")
+            nib.save(nib.Nifti1Image(array, np.eye(4)), fname)
+            files.append(fname)
+
+    columns = ["intercept", "age", "group"]
+    regressors = dict(zip(columns, [[1.0] * n, list(rng.normal(size=n)), [float(i % 2) for i in range(n)]]))
+    contrasts = [
+        ("mean", "T", columns, [1, 0, 0]),
+        ("age", "T", columns, [0, 1, 0]),
+        ("all", "F", [("all_0", "T", columns, [0, 1, 0]), ("all_1", "T", columns, [0, 0, 1])]),
+    ]
+
+    results = dict()
+    configurations = [
+        ("voxelwise", 1, np.float64), ("voxelwise", 2, np.float64), ("batched", 1, np.float64), ("batched", 1, np.float32)
+    ]
+    for engine, num_threads, dtype in configurations:
+        engine_path = tmp_path / f"{engine}_{num_threads}_{dtype.__name__}"
+        engine_path.mkdir()
+        os.chdir(str(engine_path))
+
+        results[(engine, num_threads, dtype)] = flame1(
+            cope_files=cope_files,
+            var_cope_files=var_cope_files if use_var_cope else None,
+            mask_files=mask_files,
+            regressors=regressors,
+            contrasts=contrasts,
+            num_threads=num_threads,
+            engine=engine,
+            dtype=dtype,
+        )
+
+    reference, *others = configurations
+    for k, other in product(["copes", "var_copes", "tdof", "zstats", "tstats", "fstats", "masks"], others):
+        for f0, f1 in zip(results[reference][k], results[other][k]):
+            assert (f0 is False) == (f1 is False)
+            if f0 is False:
+                continue
+
+            _, _, dtype = other
+            assert nib.load(f1).get_data_dtype() == dtype
+
+            a0 = nib.load(f0).get_fdata()
+            a1 = nib.load(f1).get_fdata()
+
+            assert np.array_equal(np.isfinite(a0), np.isfinite(a1))
+            assert np.allclose(a0, a1, rtol=1e-5, atol=1e-5, equal_nan=True), f"Results differ for {k} with {other}"
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""
+"""
+
+import os
+
+import pytest
+
+import numpy as np
+import pandas as pd
+import nibabel as nib
+from scipy import stats
+
+from ..glm import OLS, DualRegression, dual_regression
+
+
+def ols_reference(x, y, contrast):
+    """
+    per voxel least squares with demeaning like fsl_glm
+    """
+    x = x - x.mean(axis=0)
+    n, p = x.shape
+    dof = n - np.linalg.matrix_rank(x)
+    copes, varcopes, zs = list(), list(), list()
+    for j in range(y.shape[1]):
+        yj = y[:, j] - y[:, j].mean()
+        beta, _, _, _ = np.linalg.lstsq(x, yj, rcond=None)
+        residuals = yj - x @ beta
+        sigmasq = residuals @ residuals / dof
+        cope = contrast @ beta
+        varcope = contrast @ np.linalg.pinv(x.T @ x) @ contrast * sigmasq
+        copes.append(cope)
+        varcopes.append(varcope)
+        t = cope / np.sqrt(varcope)
+        zs.append(np.sign(t) * stats.norm.isf(stats.t.sf(np.abs(t), dof)))  # smaller tail for precision
+    return np.array(copes), np.array(varcopes), np.array(zs)
+
+
+def test_ols():
+    rng = np.random.default_rng(0x61a)
+    x = rng.normal(size=(40, 3))
+    y = x @ rng.normal(size=(3, 25)) + rng.normal(size=(40, 25)) + 5
+
+    model = OLS(x)
+    beta, residual_ss = model.fit(y)
+    contrasts = np.eye(3)
+    cope, varcope, _, z = model.t_contrasts(beta, residual_ss, contrasts)
+
+    for i, contrast in enumerate(contrasts):
+        ref_cope, ref_varcope, ref_z = ols_reference(x, y, contrast)
+        assert np.allclose(cope[i], ref_cope)
+        assert np.allclose(varcope[i], ref_varcope)
+        assert np.allclose(z[i], ref_z)
+
+    # a duplicate column does not change the fit of the others
+    model = OLS(np.hstack([x, x[:, -1:]]))
+    assert model.dof == 40 - 3
+    beta2, residual_ss2 = model.fit(y)
+    assert np.allclose(residual_ss, residual_ss2)
+    assert np.allclose(beta[:2], beta2[:2])
+
+
+def test_dual_regression():
+    rng = np.random.default_rng(0xd0a1)
+    maps = rng.normal(size=(300, 4))
+    timeseries = rng.normal(size=(50, 4))
+    confounds = rng.normal(size=(50, 2))
+    data = timeseries @ maps.T + rng.normal(size=(50, 300))
+
+    estimated, result = dual_regression(data, maps, confounds)
+
+    # the first stage is a regression of each volume on the maps
+    for i in range(data.shape[0]):
+        x = maps - maps.mean(axis=0)
+        beta, _, _, _ = np.linalg.lstsq(x, data[i] - data[i].mean(), rcond=None)
+        assert np.allclose(estimated[i], beta)
+
+    design = np.hstack([estimated, confounds])
+    for i in range(4):
+        contrast = np.eye(4, 6)[i]
+        ref_cope, ref_varcope, ref_z = ols_reference(design, data, contrast)
+        assert np.allclose(result["effect"][i], ref_cope)
+        assert np.allclose(result["variance"][i], ref_varcope)
+        assert np.allclose(result["z"][i], ref_z)
+
+    assert result["dof"] == 50 - 6
+
+
+@pytest.mark.parametrize("dtype", ["float64", "float32"])
+def test_DualRegression(tmp_path, dtype):
+    os.chdir(str(tmp_path))
+
+    rng = np.random.default_rng(0xd1a2)
+    shape = (6, 7, 8)
+    mask = rng.uniform(size=shape) > 0.2
+
+    affine = np.eye(4)
+    map_files = list()
+    for i, m in enumerate([3, 5]):
+        map_file = f"maps_{i:d}.nii.gz"
+        nib.Nifti1Image(rng.normal(size=(*shape, m)), affine).to_filename(map_file)
+        map_files.append(map_file)
+
+    data = rng.normal(size=(*shape, 40)).astype(np.float32)
+    nib.Nifti1Image(data, affine).to_filename("bold.nii.gz")
+    nib.Nifti1Image(mask.astype(np.uint8), affine).to_filename("mask.nii.gz")
+
+    confounds = pd.DataFrame(rng.normal(size=(40, 2)), columns=["a", "b"])
+    confounds.loc[3, "a"] = np.nan
+    confounds.to_csv("confounds.tsv", sep="\t", index=False, na_rep="n/a")
+
+    instance = DualRegression(
+        in_file="bold.nii.gz", mask="mask.nii.gz", map_files=map_files, confounds="confounds.tsv", dtype=dtype
+    )
+    result = instance.run()
+    outputs = result.outputs
+
+    assert outputs.component_names == [["1", "2", "3"], ["1", "2", "3", "4", "5"]]
+
+    for i, (map_file, component_names) in enumerate(zip(map_files, outputs.component_names)):
+        maps = nib.load(map_file).get_fdata()[mask]
+        _, expected = dual_regression(data[mask].T.astype(np.float64), maps, np.nan_to_num(confounds.values))
+
+        for j in range(len(component_names)):
+            for key in ["effect", "variance", "z"]:
+                out_data = nib.load(getattr(outputs, key)[i][j]).get_fdata()
+                assert np.allclose(out_data[mask], expected[key][j], rtol=1e-4, atol=1e-6)
+                assert np.all(out_data[~mask] == 0)
+
+        assert np.all(nib.load(outputs.dof[i]).get_fdata() == 40 - len(component_names) - 2)
+
+        design_df = pd.read_csv(outputs.design_matrix[i], sep="\t")
+        assert list(design_df.columns) == [*component_names, "a", "b"]
+        contrast_df = pd.read_csv(outputs.contrast_matrix[i], sep="\t", index_col=0)
+        assert contrast_df.shape == (len(component_names), len(component_names) + 2)
@@ -9,7 +9,7 @@ import pytest
 import numpy as np
 from scipy import stats
 
-from ..miscmaths import t2z_convert, f2z_convert
+from ..miscmaths import t2z_convert, f2z_convert, t2z_convert_array, f2z_convert_array
 
 
 def t2z_convert_numpy(t, dof):
@@ -63,3 +63,68 @@ def test_nonfinite():
     assert f2z_convert(np.inf, 1, 1) == np.inf
     assert f2z_convert(-np.inf, 1, 1) == -np.inf
     assert np.isnan(f2z_convert(np.nan, 1, 1))
+
+
+@pytest.mark.parametrize("dof", [2, 10, 30])
+def test_t2z_convert_array(dof):
+    t = np.concatenate([np.linspace(-7, 7, num=15), np.logspace(1, 4, num=5)])
+    z = t2z_convert_array(t, dof)
+    assert z.shape == t.shape
+    assert np.allclose(z, [t2z_convert(a, dof) for a in t], rtol=0, atol=1e-6)
+
+
+@pytest.mark.parametrize("d1,d2", [
+    (1, 1), (2, 1), (5, 2), (10, 1), (10, 20), (10, 100)
+])
+def test_f2z_convert_array(d1, d2):
+    f = np.concatenate([np.linspace(1e-3, 7, num=15), np.logspace(2, 4, num=5)])
+    z = f2z_convert_array(f, d1, d2)
+    assert z.shape == f.shape
+    assert np.allclose(z, [f2z_convert(a, d1, d2) for a in f], rtol=0, atol=1e-6)
+
+
+def test_convert_array_broadcast():
+    t = np.array([[-3.0, 0.0, 3.0]])
+    dof = np.array([[2.0], [30.0]])
+    z = t2z_convert_array(t, dof)
+    assert z.shape == (2, 3)
+    assert np.allclose(z[:, 1], 0)
+    assert np.allclose(z[:, 0], -z[:, 2])
+
+    assert isinstance(t2z_convert_array(1.0, 10), float)
+    assert isinstance(f2z_convert_array(1.0, 2, 10), float)
+
+
+@pytest.mark.timeout(1)
+def test_nonfinite_array():
+    z = t2z_convert_array([np.inf, -np.inf, np.nan], 1)
+    assert z[0] == np.inf
+    assert z[1] == -np.inf
+    assert np.isnan(z[2])
+
+    z = f2z_convert_array([np.inf, -np.inf, np.nan, -1.0], 1, 1)
+    assert z[0] == np.inf
+    assert z[1] == -np.inf
+    assert np.isnan(z[2])
+    assert z[3] == 0
+
+
+@pytest.mark.timeout(300)
+def test_convert_array_underflow():
+    """
+    the tail probabilities underflow in float64, so these elements use mpmath
+    """
+    t = np.array([1e6, -1e6, 3.0])
+    assert stats.t.sf(1e6, 60) < np.finfo(np.float64).tiny
+    z = t2z_convert_array(t, 60)
+    assert np.all(np.isfinite(z))
+    assert np.isclose(z[0], t2z_convert(1e6, 60), rtol=0, atol=1e-6)
+    assert z[1] == -z[0]
+    assert np.isclose(z[2], t2z_convert(3.0, 60), rtol=0, atol=1e-6)
+
+    f = np.array([1e10, 1e-150, 3.0])
+    assert stats.f.sf(1e10, 5, 100) < np.finfo(np.float64).tiny
+    assert stats.f.cdf(1e-150, 5, 100) < np.finfo(np.float64).tiny
+    z = f2z_convert_array(f, 5, 100)
+    assert np.all(np.isfinite(z))
+    assert np.allclose(z, [f2z_convert(a, 5, 100) for a in f], rtol=0, atol=1e-6)
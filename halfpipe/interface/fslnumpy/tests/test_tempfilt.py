@@ -6,16 +6,105 @@
 
 import pytest
 
+import logging
 import os
 from random import seed
+from time import time
 
 import nibabel as nib
 import numpy as np
 
-from ..tempfilt import TemporalFilter
+from ..tempfilt import TemporalFilter, bandpass_temporal_filter
 from nipype.interfaces import fsl
 
 
+def bandpass_temporal_filter_loop(array, hp_sigma, lp_sigma):
+    """
+    reference implementation that loops over time points like fsl
+    """
+
+    if hp_sigma <= 0:
+        hp_mask_size_minus = 0
+    else:
+        hp_mask_size_minus = int(np.floor(hp_sigma * 3))
+
+    hp_mask_size_plus = hp_mask_size_minus
+
+    if lp_sigma <= 0:
+        lp_mask_size_minus = 0
+    else:
+        lp_mask_size_minus = int(np.floor(lp_sigma * 20)) + 2
+
+    lp_mask_size_plus = lp_mask_size_minus
+
+    if hp_sigma > 0:
+        hp_exp = np.zeros(hp_mask_size_minus + hp_mask_size_plus + 1)
+        for t in range(-hp_mask_size_minus, hp_mask_size_plus + 1):
+            hp_exp[t] = np.exp(-0.5 * (float(t * t)) / (hp_sigma * hp_sigma))
+
+    if lp_sigma > 0:
+        total = 0.0
+        lp_exp = np.zeros(lp_mask_size_minus + lp_mask_size_plus + 1)
+        for t in range(-lp_mask_size_minus, lp_mask_size_plus + 1):
+            lp_exp[t] = np.exp(-0.5 * (float(t * t)) / (lp_sigma * lp_sigma))
+            total += lp_exp[t]
+        for t in range(-lp_mask_size_minus, lp_mask_size_plus + 1):
+            lp_exp[t] /= total
+
+    m, sourcetsize = array.shape
+    array2 = np.zeros_like(array)
+
+    if hp_sigma > 0:
+        c0 = None
+        for t in range(sourcetsize):
+
+            A = 0
+            B = np.zeros((m,), dtype=array.dtype)
+            C = 0
+            D = np.zeros((m,), dtype=array.dtype)
+            N = 0
+
+            for tt in range(max(t - hp_mask_size_minus, 0), min(t + hp_mask_size_plus, sourcetsize - 1) + 1):
+                dt = tt - t
+                w = hp_exp[dt]
+                A += w * dt
+                B += w * array[:, tt]
+                C += w * dt * dt
+                D += w * dt * array[:, tt]
+                N += w
+
+            tmpdenom = C * N - A * A
+            if not np.isclose(tmpdenom, 0):
+                c = (B * C - A * D) / tmpdenom
+                if c0 is None:
+                    c0 = c
+                array2[:, t] = c0 + array[:, t] - c
+            else:
+                array2[:, t] = array[:, t]
+
+        array2 -= array2.mean(axis=1)[:, None]
+
+        np.copyto(array, array2)  # destination, then source
+
+    if lp_sigma > 0:
+        for t in range(sourcetsize):
+            total = np.zeros((m,), dtype=array.dtype)
+            sum = 0
+
+            for tt in range(max(t - lp_mask_size_minus, 0), min(t + lp_mask_size_plus, sourcetsize - 1) + 1):
+                total += array[:, tt] * lp_exp[tt - t]
+                sum += lp_exp[tt - t]
+
+            if sum > 0:
+                array2[:, t] = total / sum
+            else:
+                array2[:, t] = total
+
+        np.copyto(array, array2)
+
+    return array
+
+
 @pytest.mark.timeout(60)
 def test_TemporalFilter(tmp_path):
     seed(a=0x4d3c732f)
@@ -44,3 +133,80 @@ def test_TemporalFilter(tmp_path):
 
     r1 = nib.load(result.outputs.out_file).get_fdata()
     assert np.allclose(r0, r1)
+
+
+@pytest.mark.parametrize("method", ["fft", "direct"])
+@pytest.mark.parametrize("hp_sigma,lp_sigma", [(125, 12), (25, -1), (-1, 2.5), (4, 1), (0.1, -1)])
+@pytest.mark.parametrize("n", [100, 7])
+def test_bandpass_temporal_filter(method, hp_sigma, lp_sigma, n):
+    array = np.random.default_rng(0x5e0c).normal(loc=10000, scale=100, size=(50, n))
+
+    r0 = bandpass_temporal_filter_loop(array.copy(), hp_sigma, lp_sigma)
+    r1 = bandpass_temporal_filter(array.copy(), hp_sigma, lp_sigma, method=method)
+
+    assert np.allclose(r0, r1, rtol=1e-8, atol=1e-8)
+
+    r2 = bandpass_temporal_filter(array.copy(), hp_sigma, lp_sigma, method=method, dtype=np.float32)
+
+    assert r2.dtype == np.float32
+    assert np.allclose(r0, r2, rtol=1e-3, atol=1e-1)
+
+
+@pytest.mark.parametrize("use_mask", [False, True])
+def test_TemporalFilter_stream(tmp_path, use_mask):
+    os.chdir(str(tmp_path))
+
+    rng = np.random.default_rng(0x2b7a)
+
+    in_file = "img.nii.gz"
+    nib.save(nib.Nifti1Image(rng.normal(loc=1000, scale=10, size=(5, 6, 7, 50)), np.eye(4)), in_file)
+
+    mask_file = "mask.nii.gz"
+    nib.save(nib.Nifti1Image((rng.uniform(size=(5, 6, 7)) > 0.3).astype(np.uint8), np.eye(4)), mask_file)
+
+    results = list()
+    for stream_mem_gb in [None, 2 ** -20]:  # a budget of a few voxels per block
+        instance = TemporalFilter(lowpass_sigma=2, highpass_sigma=10)
+        instance.inputs.in_file = in_file
+        if use_mask:
+            instance.inputs.mask = mask_file
+        if stream_mem_gb is not None:
+            instance.inputs.stream_mem_gb = stream_mem_gb
+        result = instance.run()
+
+        results.append(nib.load(result.outputs.out_file).get_fdata())
+
+    r0, r1 = results
+    assert r0.shape == r1.shape
+    assert np.allclose(r0, r1)
+
+
+@pytest.mark.timeout(300)
+def test_bandpass_temporal_filter_benchmark():
+    """
+    time a sample of the voxels of a 97x115x97x400 series, as the reference loop
+    would take about half an hour for all of them
+    """
+    shape, n, sample_size = (97, 115, 97), 400, 5000
+    voxel_count = int(np.prod(shape))
+
+    array = np.random.default_rng(0xbe4c).normal(loc=10000, scale=100, size=(sample_size, n))
+
+    durations = dict()
+    results = dict()
+    for name, function, kwargs in [
+        ("loop", bandpass_temporal_filter_loop, dict()),
+        ("fft", bandpass_temporal_filter, dict(method="fft")),
+        ("fft float32", bandpass_temporal_filter, dict(method="fft", dtype=np.float32)),
+    ]:
+        start = time()
+        results[name] = function(array.copy(), 125, 12, **kwargs)
+        durations[name] = time() - start
+
+        logging.getLogger("halfpipe").info(
+            f"bandpass_temporal_filter {name} took {durations[name]:.3f}s for {sample_size:d} voxels, "
+            f"{durations[name] * voxel_count / sample_size:.0f}s extrapolated to {'x'.join(map(str, (*shape, n)))}"
+        )
+
+    assert np.allclose(results["loop"], results["fft"], rtol=1e-8, atol=1e-8)
+    assert durations["fft"] < durations["loop"]
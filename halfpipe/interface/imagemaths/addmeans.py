@@ -4,6 +4,9 @@
 """
 """
 
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
 import numpy as np
 
 from nipype.interfaces.base import File
@@ -20,17 +23,30 @@ class AddMeans(Transformer):
 
     suffix = "addmean"
 
+    voxel_separable = True
+
     def _run_interface(self, runtime):
         in_file = self.inputs.in_file
         mean_file = self.inputs.mean_file
 
-        mean_data = self._load(mean_file)
-        mean_r = np.nanmean(mean_data, axis=0)
+        if self._can_stream(in_file, mean_file):
+            with TemporaryDirectory(dir=Path.cwd()) as scratch_dir:
+                mean_data, _ = self._open(mean_file, scratch_dir)
+
+                def add_means(array, index):
+                    return array + np.nanmean(mean_data[:, index], axis=0, dtype=np.float64)
+
+                out_file = self._stream(in_file, add_means, scratch_dir)
+
+        else:
+            mean_data = self._load(mean_file)
+            mean_r = np.nanmean(mean_data, axis=0, dtype=np.float64)
+
+            array = self._load(in_file)
+            array2 = array + mean_r
 
-        array = self._load(in_file)
-        array2 = array + mean_r
+            out_file = self._dump(array2)
 
-        out_file = self._dump(array2)
         self._results["out_file"] = out_file
 
         return runtime
@@ -10,6 +10,7 @@ from ..transformer import Transformer
 
 
 class MaxIntensity(Transformer):
+    voxel_separable = True
 
     def _transform(self, array):
         mask = np.logical_not(np.all(np.isclose(array, 0, atol=1e-5, rtol=1e-3), axis=0))
@@ -41,7 +41,7 @@ def _merge_fname(in_files):
     return fname
 
 
-def _merge(in_files, dimension):
+def _merge(in_files, dimension, dtype=np.float64):
     in_imgs = [nib.load(f) for f in in_files]
 
     idim = dimensions.index(dimension)
@@ -55,11 +55,11 @@ def _merge(in_files, dimension):
     outshape[idim] = sum(sizes)
 
     movd_shape = [outshape[idim], *outshape[:idim], *outshape[idim + 1 :]]
-    movd_outarr = np.zeros(movd_shape, dtype=np.float64)
+    movd_outarr = np.zeros(movd_shape, dtype=dtype)
 
     i = 0
     for in_img, size in zip(in_imgs, sizes):
-        in_data = in_img.get_fdata()
+        in_data = in_img.get_fdata(dtype=dtype)
         while len(in_data.shape) < idim + 1:
             in_data = np.expand_dims(in_data, len(in_data.shape))
         movd_outarr[i : i + size] = np.moveaxis(in_data, idim, 0)
@@ -68,6 +68,8 @@ def _merge(in_files, dimension):
     outarr = np.moveaxis(movd_outarr, 0, idim)
 
     outimg = new_img_like(first(in_imgs), outarr, copy_header=True)
+    if np.dtype(dtype) == np.float32:
+        outimg.set_data_dtype(np.float32)
 
     merged_file = _merge_fname(in_files)
     nib.save(outimg, merged_file)
@@ -97,6 +99,7 @@ class MergeInputSpec(TraitedSpec):
         File(desc="Image file(s) to resample", exists=True), mandatory=True
     )
     dimension = traits.Enum(*dimensions, desc="dimension along which to merge", mandatory=True)
+    dtype = traits.Enum("float64", "float32", usedefault=True, desc="precision of arrays and output images")
 
 
 class MergeOutputSpec(TraitedSpec):
@@ -116,7 +119,7 @@ class Merge(SimpleInterface):
             self._results["merged_file"] = False
             return runtime
 
-        merged_file = _merge(in_files, self.inputs.dimension)
+        merged_file = _merge(in_files, self.inputs.dimension, dtype=self.inputs.dtype)
 
         self._results["merged_file"] = str(merged_file)
 
@@ -12,8 +12,8 @@ from ..transformer import Transformer
 class ZScore(Transformer):
 
     def _transform(self, array):
-        mean = np.nanmean(array)
-        std = np.nanstd(array)
+        mean = np.nanmean(array, dtype=np.float64)
+        std = np.nanstd(array, dtype=np.float64)
 
         if np.isclose(std, 0):
             std = 1
@@ -14,6 +14,7 @@ class GrandMeanScalingInputSpec(BaseInterfaceInputSpec):
     files = traits.List(File(exists=True), mandatory=True)
     mask = File(exists=True, desc="3D brain mask")
     mean = traits.Float(mandatory=True, desc="grand mean scale value")
+    dtype = traits.Enum("float64", "float32", usedefault=True, desc="precision of arrays and output images")
 
 
 class GrandMeanScalingOutputSpec(TraitedSpec):
@@ -35,7 +36,7 @@ class GrandMeanScaling(Transformer):
 
     def _transform(self, array):
         if self.scaling_factor is None:  # scaling factor is determined by first file
-            arraymean = np.nanmean(array)
+            arraymean = np.nanmean(array, dtype=np.float64)
             if arraymean == 0:
                 logging.getLogger("halfpipe").warning(
                     f'File "{self.inputs.files[0]}" has a grand mean of 0. Skipping grand mean scaling'
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""
+Regional homogeneity as Kendall's coefficient of concordance of the time series of each
+voxel and its neighbors, a numpy translation of AFNI 3dReHo
+"""
+
+from itertools import product
+from pathlib import Path
+
+import numpy as np
+import nibabel as nib
+from scipy import sparse
+
+from nipype.interfaces.base import (
+    SimpleInterface,
+    TraitedSpec,
+    File,
+    traits,
+    isdefined,
+)
+
+from ..utils import nvol
+
+block_nbytes = 2 ** 26  # size of the blocks of voxels that are processed at once
+
+neighborhood_max_norms = dict(faces=1, edges=2, vertices=3)  # 7, 19 and 27 voxels
+
+
+def neighborhood_offsets(neighborhood):
+    max_norm = neighborhood_max_norms[neighborhood]
+    return [
+        offset for offset in product([-1, 0, 1], repeat=3)
+        if sum(map(abs, offset)) <= max_norm
+    ]
+
+
+def adjacency_matrix(mask, neighborhood="vertices"):
+    """
+    sparse matrix of the voxels in the mask by their neighbors in the mask, including
+    the voxel itself
+    """
+    coords = np.argwhere(mask)
+    indices = np.full(mask.shape, -1, dtype=np.int64)
+    indices[tuple(coords.T)] = np.arange(coords.shape[0])
+
+    rows, cols = list(), list()
+    for offset in neighborhood_offsets(neighborhood):
+        neighbor_coords = coords + np.asarray(offset)
+        is_inside = np.all((neighbor_coords >= 0) & (neighbor_coords < mask.shape), axis=1)
+        (row,) = np.nonzero(is_inside)
+        col = indices[tuple(neighbor_coords[is_inside].T)]
+        is_in_mask = col >= 0
+        rows.append(row[is_in_mask])
+        cols.append(col[is_in_mask])
+
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    n = coords.shape[0]
+    return sparse.csr_matrix((np.ones(rows.size, dtype=np.float32), (rows, cols)), shape=(n, n))
+
+
+def rank_rows(array, out):
+    """
+    ranks of the values in each row starting at one, where ties get the average rank
+    like in scipy.stats.rankdata, but vectorized over rows
+    """
+    m, n = array.shape
+    order = np.argsort(array, axis=1, kind="stable")
+    sorted_array = np.take_along_axis(array, order, axis=1)
+
+    positions = np.broadcast_to(np.arange(n, dtype=np.float64), (m, n))
+    is_different = sorted_array[:, 1:] != sorted_array[:, :-1]
+
+    if np.all(is_different):  # no ties
+        ranks = positions + 1
+    else:
+        is_first = np.ones((m, n), dtype=bool)
+        is_first[:, 1:] = is_different
+        is_last = np.ones((m, n), dtype=bool)
+        is_last[:, :-1] = is_different
+
+        first = np.maximum.accumulate(np.where(is_first, positions, 0), axis=1)
+        last = np.minimum.accumulate(np.where(is_last, positions, n)[:, ::-1], axis=1)[:, ::-1]
+        ranks = (first + last) / 2 + 1
+
+    np.put_along_axis(out, order, ranks.astype(out.dtype), axis=1)
+
+
+def kendall_w(ranks, adjacency):
+    """
+    ranks are voxels by time points, where ties have the average rank
+    """
+    m, n = ranks.shape
+    counts = np.asarray(adjacency.sum(axis=1), dtype=np.float64).ravel()
+
+    w = np.empty(m, dtype=np.float64)
+
+    block_size = max(1, block_nbytes // (n * 8))
+    for start in range(0, m, block_size):
+        stop = min(m, start + block_size)
+        rank_sums = adjacency[start:stop].dot(ranks).astype(np.float64)  # sum over neighbors
+        k = counts[start:stop]
+        s = np.einsum("ij,ij->i", rank_sums, rank_sums)
+        w[start:stop] = (12 * s - 3 * k * k * n * (n + 1) ** 2) / (k * k * (n ** 3 - n))
+
+    return w
+
+
+def reho(data, mask, neighborhood="vertices"):
+    """
+    data has time in the last dimension
+    """
+    n = data.shape[-1]
+    if n < 2:
+        raise ValueError("Need at least two time points")
+
+    time_series = data[mask]
+
+    ranks = np.empty(time_series.shape, dtype=np.float32)  # half ranks are exact
+    block_size = max(1, block_nbytes // (n * 8))
+    for start in range(0, time_series.shape[0], block_size):
+        stop = start + block_size
+        rank_rows(time_series[start:stop], out=ranks[start:stop])
+
+    out = np.zeros(mask.shape, dtype=np.float64)
+    out[mask] = kendall_w(ranks, adjacency_matrix(mask, neighborhood))
+    return out
+
+
+class ReHoInputSpec(TraitedSpec):
+    in_file = File(desc="input dataset", exists=True, mandatory=True)
+    mask_file = File(desc="mask of voxels to include", exists=True)
+    neighborhood = traits.Enum("faces", "edges", "vertices", usedefault=True, desc="7, 19 or 27 voxels")
+    out_file = File("reho.nii.gz", usedefault=True, desc="output image file name")
+
+
+class ReHoOutputSpec(TraitedSpec):
+    out_file = File(desc="reho map")
+
+
+class ReHo(SimpleInterface):
+    input_spec = ReHoInputSpec
+    output_spec = ReHoOutputSpec
+
+    def _run_interface(self, runtime):
+        in_img = nib.load(self.inputs.in_file)
+        data = np.asanyarray(in_img.dataobj)
+
+        if isdefined(self.inputs.mask_file):
+            mask_img = nib.load(self.inputs.mask_file)
+            assert nvol(mask_img) == 1
+            assert np.allclose(mask_img.affine, in_img.affine)
+            mask = np.asanyarray(mask_img.dataobj).astype(bool).reshape(in_img.shape[:3])
+        else:
+            mask = np.any(data != 0, axis=-1)  # like afni without a mask
+
+        out = reho(data, mask, self.inputs.neighborhood)
+
+        out_img = nib.Nifti1Image(out.astype(np.float32), in_img.affine, in_img.header)
+        out_img.header.set_data_shape(out.shape)
+        out_img.header.set_data_dtype(np.float32)
+        out_img.header.set_slope_inter(1, 0)
+
+        out_file = Path(self.inputs.out_file).resolve()
+        nib.save(out_img, out_file)
+        self._results["out_file"] = str(out_file)
+
+        return runtime
@@ -9,6 +9,7 @@ from nipype.interfaces.base import (
     TraitedSpec,
     SimpleInterface,
     File,
+    Directory,
     isdefined,
 )
 
@@ -25,6 +26,8 @@ class CalcMeanInputSpec(TraitedSpec):
     vals = traits.Dict(traits.Str(), traits.Any())
     key = traits.Str()
 
+    cache_dir = Directory(desc="directory to cache the label matrices in", nohash=True)
+
 
 class CalcMeanOutputSpec(TraitedSpec):
     mean = traits.Either(traits.Float(), traits.List(traits.Float()))
@@ -40,18 +43,21 @@ class CalcMean(SimpleInterface):
         mask_file = None
         if isdefined(self.inputs.mask):
             mask_file = self.inputs.mask
+        cache_dir = None
+        if isdefined(self.inputs.cache_dir):
+            cache_dir = self.inputs.cache_dir
 
         if isdefined(self.inputs.dseg):  # get grey matter only
             _, self._results["mean"], _ = meansignals(
-                in_file, self.inputs.dseg, mask_file=mask_file, min_region_coverage=0
+                in_file, self.inputs.dseg, mask_file=mask_file, min_region_coverage=0, cache_dir=cache_dir
             ).ravel()
         elif isdefined(self.inputs.parcellation):
             self._results["mean"] = list(meansignals(
-                in_file, self.inputs.parcellation, mask_file=mask_file, min_region_coverage=0
+                in_file, self.inputs.parcellation, mask_file=mask_file, min_region_coverage=0, cache_dir=cache_dir
             ).ravel())
         elif mask_file is not None:
             self._results["mean"] = firstfloat(meansignals(
-                in_file, mask_file, min_region_coverage=0
+                in_file, mask_file, min_region_coverage=0, cache_dir=cache_dir
             ).ravel())
         vals = dict()
         self._results["vals"] = vals
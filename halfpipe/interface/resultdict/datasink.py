@@ -168,6 +168,12 @@ class ResultdictDatasink(SimpleInterface):
                 if was_updated:
                     _make_plot(tags, key, outpath)
 
+                instem, inextension = splitext(inpath)
+                npypath = Path(inpath).parent / f"{instem}.npy"
+                if inextension == ".tsv" and npypath.is_file():  # binary copy of the same matrix
+                    stem, _ = splitext(outpath)
+                    _copy_file(npypath, outpath.parent / f"{stem}.npy")
+
                 if key in ["effect", "reho", "falff", "alff", "bold", "timeseries"]:
                     stem, extension = splitext(outpath)
                     if extension in [".nii", ".nii.gz", ".tsv"]:
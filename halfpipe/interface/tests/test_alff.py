@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""
+"""
+
+import os
+
+import pytest
+
+import numpy as np
+import nibabel as nib
+
+from ..alff import ALFF, alff
+
+
+def bandpass(time_series, repetition_time, low, high):
+    """
+    reference ideal filter that zeroes the frequencies outside of the band
+    """
+    n = time_series.shape[-1]
+    frequencies = np.fft.rfftfreq(n, d=repetition_time)
+    spectrum = np.fft.rfft(time_series, axis=-1)
+    spectrum[..., (frequencies < low) | (frequencies > high)] = 0
+    return np.fft.irfft(spectrum, n=n, axis=-1)
+
+
+@pytest.mark.parametrize("n", [99, 100])
+def test_alff(n):
+    repetition_time, low, high = 2.0, 0.01, 0.1
+
+    rng = np.random.default_rng(0xa1ff)
+    time_series = rng.normal(size=(50, n)) + 100
+
+    amplitude, fraction = alff(time_series, repetition_time, low, high, block_nbytes=1)
+
+    filtered_std = np.std(bandpass(time_series, repetition_time, low, high), axis=-1)
+    unfiltered_std = np.std(time_series, axis=-1)
+
+    assert np.allclose(amplitude, filtered_std)
+    assert np.allclose(fraction, filtered_std / unfiltered_std)
+
+    # without a band, the amplitude is the standard deviation
+    amplitude, fraction = alff(time_series, repetition_time)
+    assert np.allclose(amplitude, unfiltered_std)
+    assert np.allclose(fraction, 1)
+
+
+def test_ALFF(tmp_path):
+    os.chdir(str(tmp_path))
+
+    rng = np.random.default_rng(0xf0ff)
+    data = rng.normal(size=(5, 6, 7, 60)).astype(np.float32)
+    data[0, 0, 0, :] = 1  # constant
+    mask = rng.uniform(size=(5, 6, 7)) > 0.2
+
+    affine = np.eye(4)
+    nib.Nifti1Image(data, affine).to_filename("bold.nii.gz")
+    nib.Nifti1Image(mask.astype(np.uint8), affine).to_filename("mask.nii.gz")
+
+    amplitude, fraction = alff(data[mask], 2.0, 0.01, 0.1)
+
+    for stream_mem_gb in [None, 2 ** -20]:  # a budget of a few voxels per block
+        instance = ALFF(in_file="bold.nii.gz", mask="mask.nii.gz", repetition_time=2.0, dtype="float32")
+        if stream_mem_gb is not None:
+            instance.inputs.stream_mem_gb = stream_mem_gb
+        result = instance.run()
+
+        alff_data = nib.load(result.outputs.alff).get_fdata()
+        falff_data = nib.load(result.outputs.falff).get_fdata()
+
+        assert np.allclose(alff_data[mask], amplitude, atol=1e-5)
+        assert np.allclose(falff_data[mask], fraction, atol=1e-5)
+        assert np.all(alff_data[~mask] == 0) and np.all(falff_data[~mask] == 0)
+        assert np.all(np.isfinite(falff_data))
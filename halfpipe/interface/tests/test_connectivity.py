@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+"""
+
+"""
+
+import numpy as np
+import pandas as pd
+import nibabel as nib
+
+from ..connectivity import ConnectivityMeasure, cov_corr
+from ...io import meansignals
+
+
+def test_cov_corr():
+    rng = np.random.default_rng(0)
+
+    time_series = rng.normal(size=(50, 7))
+    time_series[:, 2] = np.nan
+    time_series[:, 4] = 1.0  # constant
+
+    cov_mat, corr_mat = cov_corr(time_series)
+
+    df = pd.DataFrame(time_series)
+    np.testing.assert_allclose(cov_mat, df.cov())
+    np.testing.assert_allclose(corr_mat, df.corr())
+
+
+def test_ConnectivityMeasure(tmp_path, monkeypatch):
+    monkeypatch.chdir(str(tmp_path))
+
+    rng = np.random.default_rng(0)
+    shape = (9, 10, 11)
+    affine = np.eye(4)
+
+    in_file = str(tmp_path / "bold.nii.gz")
+    nib.Nifti1Image(rng.normal(size=(*shape, 23)), affine).to_filename(in_file)
+
+    mask_file = str(tmp_path / "mask.nii.gz")
+    nib.Nifti1Image(np.ones(shape, dtype=np.uint8), affine).to_filename(mask_file)
+
+    atlas_files = list()
+    for nlabel in [5, 12]:
+        atlas_file = str(tmp_path / f"atlas-{nlabel}.nii.gz")
+        labels = rng.integers(0, nlabel + 1, size=shape).astype(np.int32)
+        nib.Nifti1Image(labels, affine).to_filename(atlas_file)
+        atlas_files.append(atlas_file)
+
+    cm = ConnectivityMeasure(in_file=in_file, mask_file=mask_file, atlas_files=atlas_files)
+    result = cm.run()
+
+    outputs = result.outputs
+    assert len(outputs.time_series) == len(atlas_files)
+
+    for i, atlas_file in enumerate(atlas_files):
+        time_series = meansignals(in_file, atlas_file, mask_file=mask_file, min_region_coverage=0.8)
+        np.testing.assert_allclose(np.loadtxt(outputs.time_series[i]), time_series, atol=1e-9)
+
+        df = pd.DataFrame(time_series)
+        np.testing.assert_allclose(np.loadtxt(outputs.covariance[i]), df.cov(), atol=1e-9)
+        np.testing.assert_allclose(np.load(outputs.correlation[i].replace(".tsv", ".npy")), df.corr())
+
+        assert len(outputs.region_coverage[i]) == time_series.shape[1]
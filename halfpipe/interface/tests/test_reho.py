@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""
+"""
+
+import logging
+import os
+from shutil import which
+from time import time
+
+import pytest
+
+import numpy as np
+import nibabel as nib
+from scipy.stats import rankdata
+
+from ..reho import ReHo, reho, rank_rows, neighborhood_offsets
+from ..fixes import ReHo as AFNIReHo
+
+
+def reho_loop(data, mask, neighborhood):
+    """
+    reference implementation that loops over voxels
+    """
+    out = np.zeros(mask.shape)
+    n = data.shape[-1]
+    for coord in np.argwhere(mask):
+        ranks = list()
+        for offset in neighborhood_offsets(neighborhood):
+            neighbor = tuple(coord + offset)
+            if all(0 <= c < s for c, s in zip(neighbor, mask.shape)) and mask[neighbor]:
+                ranks.append(rankdata(data[neighbor]))
+        rank_sums = np.sum(ranks, axis=0)
+        k = len(ranks)
+        s = np.sum(np.square(rank_sums - rank_sums.mean()))
+        out[tuple(coord)] = 12 * s / (k * k * (n ** 3 - n))
+    return out
+
+
+@pytest.mark.parametrize("neighborhood,size", [("faces", 7), ("edges", 19), ("vertices", 27)])
+def test_reho(neighborhood, size):
+    assert len(neighborhood_offsets(neighborhood)) == size
+
+    rng = np.random.default_rng(0x3e1a)
+    data = rng.normal(size=(5, 6, 7, 20))
+    data[..., :10] += rng.normal(size=(1, 1, 7, 1))  # spatially correlated
+    data[1, 1, 1, :5] = 0  # ties
+    mask = rng.uniform(size=(5, 6, 7)) > 0.2
+
+    r0 = reho_loop(data, mask, neighborhood)
+    r1 = reho(data, mask, neighborhood)
+
+    assert np.allclose(r0, r1)
+    assert np.all(r1[mask] > 0) and np.all(r1[mask] <= 1)
+
+
+@pytest.mark.skipif(which("3dReHo") is None, reason="afni is not installed")
+@pytest.mark.timeout(600)
+def test_ReHo_afni(tmp_path):
+    os.chdir(str(tmp_path))
+
+    rng = np.random.default_rng(0x5b2d)
+    data = rng.normal(size=(40, 48, 40, 150)) + rng.normal(size=(40, 48, 1, 150))
+    mask = np.zeros(data.shape[:3], dtype=np.uint8)
+    mask[4:-4, 4:-4, 4:-4] = 1
+
+    nib.save(nib.Nifti1Image(data.astype(np.float32), np.eye(4)), "bold.nii.gz")
+    nib.save(nib.Nifti1Image(mask, np.eye(4)), "mask.nii.gz")
+
+    results = list()
+    for cls in [ReHo, AFNIReHo]:
+        start = time()
+        instance = cls(neighborhood="vertices", out_file=f"{cls.__module__}.nii.gz")
+        instance.inputs.in_file = "bold.nii.gz"
+        instance.inputs.mask_file = "mask.nii.gz"
+        result = instance.run()
+        duration = time() - start
+        logging.getLogger("halfpipe").info(f"{cls.__module__}.{cls.__name__} took {duration:.3f}s")
+        results.append(nib.load(result.outputs.out_file).get_fdata())
+
+    r0, r1 = results
+    assert np.allclose(r0, r1, atol=1e-4)
+
+
+def test_rank_rows():
+    rng = np.random.default_rng(0x1c7f)
+    for array in [rng.normal(size=(50, 30)), rng.integers(0, 5, size=(50, 30)).astype(float)]:
+        ranks = np.empty(array.shape)
+        rank_rows(array, out=ranks)
+        assert np.allclose(ranks, rankdata(array, axis=1))
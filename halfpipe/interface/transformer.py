@@ -4,6 +4,7 @@
 """
 """
 from pathlib import Path
+from tempfile import TemporaryDirectory, NamedTemporaryFile
 
 import numpy as np
 import nibabel as nib
@@ -15,6 +16,7 @@ from nipype.interfaces.base import (
     TraitedSpec,
     isdefined,
     File,
+    traits,
 )
 
 from ..io import loadspreadsheet
@@ -24,6 +26,10 @@ from ..utils import splitext, nvol
 class TransformerInputSpec(TraitedSpec):
     in_file = File(desc="File to filter", exists=True, mandatory=True)
     mask = File(desc="mask to use for volumes", exists=True)
+    dtype = traits.Enum("float64", "float32", usedefault=True, desc="precision of arrays and output images")
+    stream_mem_gb = traits.Float(
+        desc="process blocks of voxels from memory-mapped files to stay within this memory budget"
+    )
 
 
 class TransformerOutputSpec(TraitedSpec):
@@ -39,9 +45,39 @@ class Transformer(SimpleInterface):
 
     suffix = "transformed"
 
+    voxel_separable = False  # whether _transform can be applied to blocks of voxels separately
+
+    stream_copies = 4  # how many copies of a block of voxels we expect _transform to make
+
     def _transform(self, array):
         raise NotImplementedError()
 
+    @property
+    def dtype(self):
+        return np.dtype(self.inputs.dtype)
+
+    def _new_img_like(self, in_img, out_array):
+        out_img = new_img_like(in_img, out_array, copy_header=True)
+        if self.dtype == np.float32:
+            out_img.set_data_dtype(np.float32)
+        return out_img
+
+    def _load_mask(self, in_img, mask_file=None):
+        self.mask = None
+
+        if mask_file is None:
+            mask_file = self.inputs.mask
+        if isdefined(mask_file) and isinstance(mask_file, str) and Path(mask_file).is_file():
+            mask_img = nib.load(mask_file)
+            assert nvol(mask_img) == 1
+            assert np.allclose(mask_img.affine, in_img.affine)
+            mask_fdata = mask_img.get_fdata(dtype=np.float64)
+            mask_bin = np.logical_not(
+                np.logical_or(mask_fdata <= 0, np.isclose(mask_fdata, 0, atol=1e-2))
+            )
+            self.mask = mask_bin
+            assert self.mask.shape == in_img.shape[:3]
+
     def _load(self, in_file, mask_file=None):
         stem, ext = splitext(in_file)
         self.stem, self.ext = stem, ext
@@ -52,28 +88,18 @@ class Transformer(SimpleInterface):
             self.in_img = in_img
 
             n = nvol(in_img)
-            in_fdata = in_img.get_fdata(dtype=np.float64)
+            in_fdata = in_img.get_fdata(dtype=self.dtype)
             array = in_fdata.reshape((-1, n)).T
 
-            if mask_file is None:
-                mask_file = self.inputs.mask
-            if isdefined(mask_file) and isinstance(mask_file, str) and Path(mask_file).is_file():
-                mask_img = nib.load(mask_file)
-                assert nvol(mask_img) == 1
-                assert np.allclose(mask_img.affine, in_img.affine)
-                mask_fdata = mask_img.get_fdata(dtype=np.float64)
-                mask_bin = np.logical_not(
-                    np.logical_or(mask_fdata <= 0, np.isclose(mask_fdata, 0, atol=1e-2))
-                )
-                self.mask = mask_bin
-                assert self.mask.size == array.shape[1]
+            self._load_mask(in_img, mask_file=mask_file)
+            if self.mask is not None:
                 array = array[:, np.ravel(self.mask)]
 
         else:
             in_df = loadspreadsheet(in_file)
             self.in_df = in_df
 
-            array = in_df.to_numpy().astype(np.float64)
+            array = in_df.to_numpy().astype(self.dtype)
 
         return array
 
@@ -87,12 +113,12 @@ class Transformer(SimpleInterface):
 
             if self.mask is not None:
                 m, n = array2.T.shape
-                out_array = np.zeros((*in_img.shape[:3], n))
+                out_array = np.zeros((*in_img.shape[:3], n), dtype=self.dtype)
                 out_array[self.mask, :] = array2.T
             else:
-                out_array = array2.T.reshape((*in_img.shape[:3], -1))
+                out_array = array2.T.reshape((*in_img.shape[:3], -1)).astype(self.dtype, copy=False)
 
-            out_img = new_img_like(in_img, out_array, copy_header=True)
+            out_img = self._new_img_like(in_img, out_array)
             nib.save(out_img, out_file)
 
         else:
@@ -106,16 +132,101 @@ class Transformer(SimpleInterface):
 
         return out_file
 
+    def _can_stream(self, *in_files):
+        if not self.voxel_separable or not isdefined(self.inputs.stream_mem_gb):
+            return False
+
+        return all(splitext(in_file)[1] in [".nii", ".nii.gz"] for in_file in in_files)
+
+    def _open(self, in_file, scratch_dir, mask_file=None):
+        """
+        copy an image volume by volume to a memory-mapped array of observations x voxels,
+        so that blocks of voxels can be read without loading the whole image
+        """
+        stem, ext = splitext(in_file)
+        self.stem, self.ext = stem, ext
+
+        in_img = nib.load(in_file, keep_file_open=True)  # read compressed files sequentially
+        self.in_img = in_img
+
+        n = nvol(in_img)
+        m = int(np.prod(in_img.shape[:3]))
+
+        with NamedTemporaryFile(dir=scratch_dir, suffix=".npy", delete=False) as file_handle:
+            array = np.lib.format.open_memmap(file_handle.name, mode="w+", dtype=self.dtype, shape=(n, m))
+
+        for i in range(n):
+            if in_img.ndim > 3:
+                volume = in_img.dataobj[..., i]
+            else:
+                volume = in_img.dataobj[...]
+            array[i, :] = np.ravel(np.asanyarray(volume, dtype=self.dtype))
+
+        self._load_mask(in_img, mask_file=mask_file)
+        if self.mask is not None:
+            voxels = np.flatnonzero(self.mask)
+        else:
+            voxels = np.arange(m)
+
+        return array, voxels
+
+    def _stream(self, in_file, func, scratch_dir):
+        """
+        apply func(array, index) to blocks of voxels and write the result to a memory-mapped
+        output, where index selects the block from the full image
+        """
+        array, voxels = self._open(in_file, scratch_dir)
+        n, m = array.shape
+
+        block_size = int(self.inputs.stream_mem_gb * 2 ** 30) // (self.stream_copies * n * array.itemsize)
+        block_size = max(1, block_size)
+
+        out_array = None
+        for start in range(0, max(voxels.size, 1), block_size):
+            if self.mask is None:  # contiguous block
+                index = slice(start, min(start + block_size, m))
+            else:
+                index = voxels[start:start + block_size]
+
+            array2 = func(np.array(array[:, index]), index)
+
+            if out_array is None:  # the number of output observations may differ
+                with NamedTemporaryFile(dir=scratch_dir, suffix=".npy", delete=False) as file_handle:
+                    out_array = np.lib.format.open_memmap(
+                        file_handle.name, mode="w+", dtype=self.dtype, shape=(array2.shape[0], m)
+                    )  # initialized to zero
+
+            out_array[:, index] = array2
+
+        stem, ext = self.stem, self.ext
+
+        out_file = str(Path(f"{stem}_{self.suffix}{ext}").resolve())
+
+        in_img = self.in_img
+
+        out_array = out_array.T.reshape((*in_img.shape[:3], -1))  # view without copying
+
+        out_img = self._new_img_like(in_img, out_array)
+        nib.save(out_img, out_file)
+
+        return out_file
+
     def _run_interface(self, runtime):
         self._merged_file = None
 
         in_file = self.inputs.in_file
 
-        array = self._load(in_file)  # observations x variables
+        if self._can_stream(in_file):
+            with TemporaryDirectory(dir=Path.cwd()) as scratch_dir:
+                out_file = self._stream(in_file, lambda array, _: self._transform(array), scratch_dir)
+
+        else:
+            array = self._load(in_file)  # observations x variables
+
+            array2 = self._transform(array)
 
-        array2 = self._transform(array)
+            out_file = self._dump(array2)
 
-        out_file = self._dump(array2)
         self._results["out_file"] = out_file
 
         return runtime
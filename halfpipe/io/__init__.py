@@ -10,6 +10,10 @@ from .file import (
     make_cachefilepath,
     cacheobj,
     uncacheobj,
+    CachedChunks,
+    make_chunksdirpath,
+    cachechunks,
+    uncachechunks,
 )
 
 from .parse import (
@@ -45,6 +49,10 @@ __all__ = [
     make_cachefilepath,
     cacheobj,
     uncacheobj,
+    CachedChunks,
+    make_chunksdirpath,
+    cachechunks,
+    uncachechunks,
     BidsDatabase,
     ExcludeDatabase,
     Database,
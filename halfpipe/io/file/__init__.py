@@ -6,6 +6,7 @@ from .dictlistfile import DictListFile
 from .indexedfile import IndexedFile
 
 from .pickle import loadpicklelzma, dumppicklelzma, make_cachefilepath, cacheobj, uncacheobj
+from .chunks import CachedChunks, make_chunksdirpath, cachechunks, uncachechunks
 
 __all__ = [
     DictListFile,
@@ -15,4 +16,8 @@ __all__ = [
     make_cachefilepath,
     cacheobj,
     uncacheobj,
+    CachedChunks,
+    make_chunksdirpath,
+    cachechunks,
+    uncachechunks,
 ]
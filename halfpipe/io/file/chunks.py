@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+"""
+a list of objects that are pickled to one uncompressed file each, so that
+a single chunk can be loaded without reading the others
+"""
+
+from collections.abc import Sequence
+import json
+import logging
+import os
+from pathlib import Path
+import pickle
+from tempfile import NamedTemporaryFile
+
+from traits.trait_errors import TraitError
+
+manifest_name = "manifest.json"
+
+
+def loadpickle(filepath):
+    try:
+        with open(filepath, "rb") as fptr:
+            return pickle.load(fptr)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        pass
+    except TraitError:
+        pass  # this can happen when trait type checks are re-run during unpickling
+
+
+def dumppickle(filepath, obj):
+    filepath = Path(filepath)
+    with NamedTemporaryFile(dir=filepath.parent, suffix=".pickle", delete=False) as fptr:
+        pickle.dump(obj, fptr, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(fptr.name, filepath)  # readers never see partial files
+
+
+def make_chunksdirpath(typestr, uuid):
+    if uuid is not None:
+        uuidstr = str(uuid)[:8]
+        return f"{typestr}.{uuidstr}.chunks"
+    return f"{typestr}.chunks"
+
+
+class CachedChunks(Sequence):
+    """
+    loads the chunks on access, without keeping them in memory
+    """
+
+    def __init__(self, manifest_path):
+        self.manifest_path = Path(manifest_path)
+        with open(self.manifest_path, "r") as fp:
+            manifest = json.load(fp)
+        self.uuid = manifest["uuid"]
+        self.chunk_names = manifest["chunks"]
+
+    def __len__(self):
+        return len(self.chunk_names)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("chunk index out of range")
+        path = self.manifest_path.parent / self.chunk_names[index]
+        obj = loadpickle(path)
+        if obj is None:
+            raise ValueError(f'Could not load chunk from "{path}"')
+        return obj
+
+    @classmethod
+    def dump(cls, dirpath, objs, uuid=None):
+        dirpath = Path(dirpath)
+        dirpath.mkdir(parents=True, exist_ok=True)
+
+        chunk_names = list()
+        for i, obj in enumerate(objs):
+            chunk_name = f"chunk_{i + 1:d}.pickle"
+            dumppickle(dirpath / chunk_name, obj)
+            chunk_names.append(chunk_name)
+
+        manifest = dict(uuid=str(uuid) if uuid is not None else None, chunks=chunk_names)
+        with NamedTemporaryFile(mode="w", dir=dirpath, suffix=".json", delete=False) as fp:
+            json.dump(manifest, fp, indent=4)
+        os.replace(fp.name, dirpath / manifest_name)  # written last, marks the cache as complete
+
+        return cls(dirpath / manifest_name)
+
+
+def cachechunks(workdir, typestr, objs, uuid=None):
+    dirpath = Path(workdir) / make_chunksdirpath(typestr, uuid)
+    if dirpath.exists():
+        logging.getLogger("halfpipe").warning(f"Overwrite {dirpath}")
+    return CachedChunks.dump(dirpath, objs, uuid=uuid)
+
+
+def uncachechunks(workdir, typestr, uuid, typedisplaystr=None):
+    if typedisplaystr is None:
+        typedisplaystr = typestr
+    manifest_path = Path(workdir) / make_chunksdirpath(typestr, uuid) / manifest_name
+    if manifest_path.is_file():
+        chunks = CachedChunks(manifest_path)
+        if uuid is not None and chunks.uuid != str(uuid):
+            return
+        logging.getLogger("halfpipe").info(f"Cached {typedisplaystr} from {manifest_path}")
+        return chunks
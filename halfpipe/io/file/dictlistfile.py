@@ -5,6 +5,7 @@
 from pathlib import Path
 import logging
 import json
+from time import time
 from functools import lru_cache
 
 import pandas as pd
@@ -25,14 +26,31 @@ def _compare(a, b):
         return a == b
 
 
+def _tagskey(indict):
+    return frozenset(
+        (k, v) for k, v in indict.items() if k in entities
+    )
+
+
 class DictListFile:
-    def __init__(self, filename, header="report('", footer="');"):
+    """
+    list of dicts that is stored in a javascript file for the reports
+
+    puts are appended to a journal file next to the javascript file, so that
+    the lock is only held briefly. the javascript file is materialized from the
+    journal at most every `max_journal_age` seconds or when `materialize` is called
+    """
+
+    def __init__(self, filename, header="report('", footer="');", max_journal_age=60.0):
         self.filename = Path(filename)
         self.filename.parent.mkdir(parents=True, exist_ok=True)
 
         lockfilename = f"{filename}.lock"
         self.lock = Lock(str(lockfilename))
 
+        self.journal_filename = Path(f"{filename}.journal")
+        self.table_filename = self.filename.parent / f"{self.filename.stem}.txt"
+
         if isinstance(header, str):
             header = header.encode()
         self.header = header
@@ -41,8 +59,10 @@ class DictListFile:
             footer = footer.encode()
         self.footer = footer
 
-        self.dictlist = None
-        self.is_dirty = None
+        self.max_journal_age = max_journal_age
+        self.write_table = False
+
+        self.pending = None
 
     @classmethod
     @lru_cache(maxsize=128)
@@ -50,10 +70,44 @@ class DictListFile:
         return cls(filename, **kwargs)
 
     def __enter__(self):
+        self.pending = []
+        return self
+
+    def __exit__(self, *args):
+        pending, self.pending = self.pending, None
+
+        if len(pending) == 0:
+            return
+
+        jsonstr = "".join(
+            json.dumps(indict, sort_keys=True, ensure_ascii=False) + "\n"
+            for indict in pending
+        )
+
         self.lock.lock()
+        try:
+            with open(str(self.journal_filename), "a") as fp:
+                fp.write(jsonstr)
+        finally:
+            self._unlock()
+
+        if self._is_due():
+            self.materialize()
+
+    def _unlock(self):
+        try:
+            self.lock.unlock()
+        except RuntimeError:
+            pass
+
+    def _is_due(self):
+        try:
+            return time() - self.filename.stat().st_mtime > self.max_journal_age
+        except FileNotFoundError:
+            return True
 
-        self.dictlist = []
-        self.is_dirty = False
+    def _read(self):
+        dictlist = []
         if self.filename.is_file():
             with open(str(self.filename), "rb") as fp:
                 bytesfromfile = fp.read()
@@ -64,28 +118,64 @@ class DictListFile:
                     bytesfromfile = bytesfromfile[: -len(self.footer)]
                 jsonstr = bytesfromfile.decode()
                 jsonstr = jsonstr.replace("\\\n", "")
-                self.dictlist = json.loads(jsonstr)
+                dictlist = json.loads(jsonstr)
             except json.decoder.JSONDecodeError as e:
                 logger.warning("JSONDecodeError %s", e)
-        return self
-
-    def __exit__(self, *args):
-        if self.is_dirty:
-            with open(str(self.filename), "w") as fp:
-                fp.write(self.header.decode())
-                jsonstr = json.dumps(self.dictlist, indent=4, sort_keys=True, ensure_ascii=False)
-                for line in jsonstr.splitlines():
-                    fp.write(line)
-                    fp.write("\\\n")
-                fp.write(self.footer.decode())
+        return dictlist
+
+    def _read_journal(self):
+        indicts = []
+        if self.journal_filename.is_file():
+            with open(str(self.journal_filename), "r") as fp:
+                for line in fp:
+                    try:
+                        indicts.append(json.loads(line))
+                    except json.decoder.JSONDecodeError as e:
+                        logger.warning("JSONDecodeError %s", e)
+        return indicts
+
+    def _write(self, dictlist):
+        tmp_filename = self.filename.parent / f".{self.filename.name}.tmp"
+        with open(str(tmp_filename), "w") as fp:
+            fp.write(self.header.decode())
+            jsonstr = json.dumps(dictlist, indent=4, sort_keys=True, ensure_ascii=False)
+            for line in jsonstr.splitlines():
+                fp.write(line)
+                fp.write("\\\n")
+            fp.write(self.footer.decode())
+        tmp_filename.replace(self.filename)  # readers never see a partial file
+
+    def materialize(self):
+        """
+        apply the journal to the javascript file and the table
+        """
+        self.lock.lock()
         try:
-            self.lock.unlock()
-        except RuntimeError:
-            pass
-        self.dictlist = None
+            dictlist = self._read()
+            indicts = self._read_journal()
 
-    def to_table(self):
-        dictlist = [{str(k): str(v) for k, v in indict.items()} for indict in self.dictlist]
+            index = {_tagskey(curdict): i for i, curdict in enumerate(dictlist)}
+
+            is_dirty = not self.filename.is_file()
+            for indict in indicts:
+                is_dirty |= self._put(dictlist, index, indict)
+
+            if is_dirty:
+                self._write(dictlist)
+            else:
+                self.filename.touch()  # reset journal age
+
+            if self.write_table or self.table_filename.is_file():
+                if is_dirty or not self.table_filename.is_file():
+                    self._write_table(dictlist)
+
+            if len(indicts) > 0:
+                self.journal_filename.unlink()
+        finally:
+            self._unlock()
+
+    def _write_table(self, dictlist):
+        dictlist = [{str(k): str(v) for k, v in indict.items()} for indict in dictlist]
         dataframe = pd.DataFrame.from_records(dictlist)
         dataframe = dataframe.replace({np.nan: ""})
 
@@ -96,38 +186,37 @@ class DictListFile:
 
         table_str = tabulate(dataframe, headers="keys", showindex=False)
 
-        table_filename = self.filename.parent / f"{self.filename.stem}.txt"
-        with open(str(table_filename), "w") as fp:
+        with open(str(self.table_filename), "w") as fp:
             fp.write(table_str)
             fp.write("\n")
 
-    def put(self, indict):
-        assert self.dictlist is not None
+    def to_table(self):
+        """
+        also write a text table when the file is materialized
+        """
+        self.write_table = True
 
-        intags = {
-            k: v for k, v in indict.items() if k in entities
-        }
+    def _put(self, dictlist, index, indict):
+        key = _tagskey(indict)
 
-        matches = False
+        i = index.get(key)
 
-        for i, curdict in enumerate(self.dictlist):
-            curtags = {
-                k: v for k, v in curdict.items() if k in entities
-            }
+        if i is not None:
+            curdict = dictlist[i]
+            if set(indict.keys()) == set(curdict.keys()):
+                if all(_compare(v, curdict[k]) for k, v in indict.items()):
+                    return False  # update not needed
 
-            if set(intags.items()) == set(curtags.items()):
-                if set(indict.keys()) == set(curdict.keys()):
-                    if all(_compare(v, curdict[k]) for k, v in indict.items()):
-                        return  # update not needed
+            curdict.update(indict)
+            logger.debug(f"Updating {self.filename} entry {curdict} with {indict}")
 
-                matches = True
+        else:
+            index[key] = len(dictlist)
+            dictlist.append(indict)
 
-                break
+        return True
 
-        self.is_dirty = True  # will need to write out file
+    def put(self, indict):
+        assert self.pending is not None
 
-        if matches:
-            self.dictlist[i].update(indict)
-            logger.debug(f"Updating {self.filename} entry {curdict} with {indict}")
-        else:
-            self.dictlist.append(indict)
+        self.pending.append(indict)
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+"""
+
+"""
+
+from uuid import uuid4
+
+import pytest
+
+from ..chunks import CachedChunks, cachechunks, uncachechunks
+
+
+def test_CachedChunks(tmp_path):
+    uuid = uuid4()
+    objs = [dict(chunk=i, nodes=list(range(i))) for i in range(5)]
+
+    assert uncachechunks(tmp_path, "execgraph.4_chunks", uuid) is None
+
+    cachechunks(tmp_path, "execgraph.4_chunks", objs, uuid=uuid)
+
+    chunks = uncachechunks(tmp_path, "execgraph.4_chunks", uuid)
+    assert isinstance(chunks, CachedChunks)
+    assert len(chunks) == len(objs)
+    assert chunks[2] == objs[2]
+    assert chunks[-1] == objs[-1]
+    assert list(chunks) == objs
+
+    with pytest.raises(IndexError):
+        chunks[len(objs)]
+
+    (chunkpath,) = tmp_path.glob(f"*/{chunks.chunk_names[3]}")
+    chunkpath.unlink()  # other chunks can still be loaded
+    assert chunks[1] == objs[1]
+    with pytest.raises(ValueError):
+        chunks[3]
+
+    assert uncachechunks(tmp_path, "execgraph.4_chunks", uuid4()) is None
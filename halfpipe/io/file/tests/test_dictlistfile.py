@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+"""
+
+"""
+
+import json
+
+from ..dictlistfile import DictListFile
+
+
+def _load(filename, header="report('", footer="');"):
+    with open(filename, "r") as fp:
+        jsonstr = fp.read()
+    jsonstr = jsonstr[len(header):-len(footer)].replace("\\\n", "")
+    return json.loads(jsonstr)
+
+
+def test_DictListFile(tmp_path):
+    filename = tmp_path / "reportvals.js"
+
+    dlf = DictListFile(filename, max_journal_age=3600.0)
+    dlf.materialize()  # creates the file
+
+    assert _load(filename) == list()
+
+    with dlf:
+        dlf.put(dict(sub="01", task="rest", fd_mean=0.1))
+        dlf.put(dict(sub="02", task="rest", fd_mean=0.2))
+        dlf.to_table()
+
+    assert _load(filename) == list()  # not due yet
+    assert dlf.journal_filename.is_file()
+
+    with dlf:
+        dlf.put(dict(sub="01", task="rest", fd_mean=0.3))  # update
+        dlf.put(dict(sub="01", task="faces", fd_mean=0.4))
+
+    dlf.materialize()
+
+    assert not dlf.journal_filename.is_file()
+    assert _load(filename) == [
+        dict(sub="01", task="rest", fd_mean=0.3),
+        dict(sub="02", task="rest", fd_mean=0.2),
+        dict(sub="01", task="faces", fd_mean=0.4),
+    ]
+    assert dlf.table_filename.is_file()
+
+    # materialize when the file is older than the maximum journal age
+    dlf = DictListFile(filename, max_journal_age=0.0)
+    with dlf:
+        dlf.put(dict(sub="03", task="rest", fd_mean=0.5))
+
+    assert not dlf.journal_filename.is_file()
+    assert len(_load(filename)) == 4
@@ -2,9 +2,13 @@
 # emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
 # vi: set ft=python sts=4 ts=4 sw=4 et:
 
+import os
 from pathlib import Path
 from os.path import relpath
+from os import readlink
 from shutil import rmtree
+from tempfile import NamedTemporaryFile
+from hashlib import sha1
 import json
 
 from inflection import camelize
@@ -12,7 +16,7 @@ from inflection import camelize
 from calamities.pattern.glob import _rlistdir
 from ...model import FileSchema, entity_longnames, entities
 from ...utils import formatlikebids, splitext, cleaner
-from ..metadata import canonicalize_direction_code
+from ..metadata import canonicalize_direction_code, metadata_cache
 
 from bids.layout import Config
 from bids.layout.writing import build_path
@@ -77,58 +81,47 @@ class BidsDatabase:
         if tagdict is not None:
             return tagdict.get(entity)
 
-    def write(self, bidsdir):
-        bidsdir = Path(bidsdir)
-        if bidsdir.is_symlink():
-            raise ValueError("Will not write to symlink")
-        bidsdir.mkdir(parents=True, exist_ok=True)
-
-        bidspaths = set()
-
-        dataset_description_path = bidsdir / "dataset_description.json"
-        bidspaths.add(dataset_description_path)
+    def _schema(self, filepath):
+        schema = FileSchema
+        while hasattr(schema, "type_field") and hasattr(schema, "type_schemas"):
+            v = self.database.tagval(filepath, schema.type_field)
+            schema = schema.type_schemas[v]
+        return schema
 
-        dataset_description = {
-            "Name": self.database.sha1,
-            "BIDSVersion": bidsversion,
-            "DatasetType": "raw",
-        }
+    def _sidecars(self):
+        """
+        metadata for the sidecar of each bidspath, where metadata is read for all
+        files of the same type at once
+        """
+        filepaths_by_schemas = dict()
+        for filepath in self.filepaths_by_bidspaths.values():
+            schema = self._schema(filepath)
+            if schema not in filepaths_by_schemas:
+                filepaths_by_schemas[schema] = list()
+            filepaths_by_schemas[schema].append(filepath)
 
-        with open(dataset_description_path, "w") as f:
-            json.dump(dataset_description, f, indent=4)
+        metadata_cache.prefetch(list(self.filepaths_by_bidspaths.values()))
 
-        # image files
-        for bidspath, filepath in self.filepaths_by_bidspaths.items():
-            bidspath = Path(bidsdir) / bidspath
-            bidspaths.add(bidspath)
-            bidspath.parent.mkdir(parents=True, exist_ok=True)
+        metadata_keys_by_schemas = dict()
+        for schema, filepaths in filepaths_by_schemas.items():
+            instance = schema()
+            metadata_keys = list()
+            if "metadata" in instance.fields:
+                metadata_keys = list(instance.fields["metadata"].nested().fields.keys())
+                for k in metadata_keys:
+                    self.database.fillmetadata(k, filepaths)
+            metadata_keys_by_schemas[schema] = metadata_keys
 
-            if bidspath.is_file():
-                continue  # ignore real files
-            elif bidspath.is_symlink():
-                if bidspath.resolve() == Path(filepath).resolve():
-                    continue  # nothing to be done
-                else:
-                    bidspath.unlink()  # symlink points to different file
-            relfilepath = relpath(filepath, start=bidspath.parent)
-            bidspath.symlink_to(relfilepath)
-
-        # sidecar files
+        sidecars = dict()
         for bidspath, filepath in self.filepaths_by_bidspaths.items():
-            schema = FileSchema
-            while hasattr(schema, "type_field") and hasattr(schema, "type_schemas"):
-                v = self.database.tagval(filepath, schema.type_field)
-                schema = schema.type_schemas[v]
-            instance = schema()
+            schema = self._schema(filepath)
 
             bidsmetadata = dict()
-            if "metadata" in instance.fields:
-                metadata_keys = list(instance.fields["metadata"].nested().fields.keys())
+            if len(metadata_keys_by_schemas[schema]) > 0:
                 task = self.database.tagval(filepath, "task")
                 if task is not None:
                     bidsmetadata["TaskName"] = task
-                for k in metadata_keys:
-                    self.database.fillmetadata(k, [filepath])
+                for k in metadata_keys_by_schemas[schema]:
                     v = self.database.metadata(filepath, k)
                     if v is not None:
                         # transform metadata
@@ -166,29 +159,119 @@ class BidsDatabase:
 
             if len(bidsmetadata) > 0:
                 basename, _ = splitext(bidspath)
-                sidecarpath = Path(bidsdir) / Path(bidspath).parent / f"{basename}.json"
-                bidspaths.add(sidecarpath)
-                jsonstr = json.dumps(bidsmetadata, indent=4, sort_keys=True)
-                if sidecarpath.is_file():
-                    with open(sidecarpath, "r") as f:
-                        if jsonstr == f.read():
-                            continue
-                with open(sidecarpath, "w") as f:
-                    f.write(jsonstr)
+                sidecarpath = str(Path(bidspath).parent / f"{basename}.json")
+                sidecars[sidecarpath] = bidsmetadata
+
+        return sidecars
+
+    def write(self, bidsdir, manifest_path=None):
+        """
+        only applies the changes since the last write, which are found by comparing to
+        a manifest of the files that were written. the files in the manifest are assumed
+        to be unchanged. without a manifest, the directory is scanned for files to remove
+        """
+        bidsdir = Path(bidsdir)
+        if bidsdir.is_symlink():
+            raise ValueError("Will not write to symlink")
+        bidsdir.mkdir(parents=True, exist_ok=True)
+
+        if manifest_path is None:
+            manifest_path = bidsdir.parent / f"{bidsdir.name}.manifest.json"
+        manifest_path = Path(manifest_path)
+
+        manifest = None
+        try:
+            with open(manifest_path, "r") as f:
+                manifest = json.load(f)
+            links, jsonhashes = manifest["links"], manifest["sidecars"]
+        except (OSError, ValueError, KeyError, TypeError):
+            manifest = None
+        if not (bidsdir / "dataset_description.json").is_file():
+            manifest = None  # directory was removed
+        if manifest is None:
+            links, jsonhashes = dict(), dict()
+
+        # target state
+        target_links = dict()
+        for bidspath, filepath in self.filepaths_by_bidspaths.items():
+            target_links[str(bidspath)] = relpath(filepath, start=(bidsdir / bidspath).parent)
+
+        dataset_description = {
+            "Name": self.database.sha1,
+            "BIDSVersion": bidsversion,
+            "DatasetType": "raw",
+        }
+        target_jsonstrs = {"dataset_description.json": json.dumps(dataset_description, indent=4)}
+        for sidecarpath, bidsmetadata in self._sidecars().items():
+            target_jsonstrs[sidecarpath] = json.dumps(bidsmetadata, indent=4, sort_keys=True)
+        target_jsonhashes = {
+            path: sha1(jsonstr.encode()).hexdigest() for path, jsonstr in target_jsonstrs.items()
+        }
+
+        # apply diff
+        parents = set(
+            (bidsdir / path).parent for path in [*target_links.keys(), *target_jsonstrs.keys()]
+        )
+        for parent in sorted(parents):
+            parent.mkdir(parents=True, exist_ok=True)
+
+        for path, target in target_links.items():
+            if links.get(path) == target:
+                continue  # nothing to be done
+            bidspath = bidsdir / path
+            if bidspath.is_symlink():
+                if readlink(bidspath) == target:
+                    continue
+                bidspath.unlink()  # symlink points to different file
+            elif bidspath.exists():
+                continue  # ignore real files
+            bidspath.symlink_to(target)
+
+        for path, jsonstr in target_jsonstrs.items():
+            if jsonhashes.get(path) == target_jsonhashes[path]:
+                continue
+            sidecarpath = bidsdir / path
+            if sidecarpath.is_file() and not sidecarpath.is_symlink():
+                with open(sidecarpath, "r") as f:
+                    if jsonstr == f.read():
+                        continue
+            with open(sidecarpath, "w") as f:
+                f.write(jsonstr)
 
         # remove unnecessary files
-        files_to_keep = set()
-        for bidspath in bidspaths:
-            relbidspath = relpath(bidspath, start=bidsdir)
-            # use relative paths to limit parents to bidsdir
-            files_to_keep.add(relbidspath)
-            files_to_keep.update(map(str, Path(relbidspath).parents))
-
-        for filepath in _rlistdir(bidsdir, False):
-            relfilepath = relpath(filepath, start=bidsdir)
-            if relfilepath not in files_to_keep:
-                p = Path(filepath)
-                if not p.is_dir():
-                    p.unlink()
-                else:
-                    rmtree(p)
+        target_paths = set(target_links.keys()) | set(target_jsonstrs.keys())
+        if manifest is not None:
+            stale_paths = (set(links.keys()) | set(jsonhashes.keys())) - target_paths
+            stale_parents = set()
+            for path in stale_paths:
+                bidspath = bidsdir / path
+                if bidspath.is_symlink() or bidspath.is_file():
+                    bidspath.unlink()
+                stale_parents.update(bidspath.parents)
+            for parent in sorted(stale_parents, key=lambda p: len(p.parts), reverse=True):
+                if bidsdir in parent.parents:
+                    try:
+                        parent.rmdir()  # only if empty
+                    except OSError:
+                        pass
+        else:
+            files_to_keep = set()
+            for relbidspath in target_paths:
+                # use relative paths to limit parents to bidsdir
+                files_to_keep.add(relbidspath)
+                files_to_keep.update(map(str, Path(relbidspath).parents))
+
+            for filepath in _rlistdir(str(bidsdir), False):
+                relfilepath = relpath(filepath, start=bidsdir)
+                if relfilepath not in files_to_keep:
+                    p = Path(filepath)
+                    if not p.is_dir():
+                        p.unlink()
+                    else:
+                        rmtree(p)
+
+        # written last, so that an interrupted write is repeated
+        manifest = dict(links=target_links, sidecars=target_jsonhashes)
+        with NamedTemporaryFile(mode="w", dir=manifest_path.parent, suffix=".json", delete=False) as f:
+            json.dump(manifest, f)
+        os.replace(f.name, manifest_path)
@@ -8,56 +8,101 @@
 
 from hashlib import sha1
 
+import numpy as np
+
 from .resolve import ResolvedSpec
-from ..metadata import MetadataLoader
+from ..metadata import MetadataLoader, metadata_cache
 from ...model import entities
 from ...utils import first
 
 
 class Database:
-    def __init__(self, spec):
+    """
+    files are identified by integer ids in the order in which they were indexed, and the
+    files that have a tag value are stored as bitsets, which are python integers where bit
+    i is set if file i has the tag value
+    """
+
+    def __init__(self, spec, cache_dir=None):
         resolved_spec = None
         if isinstance(spec, ResolvedSpec):
             resolved_spec = spec
         if resolved_spec is None:
-            resolved_spec = ResolvedSpec(spec)
+            resolved_spec = ResolvedSpec(spec, cache_dir=cache_dir)
         self.resolved_spec = resolved_spec
 
         self.metadata_loader = MetadataLoader(self)
 
-        self.filepaths_by_tags = dict()
+        self.filepaths = list()  # by file id
+        self.file_ids = dict()
+
+        self.bitsets_by_tags = dict()  # entity -> tagval -> bitset
         self.tags_by_filepaths = dict()
+        self.tagvals_by_file_ids = list()  # entity -> tagvals, including intended for
+
+        self._sha1 = sha1()  # updated as files are indexed
 
         for file_obj in self.resolved_spec.resolved_files:
             self.index(file_obj)
 
     def __hash__(self):
-        return hash(tuple(self.tags_by_filepaths.keys()))
+        return hash(tuple(self.filepaths))
 
     @property
     def sha1(self):
-        hash = sha1()
-        for filepath in self.tags_by_filepaths.keys():
-            hash.update(filepath.encode())
-        return hash.hexdigest()
+        return self._sha1.hexdigest()
 
     def put(self, spec_fileobj):
         resolved_files = self.resolved_spec.put(spec_fileobj)
         for resolved_fileobj in resolved_files:
             self.index(resolved_fileobj)
 
+    def _file_id(self, filepath):
+        file_id = self.file_ids.get(filepath)
+        if file_id is None:
+            file_id = len(self.filepaths)
+            self.filepaths.append(filepath)
+            self.file_ids[filepath] = file_id
+            self.tagvals_by_file_ids.append(dict())
+            self._sha1.update(filepath.encode())
+        return file_id
+
+    def _to_bitset(self, filepaths):
+        file_ids = [self.file_ids[filepath] for filepath in filepaths if filepath in self.file_ids]
+        is_selected = np.zeros(len(self.filepaths), dtype=bool)
+        is_selected[file_ids] = True
+        return int.from_bytes(np.packbits(is_selected, bitorder="little").tobytes(), "little")
+
+    def _from_bitset(self, bitset):
+        nbytes = (len(self.filepaths) + 7) // 8
+        is_selected = np.unpackbits(
+            np.frombuffer(bitset.to_bytes(nbytes, "little"), dtype=np.uint8), bitorder="little"
+        )
+        return [self.filepaths[file_id] for file_id in np.flatnonzero(is_selected)]
+
+    def _bitset(self, entity, tagval):
+        tagvaldict = self.bitsets_by_tags.get(entity)
+        if tagvaldict is not None:
+            return tagvaldict.get(tagval, 0)
+        return 0
+
     def index(self, fileobj):
-        def add_tag_to_index(filepath, entity, tagval):
+        filepath = fileobj.path
+        file_id = self._file_id(filepath)
+        file_bit = 1 << file_id
+        file_tagvals = self.tagvals_by_file_ids[file_id]
+
+        def add_tag_to_index(entity, tagval):
             if tagval is None:
                 return
-            if entity not in self.filepaths_by_tags:
-                self.filepaths_by_tags[entity] = dict()
-            tagvaldict = self.filepaths_by_tags[entity]
-            if tagval not in tagvaldict:
-                tagvaldict[tagval] = set()
-            tagvaldict[tagval].add(filepath)
-
-        filepath = fileobj.path
+            if entity not in self.bitsets_by_tags:
+                self.bitsets_by_tags[entity] = dict()
+            tagvaldict = self.bitsets_by_tags[entity]
+            tagvaldict[tagval] = tagvaldict.get(tagval, 0) | file_bit
+            if entity not in file_tagvals:
+                file_tagvals[entity] = list()
+            if tagval not in file_tagvals[entity]:
+                file_tagvals[entity].append(tagval)
 
         tags = dict()
         if hasattr(fileobj, "tags"):
@@ -72,7 +117,7 @@ class Database:
         self.tags_by_filepaths[filepath] = tagdict
 
         for tagname, tagval in tagdict.items():
-            add_tag_to_index(filepath, tagname, tagval)
+            add_tag_to_index(tagname, tagval)
 
         if hasattr(fileobj, "intended_for"):
             intended_for = fileobj.intended_for
@@ -83,7 +128,7 @@ class Database:
                     continue
                 for v in vlist:
                     to_entity, to_tagval = v.split(".")
-                    add_tag_to_index(filepath, to_entity, to_tagval)
+                    add_tag_to_index(to_entity, to_tagval)
 
     def tags(self, filepath):
         """
@@ -108,38 +153,42 @@ class Database:
             return tagdict.get(entity)
 
     def tagvaldict(self, entity):
-        return self.filepaths_by_tags.get(entity)
+        tagvaldict = self.bitsets_by_tags.get(entity)
+        if tagvaldict is not None:
+            return {
+                tagval: set(self._from_bitset(bitset))
+                for tagval, bitset in tagvaldict.items()
+            }
 
     def get(self, **filters):
         res = None
         for tagname, tagval in filters.items():
-            if tagname in self.filepaths_by_tags and tagval in self.filepaths_by_tags[tagname]:
-                cur_set = self.filepaths_by_tags[tagname][tagval]
-                if res is not None:
-                    res &= cur_set
-                else:
-                    res = cur_set.copy()
+            cur_bitset = self._bitset(tagname, tagval)
+            if res is not None:
+                res &= cur_bitset
             else:
-                res = None
+                res = cur_bitset
+            if res == 0:
                 break
         if res is None:
             return set()
-        return res
+        return set(self._from_bitset(res))
 
     def filter(self, filepaths, **filters):
-        res = set(filepaths)
+        res = self._to_bitset(filepaths)
 
         for entity, tagval in filters.items():
-            cur_set = self.filepaths_by_tags[entity][tagval]
-            res &= cur_set
+            res &= self.bitsets_by_tags[entity][tagval]
 
-        return res
+        return set(self._from_bitset(res))
 
     def applyfilters(self, filepaths, filters):
         if not isinstance(filters, (tuple, list)) and hasattr(filters, "filters"):
             return self.applyfilters(filepaths, filters.filters)
 
-        res = set(filepaths)
+        filepaths = set(filepaths)
+        unknown = set(filepath for filepath in filepaths if filepath not in self.file_ids)
+        res = self._to_bitset(filepaths)
 
         for filter in filters:
             type = filter.get("type")
@@ -150,23 +199,24 @@ class Database:
                 values = filter.get("values")
                 assert isinstance(values, (list, tuple))
 
-                filterset = set()
+                filterset = 0
                 for value in values:
-                    filterset |= self.filter(filepaths, **{entity: value})
+                    filterset |= self.bitsets_by_tags[entity][value]
 
                 action = filter.get("action")
 
                 if action == "include":
                     res &= filterset
+                    unknown = set()
                 elif action == "exclude":
-                    res -= filterset
+                    res &= ~filterset
                 else:
                     raise ValueError(f'Unsupported filter action "{action}"')
 
             else:
                 raise ValueError(f'Unsupported filter type "{type}"')
 
-        return res
+        return set(self._from_bitset(res)) | unknown
 
     def matches(self, filepath, **filters):
         for entity, querytagval in filters.items():
@@ -176,39 +226,49 @@ class Database:
         return True
 
     def associations(self, filepath, **filters):
-        res = self.get(**filters)
+        res = None
+        for tagname, tagval in filters.items():
+            cur_bitset = self._bitset(tagname, tagval)
+            res = cur_bitset if res is None else res & cur_bitset
+        if res is None:
+            return
+
+        file_id = self.file_ids.get(filepath)
+        file_tagvals = self.tagvals_by_file_ids[file_id] if file_id is not None else dict()
+
         for entity in reversed(entities):  # from high to low priority
-            if entity not in self.filepaths_by_tags:
+            if entity not in self.bitsets_by_tags:
                 continue
-            cur_set = set()
-            for k, filepaths in self.filepaths_by_tags[entity].items():
-                if filepath in filepaths:
-                    cur_set |= set(filepaths)
-            cur_set &= res
-            if len(cur_set) > 0:
-                res = cur_set
-            if len(cur_set) == 1:
+            cur_bitset = 0
+            for tagval in file_tagvals.get(entity, list()):
+                cur_bitset |= self.bitsets_by_tags[entity][tagval]
+            cur_bitset &= res
+            if cur_bitset != 0:
+                res = cur_bitset
+            if cur_bitset & (cur_bitset - 1) == 0 and cur_bitset != 0:  # exactly one file
                 break
-        if len(res) > 0:
-            return tuple(res)
+        if res != 0:
+            return tuple(self._from_bitset(res))
 
     def tagvalset(self, entity, filepaths=None):
         if not isinstance(entity, str):
             return
-        if entity not in self.filepaths_by_tags:
+        if entity not in self.bitsets_by_tags:
             return
         if filepaths is not None:
-            if not isinstance(filepaths, set):
-                filepaths = set(filepaths)
+            mask = self._to_bitset(filepaths)
             return set(
                 tagval
-                for tagval, tagvalfilepaths in self.filepaths_by_tags[entity].items()
-                if not filepaths.isdisjoint(tagvalfilepaths)
+                for tagval, bitset in self.bitsets_by_tags[entity].items()
+                if bitset & mask != 0
             )
         else:
-            return set(self.filepaths_by_tags[entity].keys())
+            return set(self.bitsets_by_tags[entity].keys())
 
     def multitagvalset(self, entitylist, filepaths=None, prune=True):
+        if filepaths is not None and not isinstance(filepaths, (list, tuple, set)):
+            filepaths = list(filepaths)
+
         if prune:
             pruned_entitylist = []
             for entity in entitylist:
@@ -218,7 +278,7 @@ class Database:
             entitylist = pruned_entitylist
 
         if filepaths is None:
-            filepaths = self.tags_by_filepaths.keys()
+            filepaths = self.filepaths
 
         return (
             entitylist,
@@ -246,6 +306,13 @@ class Database:
             found_all = found_all and found
         return found
 
+    def prefetchmetadata(self):
+        """
+        read the headers and sidecars of all nifti files at once
+        """
+        niftifiles = self.get(extension=".nii.gz") | self.get(extension=".nii")
+        metadata_cache.prefetch(sorted(niftifiles))
+
     def metadata(self, filepath, key):
         fileobj = self.fileobj(filepath)
         if fileobj is not None and hasattr(fileobj, "metadata"):
@@ -6,15 +6,19 @@
 
 """
 
+import os
 import logging
+import shutil
+from pathlib import Path
 
 from marshmallow import EXCLUDE
 import marshmallow.exceptions
 
-from calamities.pattern import tag_glob, tag_parse, get_entities_in_path
+from calamities.pattern import tag_parse, get_entities_in_path
 
-from ...model import FileSchema, entities, entity_longnames
-from ...utils import splitext
+from .scan import DirectoryCache, tag_glob
+from ...model import File, FileSchema, entities, entity_longnames
+from ...utils import splitext, hexdigest, deepcopy
 
 import bids
 
@@ -26,9 +30,14 @@ entity_shortnames = {v: k for k, v in entity_longnames.items()}
 
 
 class ResolvedSpec:
-    def __init__(self, spec):
+    def __init__(self, spec, cache_dir=None):
         self.spec = spec
 
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self.dircache = DirectoryCache(
+            self.cache_dir / "dircache.json" if self.cache_dir is not None else None
+        )
+
         self.fileobj_by_filepaths = dict()
 
         self.specfileobj_by_filepaths = dict()
@@ -37,16 +46,20 @@ class ResolvedSpec:
         for fileobj in self.spec.files:
             self.resolve(fileobj)
 
+        self.dircache.save()
+
     @property
     def resolved_files(self):
         yield from self.fileobj_by_filepaths.values()
 
     def put(self, fileobj):
         self.spec.put(fileobj)
-        return self.resolve(fileobj)
+        resolved_files = self.resolve(fileobj)
+        self.dircache.save()
+        return resolved_files
 
     def _resolve_fileobj_with_tags(self, fileobj):
-        tagglobres = list(tag_glob(fileobj.path))
+        tagglobres = list(tag_glob(fileobj.path, self.dircache))
         if len(tagglobres) == 0:
             logging.getLogger("halfpipe").warning(f'No files found for query "{fileobj.path}"')
 
@@ -56,18 +69,27 @@ class ResolvedSpec:
 
         resolved_files = []
 
+        basefiledict = file_schema.dump(fileobj)
+        templates = dict()  # validated objects by extension and tag names
+
         for filepath, tagdict in tagglobres:
-            filedict = file_schema.dump(fileobj)
+            _, extension = splitext(filepath)
 
-            filedict["path"] = filepath
-            _, filedict["extension"] = splitext(filepath)
+            tagdict.update(basefiledict.get("tags", {}))
 
-            tagdict.update(filedict.get("tags", {}))
-            filedict["tags"] = tagdict
+            key = (extension, tuple(sorted(tagdict.keys())))
+            template = templates.get(key)
 
-            filedict["tmplstr"] = tmplstr
+            if template is None:  # only validate the first file of each kind
+                filedict = deepcopy(basefiledict)
+                filedict.update(path=filepath, extension=extension, tags=tagdict, tmplstr=tmplstr)
 
-            resolved_fileobj = file_schema.load(filedict)
+                resolved_fileobj = file_schema.load(filedict)
+                templates[key] = resolved_fileobj
+            else:
+                attrs = deepcopy(vars(template))  # tag values are strings without validation
+                attrs.update(path=filepath, extension=extension, tags=tagdict)
+                resolved_fileobj = File(**attrs)
 
             self.fileobj_by_filepaths[filepath] = resolved_fileobj
             self.specfileobj_by_filepaths[resolved_fileobj.path] = fileobj
@@ -76,8 +98,41 @@ class ResolvedSpec:
 
         return resolved_files
 
+    def _bids_layout_database_path(self, root):
+        """
+        path of the pybids index for the current state of the dataset, and
+        remove the indices of previous states
+        """
+        filestats = list()
+        for filepath in sorted(self.dircache.walk(root)):
+            if filepath.endswith(".json"):  # sidecars can be edited in place
+                try:
+                    st = os.stat(filepath)
+                    filestats.append([filepath, st.st_size, st.st_mtime_ns])
+                    continue
+                except OSError:
+                    pass
+            filestats.append(filepath)
+
+        prefix = f"bidslayout.{hexdigest(root)}"
+        database_path = self.cache_dir / f"{prefix}.{hexdigest(filestats)}"
+        for path in self.cache_dir.glob(f"{prefix}.*"):
+            if path != database_path:  # outdated index of the same dataset
+                shutil.rmtree(path, ignore_errors=True)
+
+        return database_path
+
+    def _bids_layout(self, root):
+        if self.cache_dir is None:
+            return BIDSLayout(root, absolute_paths=True, validate=False)
+
+        database_path = self._bids_layout_database_path(root)
+        return BIDSLayout(
+            root, absolute_paths=True, validate=False, database_path=str(database_path)
+        )  # only indexes the dataset if the files have changed
+
     def _resolve_bids(self, fileobj):
-        layout = BIDSLayout(fileobj.path, absolute_paths=True, validate=False)
+        layout = self._bids_layout(fileobj.path)
 
         basemetadata = dict()
         if hasattr(fileobj, "metadata") and isinstance(fileobj.metadata, dict):
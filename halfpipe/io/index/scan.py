@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+"""
+listing of directories for tag_glob, where directories at the same depth are listed
+in parallel and listings are cached by the modification time of the directory
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+from os import path as op
+from pathlib import Path
+import stat
+from tempfile import NamedTemporaryFile
+from time import time_ns
+
+from calamities.pattern import tag_glob as serial_tag_glob, get_entities_in_path
+from calamities.pattern.glob import has_magic, _translate
+
+min_age_ns = 2 * 10 ** 9  # do not cache directories that changed just now, as mtimes can be coarse
+
+
+def _scandir(dirname):
+    names = list()
+    try:
+        with os.scandir(dirname or os.curdir) as it:
+            for entry in it:
+                if entry.name.startswith("."):  # hidden
+                    continue
+                try:
+                    if entry.is_dir():
+                        names.append(op.join(entry.name, ""))
+                    else:
+                        names.append(entry.name)
+                except OSError:
+                    pass
+    except OSError:
+        pass
+    return names
+
+
+class DirectoryCache:
+    def __init__(self, filename=None, max_workers=None):
+        self.filename = Path(filename) if filename is not None else None
+
+        if max_workers is None:
+            max_workers = min(32, 4 * (os.cpu_count() or 1))
+        self.max_workers = max_workers
+
+        self.listings = dict()  # dirname -> (mtime_ns, names)
+        self.changed = False
+
+        self.load()
+
+    def load(self):
+        if self.filename is None:
+            return
+        try:
+            with open(self.filename, "r") as fp:
+                self.listings = {
+                    dirname: (mtime_ns, names) for dirname, (mtime_ns, names) in json.load(fp).items()
+                }
+        except (OSError, ValueError, TypeError):
+            self.listings = dict()
+
+    def save(self):
+        if self.filename is None or not self.changed:
+            return
+        self.filename.parent.mkdir(parents=True, exist_ok=True)
+        with NamedTemporaryFile(mode="w", dir=self.filename.parent, suffix=".json", delete=False) as fp:
+            json.dump(self.listings, fp)
+        os.replace(fp.name, self.filename)  # concurrent readers never see partial files
+        self.changed = False
+
+    def listdir(self, dirname):
+        """
+        names of the entries of a directory, where subdirectories have a trailing slash
+        """
+        try:
+            st = os.stat(dirname or os.curdir)
+        except OSError:
+            return list()
+        if not stat.S_ISDIR(st.st_mode):
+            return list()
+
+        cached = self.listings.get(dirname)
+        if cached is not None and cached[0] == st.st_mtime_ns:
+            return cached[1]
+
+        names = _scandir(dirname)
+        if time_ns() - st.st_mtime_ns > min_age_ns:
+            self.listings[dirname] = (st.st_mtime_ns, names)
+            self.changed = True
+        return names
+
+    def listdirs(self, dirnames, executor=None):
+        dirnames = list(dict.fromkeys(dirnames))  # unique
+        if executor is None or len(dirnames) < 2:
+            return dict(zip(dirnames, map(self.listdir, dirnames)))
+        return dict(zip(dirnames, executor.map(self.listdir, dirnames)))
+
+    def walk(self, dirname):
+        """
+        paths of all files below a directory
+        """
+        filepaths = list()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            dirnames = [op.join(dirname, "")]
+            while len(dirnames) > 0:
+                listings = self.listdirs(dirnames, executor)
+                dirnames = list()
+                for parent, names in listings.items():
+                    for name in names:
+                        if name.endswith("/"):
+                            dirnames.append(op.join(parent, name))
+                        else:
+                            filepaths.append(op.join(parent, name))
+        return filepaths
+
+
+def tag_glob(pathname, dircache=None):
+    """
+    same results as calamities.pattern.tag_glob, but one level of directories at a time
+    """
+    if dircache is None:
+        dircache = DirectoryCache()
+
+    components = pathname.split("/")
+    if "**" in components:
+        yield from serial_tag_glob(pathname)
+        return
+
+    # directories without magic do not need to be listed
+    i = 0
+    while i < len(components) - 1 and not has_magic(components[i]):
+        i += 1
+    prefix = "/".join(components[:i])
+    if i > 0:
+        prefix = op.join(prefix, "")
+
+    matchers = dict()
+
+    def match(component, tagdict):
+        entities = get_entities_in_path(component)
+        key = (component, tuple((e, tagdict[e]) for e in entities if e in tagdict))
+        if key not in matchers:
+            matchers[key] = _translate(component, None, tagdict)
+        return matchers[key]
+
+    with ThreadPoolExecutor(max_workers=dircache.max_workers) as executor:
+        current = [(prefix, dict())]
+        for j in range(i, len(components)):
+            component = components[j]
+            is_last = j == len(components) - 1
+
+            if not is_last and not has_magic(component):
+                current = [(op.join(dirname, component, ""), tagdict) for dirname, tagdict in current]
+                continue
+
+            listings = dircache.listdirs([dirname for dirname, _ in current], executor)
+
+            matches = list()
+            for dirname, tagdict in current:
+                fullmatch = match(component, tagdict)
+                for name in listings[dirname]:
+                    if not is_last and not name.endswith("/"):
+                        continue  # only directories
+                    matchobj = fullmatch(name)
+                    if matchobj is not None:
+                        matches.append((op.join(dirname, name), {**tagdict, **matchobj.groupdict()}))
+            current = matches
+
+    yield from current
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""
+"""
+
+import json
+import os
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import nibabel as nib
+
+from ..bids import BidsDatabase
+from ..database import Database
+from ....model import FileSchema
+
+
+def make_database(tmp_path):
+    for sub in ["01", "02", "03"]:
+        func_path = tmp_path / "data" / f"sub-{sub}" / "func"
+        func_path.mkdir(parents=True, exist_ok=True)
+        img = nib.Nifti1Image(np.zeros((2, 3, 4, 5), dtype=np.uint8), np.eye(4))
+        img.header.set_xyzt_units(xyz="mm", t="sec")
+        img.header["pixdim"][4] = 2.0
+        img.to_filename(func_path / f"sub-{sub}_task-rest_bold.nii.gz")
+
+    fileobj = FileSchema().load(dict(
+        datatype="func", suffix="bold",
+        path=str(tmp_path / "data" / "sub-{sub}/func/sub-{sub}_task-{task}_bold.nii.gz"),
+    ))
+    return Database(SimpleNamespace(files=[fileobj]))
+
+
+def write(database, bidsdir, subjects):
+    bidsdatabase = BidsDatabase(database)
+    for filepath in database.get(datatype="func", suffix="bold"):
+        if database.tagval(filepath, "sub") in subjects:
+            bidsdatabase.put(filepath)
+    bidsdatabase.write(bidsdir)
+    return bidsdatabase
+
+
+def test_BidsDatabase_write(tmp_path):
+    database = make_database(tmp_path)
+    bidsdir = tmp_path / "rawdata"
+
+    write(database, bidsdir, ["01", "02", "03"])
+    (bidsdir / "extra.txt").touch()  # is removed when there is no manifest
+    (tmp_path / "rawdata.manifest.json").unlink()
+
+    bidsdatabase = write(database, bidsdir, ["01", "02", "03"])
+    assert not (bidsdir / "extra.txt").exists()
+    assert (tmp_path / "rawdata.manifest.json").is_file()
+
+    for filepath in database.get(datatype="func", suffix="bold"):
+        bidspath = bidsdir / bidsdatabase.tobids(filepath)
+        assert bidspath.is_symlink()
+        assert bidspath.resolve() == Path(filepath).resolve()
+
+    sidecarpath = bidsdir / "sub-01" / "func" / "sub-01_task-rest_bold.json"
+    with open(sidecarpath, "r") as f:
+        sidecar = json.load(f)
+    assert sidecar["TaskName"] == "rest"
+    assert sidecar["RepetitionTime"] == 2.0
+
+    os.utime(sidecarpath, ns=(0, 0))
+    write(database, bidsdir, ["01", "02"])
+    assert sidecarpath.stat().st_mtime_ns == 0  # unchanged files are not written again
+    assert not (bidsdir / "sub-03").exists()
+    assert (bidsdir / "sub-02" / "func" / "sub-02_task-rest_bold.nii.gz").is_symlink()
+
+    write(database, bidsdir, ["01", "02", "03"])
+    assert (bidsdir / "sub-03" / "func" / "sub-03_task-rest_bold.json").is_file()
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""
+"""
+
+from collections import defaultdict
+from hashlib import sha1
+import logging
+from random import Random
+from time import time
+from types import SimpleNamespace
+
+from ..database import Database
+from ....model import entities
+
+
+fmap_intended_for = {"datatype.fmap": ["task.rest"]}
+
+
+def make_database(n_subjects, seed=0):
+    database = Database(SimpleNamespace(files=[]))
+
+    random = Random(seed)
+    for i in range(n_subjects):
+        subject = f"{i + 1:04d}"
+        database.index(SimpleNamespace(
+            path=f"/data/sub-{subject}/anat/sub-{subject}_T1w.nii.gz",
+            datatype="anat", suffix="T1w", extension=".nii.gz", tags=dict(sub=subject),
+        ))
+        for task in ["rest", "faces"]:
+            for run in ["1", "2"]:
+                database.index(SimpleNamespace(
+                    path=f"/data/sub-{subject}/func/sub-{subject}_task-{task}_run-{run}_bold.nii.gz",
+                    datatype="func", suffix="bold", extension=".nii.gz",
+                    tags=dict(sub=subject, task=task, run=run),
+                ))
+        if random.random() < 0.5:
+            database.index(SimpleNamespace(
+                path=f"/data/sub-{subject}/fmap/sub-{subject}_fieldmap.nii.gz",
+                datatype="fmap", suffix="fieldmap", extension=".nii.gz", tags=dict(sub=subject),
+                intended_for=fmap_intended_for,
+            ))
+
+    return database
+
+
+def reference_filepaths_by_tags(database):
+    """
+    plain sets of file paths for each tag value, like the database before bitsets
+    """
+    filepaths_by_tags = defaultdict(lambda: defaultdict(set))
+    for filepath, tagdict in database.tags_by_filepaths.items():
+        for entity, tagval in tagdict.items():
+            filepaths_by_tags[entity][tagval].add(filepath)
+        for k, vlist in fmap_intended_for.items():
+            from_entity, from_tagval = k.split(".")
+            if tagdict.get(from_entity) != from_tagval:
+                continue
+            for v in vlist:
+                to_entity, to_tagval = v.split(".")
+                filepaths_by_tags[to_entity][to_tagval].add(filepath)
+    return filepaths_by_tags
+
+
+def reference_associations(filepaths_by_tags, filepath, **filters):
+    res = set.intersection(*(filepaths_by_tags[entity][tagval] for entity, tagval in filters.items()))
+    for entity in reversed(entities):
+        if entity not in filepaths_by_tags:
+            continue
+        cur_set = set()
+        for filepaths in filepaths_by_tags[entity].values():
+            if filepath in filepaths:
+                cur_set |= filepaths
+        cur_set &= res
+        if len(cur_set) > 0:
+            res = cur_set
+        if len(cur_set) == 1:
+            break
+    return res
+
+
+def test_database():
+    database = make_database(10)
+
+    assert database.sha1 == sha1("".join(database.filepaths).encode()).hexdigest()
+
+    bold_files = database.get(datatype="func", suffix="bold")
+    assert len(bold_files) == 40
+    assert database.get(datatype="func", task="missing") == set()
+
+    rest_files = database.filter(bold_files, task="rest")
+    assert len(rest_files) == 20
+    assert all(database.tagval(f, "task") == "rest" for f in rest_files)
+
+    filters = [
+        dict(type="tag", action="include", entity="task", values=["rest", "faces"]),
+        dict(type="tag", action="exclude", entity="sub", values=["0001", "0002"]),
+    ]
+    filtered_files = database.applyfilters(bold_files, filters)
+    assert len(filtered_files) == 32
+
+    assert database.tagvalset("sub", filepaths=rest_files) == {f"{i + 1:04d}" for i in range(10)}
+    entitylist, tagvals = database.multitagvalset(["sub", "task", "run", "dir"], filepaths=rest_files)
+    assert entitylist == ["sub", "run"]
+    assert len(tagvals) == 20
+
+    filepaths_by_tags = reference_filepaths_by_tags(database)
+    for bold_file in bold_files:
+        t1ws = database.associations(bold_file, datatype="anat", suffix="T1w")
+        assert t1ws is not None and len(t1ws) == 1
+        assert database.tagval(t1ws[0], "sub") == database.tagval(bold_file, "sub")
+        assert set(t1ws) == reference_associations(filepaths_by_tags, bold_file, datatype="anat", suffix="T1w")
+
+        fmaps = database.associations(bold_file, datatype="fmap")
+        assert set(fmaps or ()) == reference_associations(filepaths_by_tags, bold_file, datatype="fmap")
+
+    for entity, tagvaldict in filepaths_by_tags.items():
+        assert database.tagvaldict(entity) == tagvaldict
+    assert len(filepaths_by_tags["task"]["rest"]) == 20 + len(database.get(datatype="fmap"))
+
+
+def test_database_unknown_filepaths():
+    database = make_database(10)
+
+    bold_files = database.get(datatype="func", suffix="bold")
+    unknown_file = "/data/sub-0001/func/sub-0001_task-rest_run-3_bold.nii.gz"
+    filepaths = [*bold_files, unknown_file]
+
+    rest_files = database.filter(filepaths, task="rest")
+    assert rest_files == database.filter(bold_files, task="rest")  # unknown files have no tags
+
+    exclude = [dict(type="tag", action="exclude", entity="sub", values=["0001"])]
+    filtered_files = database.applyfilters(filepaths, exclude)
+    assert unknown_file in filtered_files  # cannot be excluded
+    assert filtered_files == database.applyfilters(bold_files, exclude) | {unknown_file}
+
+    include = [dict(type="tag", action="include", entity="task", values=["rest"])]
+    assert database.applyfilters(filepaths, include) == rest_files
+    assert database.applyfilters(filepaths, [*exclude, *include]) == rest_files - database.get(sub="0001")
+    assert database.applyfilters(filepaths, []) == set(filepaths)
+
+
+def test_database_associations_timing():
+    database = make_database(2000)
+    bold_files = sorted(database.get(datatype="func", suffix="bold"))[:1000]
+
+    start = time()
+    for bold_file in bold_files:
+        assert database.associations(bold_file, datatype="anat", suffix="T1w") is not None
+    duration = time() - start
+
+    logging.getLogger("halfpipe").info(
+        f"associations of {len(bold_files)} files among {len(database.filepaths)} took {duration:.3f}s"
+    )
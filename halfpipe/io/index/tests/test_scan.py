@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""
+"""
+
+import json
+import os
+from types import SimpleNamespace
+
+from calamities.pattern import tag_glob as serial_tag_glob
+
+from ..scan import DirectoryCache, tag_glob
+from ..resolve import ResolvedSpec
+from ....model import FileSchema
+
+
+def make_tree(base_path):
+    for sub in ["01", "02", "03"]:
+        for task in ["rest", "faces"]:
+            func_path = base_path / f"sub-{sub}" / "func"
+            func_path.mkdir(parents=True, exist_ok=True)
+            (func_path / f"sub-{sub}_task-{task}_bold.nii.gz").touch()
+            (func_path / f"sub-{sub}_task-{task}_bold.json").touch()
+        (base_path / f"sub-{sub}" / ".hidden").touch()
+    (base_path / "README").touch()
+
+    for dirpath, _, _ in os.walk(base_path):  # make directory listings cacheable
+        os.utime(dirpath, ns=(0, 0))
+
+
+def test_tag_glob(tmp_path):
+    make_tree(tmp_path)
+
+    for pattern in [
+        "sub-{sub}/func/sub-{sub}_task-{task}_bold.nii.gz",
+        "sub-{sub}/func/sub-{sub}_task-{task:rest}_bold.{extension}",
+        "sub-{sub}/{datatype}/",
+        "sub-{sub}/*/*.json",
+    ]:
+        pathname = str(tmp_path / pattern)
+        assert sorted(tag_glob(pathname), key=str) == sorted(serial_tag_glob(pathname), key=str)
+
+
+def test_DirectoryCache(tmp_path):
+    make_tree(tmp_path)
+    filename = tmp_path / "dircache.json"
+
+    dircache = DirectoryCache(filename)
+    pathname = str(tmp_path / "sub-{sub}/func/sub-{sub}_task-{task}_bold.nii.gz")
+    expected = sorted(tag_glob(pathname, dircache), key=str)
+    assert len(expected) == 6
+    assert len(dircache.walk(str(tmp_path))) == 13
+    dircache.save()
+
+    dircache = DirectoryCache(filename)
+    assert os.path.join(tmp_path, "sub-01", "func", "") in dircache.listings
+    assert sorted(tag_glob(pathname, dircache), key=str) == expected
+
+    (tmp_path / "sub-01" / "func" / "sub-01_task-gambling_bold.nii.gz").touch()
+    assert len(list(tag_glob(pathname, dircache))) == 7  # listing is invalidated by the mtime
+
+
+def test_ResolvedSpec(tmp_path):
+    make_tree(tmp_path)
+
+    fileobj = FileSchema().load(dict(
+        datatype="func", suffix="bold",
+        path=str(tmp_path / "sub-{sub}/func/sub-{sub}_task-{task}_bold.nii.gz"),
+        tags=dict(run="1"), metadata=dict(repetition_time=2.0),
+    ))
+    resolved_spec = ResolvedSpec(SimpleNamespace(files=[fileobj]), cache_dir=tmp_path / "filecache")
+
+    resolved_files = sorted(resolved_spec.resolved_files, key=lambda f: f.path)
+    assert len(resolved_files) == 6
+
+    for resolved_file in resolved_files:
+        assert resolved_file.extension == ".nii.gz"
+        assert resolved_file.tags["run"] == "1"
+        assert resolved_file.tags["sub"] in resolved_file.path
+        assert resolved_file.metadata == dict(repetition_time=2.0)
+        assert resolved_spec.specfileobj(resolved_file.path) is fileobj
+
+    assert resolved_files[0].metadata is not resolved_files[1].metadata
+
+    assert (tmp_path / "filecache" / "dircache.json").is_file()
+
+
+def test_ResolvedSpec_bids_layout_database_path(tmp_path):
+    bids_path = tmp_path / "bids"
+    make_tree(bids_path)
+
+    resolved_spec = ResolvedSpec(SimpleNamespace(files=list()), cache_dir=tmp_path / "filecache")
+
+    database_path = resolved_spec._bids_layout_database_path(str(bids_path))
+    database_path.mkdir(parents=True)
+    assert resolved_spec._bids_layout_database_path(str(bids_path)) == database_path
+
+    sidecar_path = bids_path / "sub-01" / "func" / "sub-01_task-rest_bold.json"
+    with open(sidecar_path, "w") as f:
+        json.dump(dict(RepetitionTime=2.0), f)  # edited in place, so the directory listing stays the same
+
+    new_database_path = resolved_spec._bids_layout_database_path(str(bids_path))
+    assert new_database_path != database_path
+    assert not database_path.exists()  # outdated index is removed
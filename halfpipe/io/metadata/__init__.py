@@ -5,11 +5,14 @@
 from .direction import canonicalize_direction_code, direction_code_str
 from .slicetiming import slice_timing_str, str_slice_timing
 from .base import MetadataLoader, SidecarMetadataLoader
+from .cache import MetadataCache, metadata_cache
 
 __all__ = [
     canonicalize_direction_code,
     direction_code_str,
     MetadataLoader,
+    MetadataCache,
+    metadata_cache,
     SidecarMetadataLoader,
     slice_timing_str,
     str_slice_timing,
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+"""
+nifti headers and json sidecars are read once and cached by path, size and modification
+time, so that they do not need to be read again when the workflow is built
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+import json
+import os
+from pathlib import Path
+
+import nibabel as nib
+
+from ..file.chunks import loadpickle, dumppickle
+from ...utils import splitext
+
+header_classes = {
+    "Nifti1Header": nib.Nifti1Header,
+    "Nifti2Header": nib.Nifti2Header,
+}
+
+
+def _filekey(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return
+    return st.st_size, st.st_mtime_ns
+
+
+def _readheader(path):
+    img = nib.load(path, mmap=False, keep_file_open=False)
+    header = img.header
+    header_class_name = type(header).__name__
+    if header_class_name not in header_classes:
+        raise ValueError(f'Unsupported header type "{header_class_name}" for "{path}"')
+    return header_class_name, header.binaryblock
+
+
+def _readjson(path):
+    with open(path, "r") as fp:
+        return json.load(fp)
+
+
+class MetadataCache:
+    def __init__(self, filename=None, max_workers=None):
+        self.filename = None
+
+        if max_workers is None:
+            max_workers = min(32, 4 * (os.cpu_count() or 1))
+        self.max_workers = max_workers
+
+        self.headers = dict()  # path -> (size, mtime_ns, header class name, binary block)
+        self.sidecars = dict()  # path -> (size, mtime_ns, json)
+        self.changed = False
+
+        if filename is not None:
+            self.load(filename)
+
+    def load(self, filename):
+        self.filename = Path(filename)
+        obj = loadpickle(self.filename)
+        if isinstance(obj, dict):
+            self.headers.update(obj.get("headers", dict()))
+            self.sidecars.update(obj.get("sidecars", dict()))
+
+    def save(self):
+        if self.filename is None or not self.changed:
+            return
+        self.filename.parent.mkdir(parents=True, exist_ok=True)
+        dumppickle(self.filename, dict(headers=self.headers, sidecars=self.sidecars))
+        self.changed = False
+
+    def _get(self, entries, path, read):
+        path = str(path)
+        key = _filekey(path)
+        if key is None:
+            raise FileNotFoundError(path)
+        entry = entries.get(path)
+        if entry is not None and entry[:2] == key:
+            return entry[2:]
+        value = read(path)
+        entries[path] = (*key, *value)
+        self.changed = True
+        return value
+
+    def header(self, path):
+        """
+        header of a nifti file, raises an exception if it cannot be read
+        """
+        header_class_name, binaryblock = self._get(self.headers, path, _readheader)
+        return header_classes[header_class_name](binaryblock=binaryblock, check=False)
+
+    def sidecar(self, path):
+        """
+        contents of a json file, or None if it does not exist
+        """
+        if not os.path.isfile(path):
+            return
+        (data,) = self._get(self.sidecars, path, lambda p: (_readjson(p),))
+        return deepcopy(data)  # callers may modify it
+
+    def prefetch(self, niftifiles):
+        """
+        read the headers and sidecars of many files concurrently
+        """
+
+        def fetch(niftifile):
+            stem, _ = splitext(niftifile)
+            try:
+                self.header(niftifile)
+            except Exception:
+                pass  # will be logged when the header is loaded
+            try:
+                self.sidecar(Path(niftifile).parent / f"{stem}.json")
+            except Exception:
+                pass
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for _ in executor.map(fetch, niftifiles):
+                pass
+
+
+metadata_cache = MetadataCache()  # in memory unless a file is loaded
@@ -5,10 +5,10 @@
 import logging
 import re
 
-import nibabel as nib
-
 import pint
 
+from .cache import metadata_cache
+
 logger = logging.getLogger("halfpipe")
 
 ureg = pint.UnitRegistry()
@@ -65,13 +65,11 @@ class NiftiheaderLoader:
             return cls.cache[niftifile]
 
         try:
-            nbimg = nib.load(niftifile, mmap=False, keep_file_open=False)
+            header = metadata_cache.header(niftifile)
         except Exception as e:
             logger.warning(f'Caught error loading file "{niftifile}"', e)
             return None, None
 
-        header = nbimg.header.copy()
-
         try:
             descripdict = parsedescrip(header)
         except Exception:
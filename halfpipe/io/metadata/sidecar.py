@@ -8,12 +8,12 @@
 
 import marshmallow
 from marshmallow import EXCLUDE
-import json
 from pathlib import Path
 from inflection import underscore
 
 from sdcflows.interfaces.fmap import get_ees
 
+from .cache import metadata_cache
 from ...model import MetadataSchema
 from ...utils import splitext
 
@@ -26,13 +26,7 @@ class SidecarMetadataLoader:
         stem, _ = splitext(fname)
         sidecarfile = Path(fname).parent / f"{stem}.json"
 
-        if not Path(sidecarfile).is_file():
-            return
-
-        with open(sidecarfile, "r") as fp:
-            jsn = fp.read()
-
-        return json.loads(jsn)
+        return metadata_cache.sidecar(sidecarfile)
 
     @classmethod
     def load(cls, fname):
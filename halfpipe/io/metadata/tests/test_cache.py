@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+"""
+
+"""
+
+import json
+import os
+
+import numpy as np
+
+import nibabel as nib
+
+from ..cache import MetadataCache
+from ....utils import nvol
+
+
+def test_MetadataCache(tmp_path):
+    fnames = list()
+    for i in range(4):
+        fname = str(tmp_path / f"sub-{i:02d}_bold.nii.gz")
+        nib.Nifti1Image(np.zeros((2, 3, 4, 5 + i)), np.eye(4)).to_filename(fname)
+        with open(tmp_path / f"sub-{i:02d}_bold.json", "w") as fp:
+            json.dump(dict(RepetitionTime=2.0), fp)
+        fnames.append(fname)
+
+    filename = tmp_path / "metadata.pickle"
+
+    metadata_cache = MetadataCache(filename)
+    metadata_cache.prefetch(fnames)
+    assert len(metadata_cache.headers) == 4
+    assert len(metadata_cache.sidecars) == 4
+    metadata_cache.save()
+
+    metadata_cache = MetadataCache(filename)
+    assert metadata_cache.changed is False
+    header = metadata_cache.header(fnames[1])
+    assert isinstance(header, nib.Nifti1Header)
+    assert header.get_data_shape() == (2, 3, 4, 6)
+    assert metadata_cache.changed is False  # was read from the cache file
+
+    sidecar = metadata_cache.sidecar(tmp_path / "sub-00_bold.json")
+    assert sidecar == dict(RepetitionTime=2.0)
+    sidecar["RepetitionTime"] = 3.0
+    assert metadata_cache.sidecar(tmp_path / "sub-00_bold.json") == dict(RepetitionTime=2.0)
+    assert metadata_cache.sidecar(tmp_path / "missing.json") is None
+
+    nib.Nifti1Image(np.zeros((2, 3, 4, 10)), np.eye(4)).to_filename(fnames[1])
+    os.utime(fnames[1], ns=(0, 0))  # the size alone may not change
+    assert metadata_cache.header(fnames[1]).get_data_shape() == (2, 3, 4, 10)
+
+    assert nvol(fnames[1]) == 10
@@ -7,68 +7,200 @@ Nipype interfaces to calculate connectivity measures using nilearn.
 Adapted from https://github.com/Neurita/pypes
 """
 
+import os
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+
 import numpy as np
 import nibabel as nib
+from scipy import sparse
 
-from scipy.ndimage.measurements import mean
-
-from ..utils import nvol
-
-
-def meansignals(in_file, atlas_file, mask_file=None, background_label=0, min_region_coverage=0.5, output_coverage=False):
-    in_img = nib.load(in_file)
-
-    atlas_img = nib.load(atlas_file)
-    assert nvol(atlas_img) == 1
-    assert atlas_img.shape[:3] == in_img.shape[:3]
-    assert np.allclose(atlas_img.affine, in_img.affine)
-    labels = np.asanyarray(atlas_img.dataobj).astype(np.int32)
-
-    nlabel = labels.max()
-
-    assert background_label <= nlabel
-
-    indices = np.arange(0, nlabel + 1, dtype=np.int32)
-
-    out_region_coverage = None
-
-    if mask_file is not None:
-        mask_img = nib.load(mask_file)
-        assert nvol(mask_img) == 1
-        assert mask_img.shape[:3] == in_img.shape[:3]
-        assert np.allclose(mask_img.affine, in_img.affine)
-        mask_data = np.asanyarray(mask_img.dataobj).astype(np.bool)
-
-        pre_counts = np.bincount(np.ravel(labels), minlength=nlabel + 1)
-        pre_counts = pre_counts[:nlabel + 1].astype(np.float64)
-
-        labels[np.logical_not(mask_data)] = background_label
-
-        post_counts = np.bincount(np.ravel(labels), minlength=nlabel + 1)
-        post_counts = post_counts[:nlabel + 1].astype(np.float64)
+from ..utils import nvol, hexdigest, filedigest
 
-        region_coverage = post_counts / pre_counts
-        region_coverage[np.isclose(pre_counts, 0)] = 0
+block_nbytes = 2**26  # size of the blocks of volumes that are read at once
 
-        out_region_coverage = list(region_coverage[indices != background_label])
-        assert len(out_region_coverage) == nlabel
 
-        indices = indices[region_coverage >= min_region_coverage]
+class LabelMatrix:
+    """
+    sparse matrix that maps the voxels of an image to the means of the regions of an atlas
+    """
 
-    indices = np.setdiff1d(indices, [background_label])
+    def __init__(self, matrix, coverage=None):
+        self.matrix = matrix  # regions by voxels, with the weights one over the region size
+        self.coverage = coverage
 
-    assert np.all(labels >= 0)
+        counts = np.diff(matrix.indptr)
+        self.empty = counts == 0  # regions that are excluded or have no voxels
 
-    in_data = in_img.get_fdata()
-    if in_data.ndim == 3:
-        in_data = in_data[:, :, :, np.newaxis]
-    assert in_data.ndim == 4
+    @classmethod
+    def from_files(
+        cls, atlas_file, shape, affine, mask_file=None, background_label=0, min_region_coverage=0.5
+    ):
+        atlas_img = nib.load(atlas_file)
+        assert nvol(atlas_img) == 1
+        assert atlas_img.shape[:3] == shape
+        assert np.allclose(atlas_img.affine, affine)
+        labels = np.asanyarray(atlas_img.dataobj).astype(np.int32).ravel(order="F")
+
+        nlabel = labels.max()
 
-    result = np.full((in_data.shape[3], nlabel), np.nan)
-    for i, img in enumerate(np.moveaxis(in_data, 3, 0)):
-        result[i, indices - 1] = mean(img, labels=labels.reshape(img.shape), index=indices)
+        assert background_label <= nlabel
+        assert np.all(labels >= 0)
+
+        indices = np.arange(0, nlabel + 1, dtype=np.int32)
+
+        coverage = None
+
+        if mask_file is not None:
+            mask_img = nib.load(mask_file)
+            assert nvol(mask_img) == 1
+            assert mask_img.shape[:3] == shape
+            assert np.allclose(mask_img.affine, affine)
+            mask_data = np.asanyarray(mask_img.dataobj).astype(bool).ravel(order="F")
 
-    if output_coverage is True:
-        return result, out_region_coverage
-    else:
-        return result
+            pre_counts = np.bincount(labels, minlength=nlabel + 1)
+            pre_counts = pre_counts[:nlabel + 1].astype(np.float64)
+
+            labels[np.logical_not(mask_data)] = background_label
+
+            post_counts = np.bincount(labels, minlength=nlabel + 1)
+            post_counts = post_counts[:nlabel + 1].astype(np.float64)
+
+            region_coverage = post_counts / np.maximum(pre_counts, 1)
+            region_coverage[np.isclose(pre_counts, 0)] = 0
+
+            coverage = region_coverage[indices != background_label]
+            assert coverage.size == nlabel
+
+            indices = indices[region_coverage >= min_region_coverage]
+
+        indices = np.setdiff1d(indices, [background_label])
+
+        is_selected = np.zeros(nlabel + 1, dtype=bool)
+        is_selected[indices] = True
+
+        (voxels,) = np.nonzero(is_selected[labels])
+        voxel_labels = labels[voxels]
+
+        counts = np.bincount(voxel_labels, minlength=nlabel + 1)
+        weights = 1.0 / counts[voxel_labels]
+
+        matrix = sparse.csr_matrix(
+            (weights, (voxel_labels - 1, voxels)), shape=(nlabel, labels.size)
+        )
+
+        return cls(matrix, coverage)
+
+    @classmethod
+    def load(cls, file):
+        with np.load(file) as npz:
+            matrix = sparse.csr_matrix(
+                (npz["data"], npz["indices"], npz["indptr"]), shape=tuple(npz["shape"])
+            )
+            coverage = npz["coverage"] if "coverage" in npz else None
+            return cls(matrix, coverage)
+
+    def save(self, file):
+        arrays = dict(
+            data=self.matrix.data,
+            indices=self.matrix.indices,
+            indptr=self.matrix.indptr,
+            shape=np.array(self.matrix.shape),
+        )
+        if self.coverage is not None:
+            arrays["coverage"] = self.coverage
+        np.savez(file, **arrays)
+
+    def mean(self, data, out):
+        """
+        data is voxels by volumes, out is volumes by regions
+        """
+        for i in range(data.shape[1]):  # columns are contiguous for fortran-order data
+            out[i] = self.matrix.dot(data[:, i])  # accumulated in float64
+        out[:, self.empty] = np.nan
+
+
+def label_matrix(
+    atlas_file, shape, affine, mask_file=None, background_label=0, min_region_coverage=0.5, cache_dir=None
+):
+    if cache_dir is None:
+        return LabelMatrix.from_files(
+            atlas_file, shape, affine, mask_file, background_label, min_region_coverage
+        )
+
+    key = dict(
+        atlas_file=filedigest(atlas_file),
+        mask_file=filedigest(mask_file) if mask_file is not None else None,
+        background_label=background_label,
+        min_region_coverage=min_region_coverage,
+        shape=list(shape),
+        affine=np.round(affine, 6).tolist(),
+    )
+    cache_file = Path(cache_dir) / f"labelmatrix.{hexdigest(key)}.npz"
+
+    if cache_file.is_file():
+        try:
+            return LabelMatrix.load(cache_file)
+        except (OSError, ValueError, KeyError):
+            pass  # will be overwritten
+
+    result = LabelMatrix.from_files(
+        atlas_file, shape, affine, mask_file, background_label, min_region_coverage
+    )
+
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    with NamedTemporaryFile(dir=cache_file.parent, suffix=".npz", delete=False) as tmp:
+        result.save(tmp)
+    os.replace(tmp.name, cache_file)  # atomic, so that concurrent readers never see partial files
+
+    return result
+
+
+def meansignals(
+    in_file, atlas_file, mask_file=None, background_label=0, min_region_coverage=0.5, output_coverage=False,
+    dtype=np.float64, cache_dir=None
+):
+    """
+    atlas_file can be a list of files, in which case the image data is read only once and
+    a list of results is returned
+    """
+    in_img = nib.load(in_file, keep_file_open=True)
+    shape = in_img.shape[:3]
+
+    atlas_files = atlas_file if isinstance(atlas_file, (list, tuple)) else [atlas_file]
+    label_matrices = [
+        label_matrix(
+            f, shape, in_img.affine, mask_file=mask_file, background_label=background_label,
+            min_region_coverage=min_region_coverage, cache_dir=cache_dir
+        )
+        for f in atlas_files
+    ]
+
+    n = nvol(in_img)
+    m = int(np.prod(shape))
+
+    results = [np.empty((n, lm.matrix.shape[0])) for lm in label_matrices]
+
+    volume_nbytes = m * np.dtype(dtype).itemsize
+    step = max(1, block_nbytes // volume_nbytes)
+    for start in range(0, n, step):
+        stop = min(n, start + step)
+        if len(in_img.shape) == 3:
+            in_data = np.asanyarray(in_img.dataobj)
+        else:
+            in_data = in_img.dataobj[..., start:stop]
+        in_data = in_data.astype(dtype, copy=False).reshape((m, stop - start), order="F")
+        for lm, result in zip(label_matrices, results):
+            lm.mean(in_data, out=result[start:stop])
+
+    outputs = list()
+    for lm, result in zip(label_matrices, results):
+        if output_coverage is True:
+            coverage = list(lm.coverage) if lm.coverage is not None else None
+            outputs.append((result, coverage))
+        else:
+            outputs.append(result)
+
+    if isinstance(atlas_file, (list, tuple)):
+        return outputs
+    return outputs[0]
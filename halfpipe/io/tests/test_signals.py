@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+"""
+
+"""
+
+import pytest
+
+import numpy as np
+import nibabel as nib
+from scipy.ndimage import mean
+
+from .. import signals
+from ..signals import label_matrix, meansignals
+
+
+def meansignals_loop(in_file, atlas_file, mask_file=None, background_label=0, min_region_coverage=0.5):
+    in_data = nib.load(in_file).get_fdata()
+    labels = np.asanyarray(nib.load(atlas_file).dataobj).astype(np.int32)
+    nlabel = labels.max()
+
+    indices = np.arange(0, nlabel + 1, dtype=np.int32)
+
+    if mask_file is not None:
+        mask_data = np.asanyarray(nib.load(mask_file).dataobj).astype(bool)
+
+        pre_counts = np.bincount(np.ravel(labels), minlength=nlabel + 1).astype(np.float64)
+        labels[np.logical_not(mask_data)] = background_label
+        post_counts = np.bincount(np.ravel(labels), minlength=nlabel + 1).astype(np.float64)
+
+        region_coverage = post_counts / pre_counts
+        indices = indices[region_coverage >= min_region_coverage]
+
+    indices = np.setdiff1d(indices, [background_label])
+
+    result = np.full((in_data.shape[3], nlabel), np.nan)
+    for i, img in enumerate(np.moveaxis(in_data, 3, 0)):
+        result[i, indices - 1] = mean(img, labels=labels, index=indices)
+
+    return result
+
+
+@pytest.mark.parametrize("use_mask", [False, True])
+def test_meansignals(tmp_path, monkeypatch, use_mask):
+    monkeypatch.setattr(signals, "block_nbytes", 2**12)  # use multiple blocks
+
+    rng = np.random.default_rng(0)
+    shape = (9, 10, 11)
+    affine = np.eye(4)
+
+    in_file = str(tmp_path / "bold.nii.gz")
+    nib.Nifti1Image(rng.normal(size=(*shape, 23)), affine).to_filename(in_file)
+
+    atlas_files = list()
+    for nlabel in [5, 12]:
+        atlas_file = str(tmp_path / f"atlas-{nlabel}.nii.gz")
+        labels = rng.integers(0, nlabel + 1, size=shape).astype(np.int32)
+        labels[labels == 3] = 0  # one empty region
+        labels[0, 0, 0] = nlabel
+        nib.Nifti1Image(labels, affine).to_filename(atlas_file)
+        atlas_files.append(atlas_file)
+
+    mask_file = None
+    if use_mask:
+        mask_file = str(tmp_path / "mask.nii.gz")
+        mask = np.ones(shape, dtype=np.uint8)
+        mask[:5, :2, :] = 0
+        nib.Nifti1Image(mask, affine).to_filename(mask_file)
+
+    cache_dir = tmp_path / "cache"
+    for _ in range(2):  # second run uses the cache
+        results = meansignals(
+            in_file, atlas_files, mask_file=mask_file, min_region_coverage=0.9, cache_dir=cache_dir
+        )
+
+        for atlas_file, result in zip(atlas_files, results):
+            reference = meansignals_loop(in_file, atlas_file, mask_file=mask_file, min_region_coverage=0.9)
+            np.testing.assert_allclose(result, reference)
+
+    assert len(list(cache_dir.glob("*.npz"))) == len(atlas_files)
+
+    result = meansignals(in_file, atlas_files[0], mask_file=mask_file, min_region_coverage=0.9)
+    np.testing.assert_allclose(result, results[0])
+
+    # the affine is checked again for a resampled image with the same shape
+    with pytest.raises(AssertionError):
+        label_matrix(
+            atlas_files[0], shape, np.diag([2, 2, 2, 1]), mask_file=mask_file, min_region_coverage=0.9,
+            cache_dir=cache_dir
+        )
@@ -50,6 +50,8 @@ class GlobalSettingsSchema(Schema):
 
     sloppy = fields.Boolean(default=False, required=True)
 
+    precision = fields.Str(default="float64", missing="float64", validate=validate.OneOf(["float64", "float32"]))
+
 
 class SmoothingSettingSchema(Schema):
     fwhm = fields.Float(validate=validate.Range(min=0.0), required=True)
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""
+"""
+
+import json
+from datetime import datetime as dt
+
+from ..setting import GlobalSettingsSchema
+from ..spec import loadspec, timestampfmt
+
+
+def test_loadspec_without_precision(tmp_path):
+    global_settings = GlobalSettingsSchema().dump(dict())
+    del global_settings["precision"]  # spec files from before the precision setting
+
+    with open(tmp_path / "spec.json", "w") as f:
+        json.dump(dict(
+            halfpipe_version="1.0.0",
+            schema_version="3.0",
+            timestamp=dt.now().strftime(timestampfmt),
+            files=list(),
+            settings=list(),
+            features=list(),
+            models=list(),
+            global_settings=global_settings,
+        ), f)
+
+    spec = loadspec(workdir=str(tmp_path))
+    assert spec is not None
+    assert spec.global_settings["precision"] == "float64"
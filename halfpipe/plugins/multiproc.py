@@ -6,26 +6,65 @@ import os
 import gc
 import logging
 import shutil
+from pathlib import Path
+from time import time
+from contextlib import nullcontext
 from stackprinter import format_current_exception
 
 import multiprocessing as mp
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 
 from nipype.pipeline import plugins as nip
 from nipype.utils.profiler import get_system_total_memory_gb
 
 from matplotlib import pyplot as plt
 
-from .reftracer import PathReferenceTracer
+from .reftracer import PathReferenceTracer, output_paths
+from .resources import (
+    PeakMemorySampler, ResourceHistory, node_type_key, critical_path_lengths, default_duration, process_rss_gb
+)
 from ..logging import Context
 
 logger = logging.getLogger("nipype.workflow")
 
-
-def initializer(workdir, loggingargs, watchdog):
+preload_modules = [  # imported once in the forkserver, so that workers start warm
+    "numpy",
+    "scipy",
+    "pandas",
+    "nibabel",
+    "matplotlib.pyplot",
+    "nilearn",
+    "nipype.pipeline.engine",
+    "nipype.interfaces.base",
+    "niworkflows",
+    "fmriprep",
+    "halfpipe.interface",
+]
+
+max_worker_rss_gb = None  # set by the initializer
+
+fast_interfaces = frozenset([  # pure python and without file outputs
+    "nipype.interfaces.utility.base.IdentityInterface",
+    "nipype.interfaces.utility.base.Merge",
+    "nipype.interfaces.utility.base.Select",
+    "nipype.interfaces.utility.base.Split",
+    "halfpipe.interface.utility.ops.exec.Exec",
+    "halfpipe.interface.utility.ops.filter.Filter",
+    "halfpipe.interface.utility.ops.filter.FilterList",
+    "halfpipe.interface.utility.ops.select.Select",
+    "halfpipe.interface.resultdict.make.MakeResultdicts",
+    "halfpipe.interface.resultdict.aggregate.AggregateResultdicts",
+    "halfpipe.interface.resultdict.extract.ExtractFromResultdict",
+])
+
+
+def initializer(workdir, loggingargs, watchdog, max_rss_gb=None):
     from ..logging import setup as setuplogging
     setuplogging(**loggingargs)
 
+    global max_worker_rss_gb
+    max_worker_rss_gb = max_rss_gb
+
     if watchdog is True:
         from ..watchdog import init_watchdog
 
@@ -34,8 +73,23 @@ def initializer(workdir, loggingargs, watchdog):
     os.chdir(workdir)
 
 
+def is_fast_node(node):
+    """
+    whether the node can be run in the scheduler process, as it is cheaper than
+    sending it to a worker. subclasses are excluded, as they may write files
+    """
+    cls = type(node.interface)
+    return f"{cls.__module__}.{cls.__name__}" in fast_interfaces
+
+
+def remove_paths(paths):
+    logger.info("[node dependencies finished] removing\n" + "\n".join(map(str, paths)))
+    for path in paths:
+        shutil.rmtree(path, ignore_errors=True)
+
+
 # Run node
-def run_node(node, updatehash, taskid):
+def run_node(node, updatehash, taskid, base_directory=None, sample_memory=True):
     """Function to execute node.run(), catch and log any errors and
     return the result dictionary
     Parameters
@@ -46,6 +100,10 @@ def run_node(node, updatehash, taskid):
         flag for updating hash
     taskid : int
         an identifier for this task
+    base_directory : str
+        if set, also return the output paths within this directory
+    sample_memory : boolean
+        whether to measure the peak memory of the process while the node runs
     Returns
     -------
     result : dictionary
@@ -56,15 +114,35 @@ def run_node(node, updatehash, taskid):
     result = dict(result=None, traceback=None, taskid=taskid)
 
     # Try and execute the node via node.run()
-    try:
-        result["result"] = node.run(updatehash=updatehash)
-    except Exception:  # catch all here
-        result["traceback"] = format_current_exception()
-        result["result"] = node.result
+    start = time()
+    with PeakMemorySampler() if sample_memory else nullcontext() as sampler:
+        try:
+            result["result"] = node.run(updatehash=updatehash)
+        except Exception:  # catch all here
+            result["traceback"] = format_current_exception()
+            result["result"] = node.result
+    if sampler is not None:
+        result["resources"] = sampler.asdict()
+    else:  # the scheduler process is not part of the memory budget
+        result["resources"] = dict(duration=time() - start, mem_peak_gb=0.0)
+
+    if base_directory is not None and result["result"] is not None:
+        try:
+            result["paths"] = output_paths(result["result"].outputs, base_directory)
+        except Exception:  # the scheduler falls back to loading the result file
+            pass
 
     # Avoid matplotlib memory leak
     plt.close("all")
-    gc.collect()
+
+    # Only collect garbage when the worker has grown, and report the memory
+    # that remains, so that the scheduler can optionally replace the workers
+    if max_worker_rss_gb is not None:
+        worker_rss_gb = process_rss_gb()
+        if worker_rss_gb > max_worker_rss_gb:
+            gc.collect()
+            worker_rss_gb = process_rss_gb()
+        result["worker_rss_gb"] = worker_rss_gb
 
     # Return the result dictionary
     return result
@@ -76,6 +154,9 @@ class MultiProcPlugin(nip.MultiProcPlugin):
         super(nip.MultiProcPlugin, self).__init__(plugin_args=plugin_args)
         self._taskresult = {}
         self._task_obj = {}
+        self._task_node = {}
+        self._task_paths = {}
+        self._task_start = {}
         self._taskid = 0
         self._rt = None
 
@@ -99,21 +180,52 @@ class MultiProcPlugin(nip.MultiProcPlugin):
         )
 
         mp_context = mp.get_context("forkserver")  # force forkserver
-        self.pool = ProcessPoolExecutor(
+        mp_context.set_forkserver_preload(
+            ["__main__", *self.plugin_args.get("preload_modules", preload_modules)]
+        )  # only has an effect if the forkserver was not started yet
+
+        # Workers are recycled by replacing the whole pool, because
+        # ProcessPoolExecutor can only retire single workers on Python 3.11.
+        # Workers often keep freed memory, so recycling them by their memory
+        # would replace the pool over and over, and is off by default
+        self._max_worker_rss_gb = self.plugin_args.get("max_worker_rss_gb", 2.0)
+        self._recycle_worker_rss_gb = self.plugin_args.get("recycle_worker_rss_gb", None)
+        self._pool_kwargs = dict(
             max_workers=self.processors,
             initializer=initializer,
             initargs=(
                 self._cwd,
                 Context.loggingargs(),
                 plugin_args.get("watchdog", False),
+                self._max_worker_rss_gb,
             ),
             mp_context=mp_context,
         )
+        self._max_pool_tasks = None
+        max_tasks_per_child = self.plugin_args.get("max_tasks_per_child", 100)
+        if max_tasks_per_child is not None:
+            self._max_pool_tasks = max_tasks_per_child * self.processors
+        self._pool_tasks = 0
+        self._recycle_pool = False
+        self.pool = ProcessPoolExecutor(**self._pool_kwargs)
 
         self._stats = None
+
+        self._history = ResourceHistory(Path(self._cwd) / "resource_history.json")
+        self._history_saved = time()
+        self._node_type_keys = dict()
+        self._static_mem_gb = dict()
+        self._priority = dict()
+
         self._keep = plugin_args.get("keep", "all")
+        self._remover = None
         if self._keep != "all":
             self._rt = PathReferenceTracer()
+            self._remover = ThreadPoolExecutor(max_workers=1)  # remove directories in the background
+
+        self._fast_path = self.plugin_args.get("fast_path", True)
+        self._stats_fast = dict(count=0, duration=0.0)
+        self._stats_pool = dict(count=0, overhead=0.0)
 
     def _submit_job(self, node, updatehash=False):
         self._taskid += 1
@@ -122,15 +234,47 @@ class MultiProcPlugin(nip.MultiProcPlugin):
         if getattr(node.interface, "terminal_output", "") == "stream":
             node.interface.terminal_output = "allatonce"
 
-        result_future = self.pool.submit(run_node, node, updatehash, self._taskid)
-        result_future.add_done_callback(self._async_callback)
+        base_directory = None
+        if self._rt is not None:
+            base_directory = self._cwd
+
+        if self._fast_path and is_fast_node(node):
+            # run in the scheduler thread, because nodes change the working
+            # directory of the whole process while they run
+            result_future = Future()
+            result_future.set_result(
+                run_node(node, updatehash, self._taskid, base_directory, sample_memory=False)
+            )
+        else:
+            if self._recycle_pool or (
+                self._max_pool_tasks is not None and self._pool_tasks >= self._max_pool_tasks
+            ):
+                self._replace_pool()
+            self._pool_tasks += 1
+            result_future = self.pool.submit(run_node, node, updatehash, self._taskid, base_directory)
+        self._task_start[self._taskid] = time()
         self._task_obj[self._taskid] = result_future
+        self._task_node[self._taskid] = node
+        result_future.add_done_callback(self._async_callback)
 
         logger.debug(
             "[MultiProc] Submitted task %s (taskid=%d).", node.fullname, self._taskid
         )
         return self._taskid
 
+    def _replace_pool(self):
+        """
+        submit new tasks to fresh workers, while the old workers finish their
+        tasks and then exit
+        """
+        logger.debug(
+            "[MultiProc] Replacing workers after %d tasks", self._pool_tasks
+        )
+        pool, self.pool = self.pool, ProcessPoolExecutor(**self._pool_kwargs)
+        pool.shutdown(wait=False)
+        self._pool_tasks = 0
+        self._recycle_pool = False
+
     def _generate_dependency_list(self, graph):
         if self._rt is not None:
             for node in graph.nodes:
@@ -139,6 +283,98 @@ class MultiProcPlugin(nip.MultiProcPlugin):
                 self._rt.set_node_pending(node)
         super(MultiProcPlugin, self)._generate_dependency_list(graph)
 
+        def duration(node):
+            duration = self._history.duration(self._node_type_key(node))
+            if duration is None:
+                return default_duration
+            return duration
+
+        self._priority = critical_path_lengths(graph, self.procs, duration)  # procs are in topological order
+
+    def _node_type_key(self, node):
+        key = self._node_type_keys.get(node)
+        if key is None:
+            key = node_type_key(node)
+            self._node_type_keys[node] = key
+        return key
+
+    def _update_mem_gb(self, jobids):
+        """
+        refine the static memory estimates of the jobs with the observed peak memory
+        """
+        for jobid in jobids:
+            node = self.procs[jobid]
+            static_mem_gb = self._static_mem_gb.setdefault(node, node._mem_gb)  # before the first update
+            node._mem_gb = self._history.mem_gb(self._node_type_key(node), static_mem_gb)
+
+    def _sort_jobs(self, jobids, scheduler=None):
+        self._update_mem_gb(jobids)  # called right before the resources are allocated
+
+        if scheduler not in [None, "critical_path"]:
+            return super(MultiProcPlugin, self)._sort_jobs(jobids, scheduler=scheduler)
+
+        def priority(jobid):
+            jobid = self.mapnodesubids.get(jobid, jobid)  # mapnode subnodes inherit the priority
+            return self._priority.get(self.procs[jobid], 0.0)
+
+        return sorted(jobids, key=priority, reverse=True)
+
+    def _get_result(self, taskid):
+        result = super(MultiProcPlugin, self)._get_result(taskid)
+        if result is not None and "paths" in result:
+            self._task_paths[self._task_node[taskid]] = result.pop("paths")
+        return result
+
+    def _clear_task(self, taskid):
+        super(MultiProcPlugin, self)._clear_task(taskid)
+
+        node = self._task_node.pop(taskid, None)
+        result = self._taskresult.pop(taskid, None)
+        if node is not None and result is not None and not result["traceback"]:
+            resources = result.get("resources")
+            if resources is not None:
+                self._history.record(self._node_type_key(node), **resources)
+                self._update_stats(node, result)
+
+        if time() - self._history_saved > 60.0:
+            self._history.save()
+            self._history_saved = time()
+
+    def _update_stats(self, node, result):
+        """
+        count the nodes that took the fast path, and measure the overhead of the
+        process pool from the other nodes to estimate the time that was saved
+        """
+        latency = result.get("latency")
+        duration = result["resources"]["duration"]
+        if latency is None or duration is None:
+            return
+        if self._fast_path and is_fast_node(node):
+            self._stats_fast["count"] += 1
+            self._stats_fast["duration"] += duration
+        else:
+            self._stats_pool["count"] += 1
+            self._stats_pool["overhead"] += max(0.0, latency - duration)
+
+    def _postrun_check(self):
+        count = self._stats_fast["count"]
+        if count > 0:
+            overhead = 0.0
+            if self._stats_pool["count"] > 0:
+                overhead = self._stats_pool["overhead"] / self._stats_pool["count"]
+            logger.info(
+                "[MultiProc] Ran %d nodes in the scheduler process in %0.2fs, "
+                "saving an estimated %0.2fs of process pool overhead",
+                count,
+                self._stats_fast["duration"],
+                count * overhead,
+            )
+
+        self._history.save()
+        if self._remover is not None:
+            self._remover.shutdown(wait=True)
+        super(MultiProcPlugin, self)._postrun_check()
+
     def _task_finished_cb(self, jobid, cached=False):
         if self._rt is not None:
             name = self.procs[jobid].fullname
@@ -149,12 +385,20 @@ class MultiProcPlugin(nip.MultiProcPlugin):
                 unmark = False
             if hasattr(self.procs[jobid], "keep") and self.procs[jobid].keep is True:
                 unmark = False  # always keep feature outputs
-            self._rt.set_node_complete(self.procs[jobid], unmark)
+            paths = self._task_paths.pop(self.procs[jobid], None)
+            self._rt.set_node_complete(self.procs[jobid], unmark, paths=paths)
         super(MultiProcPlugin, self)._task_finished_cb(jobid, cached=cached)
 
     def _async_callback(self, args):
         try:
             result = args.result()
+            start = self._task_start.pop(result["taskid"], None)
+            if start is not None:
+                result["latency"] = time() - start
+            worker_rss_gb = result.get("worker_rss_gb")
+            if self._recycle_worker_rss_gb is not None and worker_rss_gb is not None:
+                if worker_rss_gb > self._recycle_worker_rss_gb:
+                    self._recycle_pool = True  # garbage collection was not enough
             self._taskresult[result["taskid"]] = result
         except Exception as e:
             logging.getLogger("halfpipe").exception(f"Exception for {args}: %s", e)
@@ -165,6 +409,4 @@ class MultiProcPlugin(nip.MultiProcPlugin):
         if self._rt is not None:
             paths = [*self._rt.collect()]
             if len(paths) > 0:
-                logger.info("[node dependencies finished] removing\n" + "\n".join(map(str, paths)))
-                for path in paths:
-                    shutil.rmtree(path, ignore_errors=True)
+                self._remover.submit(remove_paths, paths)
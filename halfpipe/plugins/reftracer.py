@@ -12,6 +12,49 @@ from ..utils import findpaths
 logger = logging.getLogger("halfpipe")
 
 
+def output_paths(outputs, base_directory):
+    """
+    resolved paths of the outputs and of the contents of output directories
+    within base_directory, so that the scheduler does not have to touch the file system
+    """
+    base_directory = Path(base_directory).resolve()
+
+    paths = list()
+    stack = [*findpaths(outputs)]
+    while len(stack) > 0:
+        path = Path(stack.pop()).resolve()
+        if base_directory not in path.parents:
+            continue  # cannot be traced
+        paths.append(path)
+        if path.is_dir():
+            stack.extend(path.iterdir())
+    return paths
+
+
+class PathTrie:
+    """
+    prefix tree of paths to find the tracked parents of a path
+    """
+
+    def __init__(self):
+        self.root = dict()
+
+    def add(self, path):
+        node = self.root
+        for part in path.parts:
+            node = node.setdefault(part, dict())
+        node[None] = path  # marks the end of a path
+
+    def prefixes(self, path):
+        node = self.root
+        for part in path.parts:
+            node = node.get(part)
+            if node is None:
+                return
+            if None in node:
+                yield node[None]
+
+
 class PathReferenceTracer:
     def __init__(self):
         self.black = set()  # is pending
@@ -21,19 +64,21 @@ class PathReferenceTracer:
         self.refs = dict()  # other paths that are referenced by a path
         self.deps = dict()  # paths that a path depends on (inverse refs)
 
+        self.trie = PathTrie()  # all paths that were ever added
+
     def resolve(self, path):
         if not isinstance(path, Path):
             path = Path(path)
         path = path.resolve()
         return path
 
-    def find(self, path):
-        path = self.resolve(path)
-        pathset = set(path.parents)
-        pathset.add(path)
+    def find(self, path, resolve=True):
+        if resolve:
+            path = self.resolve(path)
         # yield any tracked folders that contain the target path
-        yield from pathset & self.black
-        yield from pathset & self.grey
+        for prefix in self.trie.prefixes(path):
+            if prefix in self.black or prefix in self.grey:
+                yield prefix
 
     def add_ref(self, frompath, topath):
         if frompath == topath:
@@ -66,6 +111,7 @@ class PathReferenceTracer:
 
         if path not in self.black and path not in self.grey and path not in self.white:
             target.add(path)
+            self.trie.add(path)
 
         if path not in self.refs:
             self.refs[path] = set()  # initialize empty
@@ -96,7 +142,11 @@ class PathReferenceTracer:
                 else:
                     logger.warning(f'{node.name} has untracked input_source "{input_file}"')
 
-    def set_node_complete(self, node, unmark: bool):
+    def set_node_complete(self, node, unmark: bool, paths=None):
+        """
+        paths are the resolved output paths from `output_paths` if they were
+        already found by the worker, otherwise the result file is loaded
+        """
         topath = self.node_resultfile_path(node)
 
         if topath not in self.deps:  # node is not being tracked
@@ -120,6 +170,10 @@ class PathReferenceTracer:
             else:
                 self.grey.add(topath)
 
+        if paths is not None:
+            self._add_output_paths(topath, paths)
+            return
+
         try:
             result = load_resultfile(topath)  # load result from file
         except Exception as ex:
@@ -130,19 +184,29 @@ class PathReferenceTracer:
         while len(stack) > 0:
             path = self.resolve(stack.pop())
 
-            found = set(self.find(path))
+            if not self._add_output_path(topath, path):
+                continue
 
-            if len(found) == 0:
-                continue  # this path is not being traced, for example because it is an external file
+            if path.is_dir():
+                stack.extend(path.iterdir())
 
-            self.add_file(path)
-            self.add_ref(path, topath)  # add reference from result file
+    def _add_output_path(self, topath, path):
+        found = [*self.find(path, resolve=False)]
 
-            for frompath in found:
-                self.add_ref(frompath, path)  # add any parents as dependency
+        if len(found) == 0:
+            return False  # this path is not being traced, for example because it is an external file
 
-            if path.is_dir():
-                stack.extend(path.iterdir())
+        self.add_file(path)
+        self.add_ref(path, topath)  # add reference from result file
+
+        for frompath in found:
+            self.add_ref(frompath, path)  # add any parents as dependency
+
+        return True
+
+    def _add_output_paths(self, topath, paths):
+        for path in paths:  # directories come before their contents
+            self._add_output_path(topath, path)
 
     def collect(self):
         while len(self.white) > 0:
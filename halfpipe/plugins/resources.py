@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+"""
+observed resource usage of nodes, used to refine the static memory estimates
+and to prioritize nodes on the critical path
+"""
+
+import os
+import re
+import json
+from pathlib import Path
+from threading import Thread, Event
+from tempfile import NamedTemporaryFile
+from time import time
+
+import psutil
+from flufl.lock import Lock
+from nipype.pipeline.engine import MapNode
+
+default_duration = 1.0  # seconds, for nodes without observations
+
+
+def node_type_key(node):
+    """
+    nodes of the same type in the workflows for different subjects have the same key
+    """
+    hierarchy = node._hierarchy.split(".") if node._hierarchy else list()
+    if len(hierarchy) > 2 and hierarchy[1] in ["fmriprep_wf", "reports_wf", "settings_wf", "features_wf"]:
+        del hierarchy[2]  # subject specific
+    name = re.sub(r"^_(.+?)\d+$", r"\1", node.name)  # mapnode subnodes
+    hierarchy.append(name)
+
+    interface = node.interface
+    nodetype = type(node).__name__
+    if isinstance(node, MapNode):
+        interface = node._interface
+    cls = type(interface)
+
+    return f"{nodetype}:{cls.__module__}.{cls.__name__}:{'.'.join(hierarchy)}"
+
+
+def process_rss_gb():
+    """
+    current resident memory of this process
+    """
+    return psutil.Process(os.getpid()).memory_info().rss / 1024.0 ** 3
+
+
+def critical_path_lengths(graph, nodes, duration):
+    """
+    length of the longest path from each node to the end of the graph, where
+    nodes need to be in topological order
+    """
+    lengths = dict()
+    for node in reversed(nodes):
+        lengths[node] = duration(node) + max(
+            (lengths[successor] for successor in graph.successors(node)), default=0.0
+        )
+    return lengths
+
+
+class PeakMemorySampler:
+    """
+    samples the resident memory of the process and its children in a background thread
+
+    the peak is relative to the memory at the start, as the workers already hold the
+    preloaded modules and the memory of previous nodes. the scheduler adds a fixed
+    baseline instead
+    """
+
+    def __init__(self, interval=0.2):
+        self.interval = interval
+        self.mem_peak_gb = 0.0
+        self.duration = None
+
+        self._stop = Event()
+        self._thread = None
+        self._start = None
+        self._start_rss_gb = 0.0
+        self._peak_rss_gb = 0.0
+
+        self._process = psutil.Process(os.getpid())
+
+    def _rss_gb(self):
+        rss = 0
+        try:
+            rss += self._process.memory_info().rss
+            for child in self._process.children(recursive=True):
+                try:
+                    rss += child.memory_info().rss
+                except Exception:
+                    pass  # child has exited
+        except Exception:
+            pass
+        return rss / 1024.0 ** 3
+
+    def _sample(self):
+        while True:
+            self._peak_rss_gb = max(self._peak_rss_gb, self._rss_gb())
+            if self._stop.wait(self.interval):
+                break
+
+    def __enter__(self):
+        self._start = time()
+        self._start_rss_gb = self._peak_rss_gb = self._rss_gb()
+        self._thread = Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+        self._peak_rss_gb = max(self._peak_rss_gb, self._rss_gb())
+        self.mem_peak_gb = self._peak_rss_gb - self._start_rss_gb
+        self.duration = time() - self._start
+
+    def asdict(self):
+        return dict(duration=self.duration, mem_peak_gb=self.mem_peak_gb)
+
+
+class ResourceHistory:
+    """
+    last observations of wall time and peak memory per node type, stored in a json
+    file in the working directory that is shared between runs and chunks
+
+    the reserved memory is the observed increase of the worker memory scaled by a
+    factor, plus a fixed baseline for the memory that a worker holds anyway. as the
+    sampling can miss short peaks, observations only lower the static estimate once
+    there are enough of them, and never below a fraction of it
+    """
+
+    def __init__(
+        self, filename, max_observations=16, mem_gb_factor=1.25, mem_gb_margin=0.1,
+        min_observations=3, min_mem_gb_fraction=0.5
+    ):
+        self.filename = Path(filename)
+        self.lock = Lock(f"{filename}.lock")
+
+        self.max_observations = max_observations
+        self.mem_gb_factor = mem_gb_factor
+        self.mem_gb_margin = mem_gb_margin
+        self.min_observations = min_observations
+        self.min_mem_gb_fraction = min_mem_gb_fraction
+
+        self.observations = dict()
+        self.pending = dict()  # observations that were not saved yet
+
+        self.load()
+
+    def _read(self):
+        try:
+            with open(self.filename, "r") as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return dict()
+
+    def load(self):
+        self.observations = self._read()
+
+    def save(self):
+        if len(self.pending) == 0:
+            return
+
+        pending, self.pending = self.pending, dict()
+
+        with self.lock:
+            observations = self._read()  # merge with other processes
+            for key, values in pending.items():
+                observations[key] = [*observations.get(key, list()), *values][-self.max_observations:]
+
+            with NamedTemporaryFile(mode="w", dir=self.filename.parent, delete=False) as fp:
+                json.dump(observations, fp)
+            os.replace(fp.name, self.filename)
+
+        self.observations = observations
+
+    def record(self, key, duration, mem_peak_gb):
+        value = [float(duration), float(mem_peak_gb)]
+        for observations in [self.observations, self.pending]:
+            observations[key] = [*observations.get(key, list()), value][-self.max_observations:]
+
+    def mem_gb(self, key, static_mem_gb):
+        observations = self.observations.get(key)
+        if not observations:
+            return static_mem_gb
+        mem_gb = max(m for _, m in observations) * self.mem_gb_factor + self.mem_gb_margin
+        if mem_gb >= static_mem_gb:
+            return mem_gb
+        if len(observations) < self.min_observations:
+            return static_mem_gb
+        return max(mem_gb, static_mem_gb * self.min_mem_gb_fraction)
+
+    def duration(self, key):
+        observations = self.observations.get(key)
+        if not observations:
+            return
+        return sum(d for d, _ in observations) / len(observations)
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""
+"""
+
+import os
+from concurrent.futures import Future
+from pathlib import Path
+
+import pytest
+
+import nipype.interfaces.utility as niu
+import nipype.pipeline.engine as pe
+from nipype.pipeline.engine.utils import load_resultfile
+
+from ..multiproc import MultiProcPlugin, is_fast_node, run_node
+from ...interface import MakeResultdicts, Merge
+from ...logging import Context, teardown
+
+
+def add(a, b):
+    return a + b
+
+
+def test_is_fast_node():
+    assert is_fast_node(pe.Node(niu.IdentityInterface(fields=["a"]), name="a"))
+    assert is_fast_node(pe.Node(niu.Merge(2), name="b"))
+    assert is_fast_node(pe.Node(MakeResultdicts(), name="c"))
+
+    assert not is_fast_node(pe.Node(niu.Function(function=add), name="d"))
+    assert not is_fast_node(pe.Node(Merge(dimension="t"), name="e"))  # image merge
+
+
+def test_run_node_inline(tmp_path):
+    node = pe.Node(niu.Merge(2), name="merge", base_dir=str(tmp_path))
+    node.inputs.in1 = [1]
+    node.inputs.in2 = [2]
+
+    result = run_node(node, False, 1, base_directory=str(tmp_path), sample_memory=False)
+
+    assert result["traceback"] is None
+    assert result["result"].outputs.out == [1, 2]
+    assert result["resources"]["mem_peak_gb"] == 0.0
+
+    resultfile = Path(node.output_dir()) / f"result_{node.name}.pklz"
+    assert load_resultfile(resultfile).outputs.out == [1, 2]  # can be loaded by downstream nodes
+
+
+def getpid(i):
+    import os
+
+    return os.getpid()
+
+
+@pytest.fixture(scope="module")
+def plugin(tmp_path_factory):
+    workdir = str(tmp_path_factory.mktemp("multiproc"))
+    plugin_args = dict(workdir=workdir, n_procs=1, max_tasks_per_child=2, preload_modules=list())
+    plugin = MultiProcPlugin(plugin_args=plugin_args)
+
+    yield plugin
+
+    plugin.pool.shutdown()
+
+    Context.setWorkdir(workdir)  # let the logging worker started by the plugin drain and exit
+    Context.enablePrint()
+    teardown()
+
+
+def test_MultiProcPlugin_fast_path(tmp_path, plugin):
+    cwd = os.getcwd()
+
+    node = pe.Node(niu.Merge(2), name="merge", base_dir=str(tmp_path))
+    node.inputs.in1 = [1]
+    node.inputs.in2 = [2]
+    taskid = plugin._submit_job(node)
+
+    assert taskid in plugin._taskresult  # ran in the scheduler thread
+    assert plugin._taskresult[taskid]["result"].outputs.out == [1, 2]
+    assert os.getcwd() == cwd
+
+
+def test_MultiProcPlugin_update_mem_gb(tmp_path, plugin):
+    node = pe.Node(niu.Function(function=add), name="add", base_dir=str(tmp_path), mem_gb=4.0)
+    plugin.procs = [node]
+
+    for _ in range(3):
+        plugin._history.record(plugin._node_type_key(node), duration=1.0, mem_peak_gb=0.1)
+
+    for _ in range(2):  # does not decrease further with each update
+        plugin._update_mem_gb([0])
+        assert node.mem_gb == 2.0
+
+
+def test_MultiProcPlugin_recycle_worker_rss_gb(plugin):
+    def callback(taskid, worker_rss_gb):
+        future = Future()
+        future.set_result(dict(taskid=taskid, worker_rss_gb=worker_rss_gb))
+        plugin._async_callback(future)
+
+    callback(-1, 10.0)
+    assert plugin._recycle_pool is False  # off by default
+
+    plugin._recycle_worker_rss_gb = 4.0
+    callback(-2, 2.0)
+    assert plugin._recycle_pool is False
+    callback(-3, 10.0)
+    assert plugin._recycle_pool is True
+
+    plugin._recycle_worker_rss_gb = None
+    plugin._recycle_pool = False
+
+
+@pytest.mark.timeout(300)
+def test_MultiProcPlugin_recycle(tmp_path, plugin):
+    plugin._replace_pool()
+
+    futures = list()
+    for i in range(6):
+        node = pe.Node(
+            niu.Function(input_names=["i"], output_names=["pid"], function=getpid), name=f"getpid{i:d}",
+            base_dir=str(tmp_path)
+        )
+        node.inputs.i = i
+        taskid = plugin._submit_job(node)
+        futures.append(plugin._task_obj[taskid])
+
+    pids = [future.result()["result"].outputs.pid for future in futures]
+
+    assert len(set(pids)) == 3  # a new worker every two tasks
@@ -10,7 +10,7 @@ import os
 from pathlib import Path
 
 from ...workflow.execgraph import DontRunRunner
-from ..reftracer import PathReferenceTracer
+from ..reftracer import PathReferenceTracer, output_paths
 
 
 def add(a, b):
@@ -129,7 +129,8 @@ def select(a, b):
 
 
 @pytest.mark.timeout(60)
-def test_PathReferenceTracer_indirect_refs(tmp_path):
+@pytest.mark.parametrize("use_output_paths", [False, True])
+def test_PathReferenceTracer_indirect_refs(tmp_path, use_output_paths):
     from nipype import config
     import nipype.interfaces.utility as niu
     import nipype.pipeline.engine as pe
@@ -196,8 +197,14 @@ def test_PathReferenceTracer_indirect_refs(tmp_path):
     yrf = rt.node_resultfile_path(y)
     zrf = rt.node_resultfile_path(z)
 
+    def set_node_complete(node, result):
+        paths = None
+        if use_output_paths:  # like in the worker
+            paths = output_paths(result.outputs, tmp_path)
+        rt.set_node_complete(node, True, paths=paths)
+
     result = x.run()
-    rt.set_node_complete(x, True)
+    set_node_complete(x, result)
 
     c = result.outputs.c
     d = result.outputs.d
@@ -214,8 +221,7 @@ def test_PathReferenceTracer_indirect_refs(tmp_path):
     assert rt.deps[c] == set([xrf.parent])
     assert rt.deps[d] == set([xrf.parent])
 
-    y.run()
-    rt.set_node_complete(y, True)
+    set_node_complete(y, y.run())
 
     assert rt.refs[xrf] == set([])
     assert rt.refs[yrf] == set([zrf])
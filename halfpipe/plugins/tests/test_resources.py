@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""
+"""
+
+from time import sleep
+
+import pytest
+
+import numpy as np
+
+from ..resources import (
+    PeakMemorySampler, ResourceHistory, node_type_key, critical_path_lengths, process_rss_gb
+)
+
+
+def add(a, b):
+    return a + b
+
+
+def test_node_type_key():
+    import nipype.interfaces.utility as niu
+    import nipype.pipeline.engine as pe
+
+    keys = set()
+    for subject in ["sub_01_wf", "sub_02_wf"]:
+        node = pe.Node(niu.IdentityInterface(fields=["a"]), name="x")
+        node._hierarchy = f"nipype.features_wf.{subject}.task_wf"
+        keys.add(node_type_key(node))
+
+    assert len(keys) == 1
+    assert "sub_01" not in keys.pop()
+
+
+def test_PeakMemorySampler():
+    with PeakMemorySampler(interval=0.01) as sampler:
+        a = np.ones(2**27, dtype=np.uint8)  # 128 MB
+        sleep(0.1)  # a few samples
+        del a
+
+    assert sampler.duration > 0
+    assert sampler.mem_peak_gb > 0.12
+
+    # memory that the process holds already is not counted
+    a = np.ones(2**27, dtype=np.uint8)
+    with PeakMemorySampler(interval=0.01) as sampler:
+        pass
+    del a
+
+    assert sampler.mem_peak_gb < 0.05
+
+
+def test_process_rss_gb():
+    before = process_rss_gb()
+    a = np.ones(2**27, dtype=np.uint8)  # 128 MB
+    assert process_rss_gb() - before > 0.1
+    del a
+
+
+def test_ResourceHistory(tmp_path):
+    filename = tmp_path / "resource_history.json"
+
+    a = ResourceHistory(filename, max_observations=3)
+    b = ResourceHistory(filename, max_observations=3)
+
+    assert a.mem_gb("x", 1.0) == 1.0
+
+    for i in range(4):
+        a.record("x", duration=float(i), mem_peak_gb=float(i))
+    b.record("y", duration=1.0, mem_peak_gb=2.0)
+
+    assert a.duration("x") == 2.0
+    assert a.mem_gb("x", 1.0) == pytest.approx(3.0 * a.mem_gb_factor + a.mem_gb_margin)
+
+    a.save()
+    b.save()  # merges
+
+    c = ResourceHistory(filename)
+    assert c.duration("x") == 2.0
+    assert c.duration("y") == 1.0
+
+
+def test_ResourceHistory_mem_gb(tmp_path):
+    history = ResourceHistory(tmp_path / "resource_history.json", mem_gb_factor=1.0, mem_gb_margin=0.0)
+
+    history.record("x", duration=1.0, mem_peak_gb=0.5)
+    history.record("x", duration=1.0, mem_peak_gb=1.0)
+    assert history.mem_gb("x", 4.0) == 4.0  # too few observations to lower the estimate
+    assert history.mem_gb("x", 0.5) == 1.0  # but enough to raise it
+
+    history.record("x", duration=1.0, mem_peak_gb=1.0)
+    assert history.mem_gb("x", 1.5) == 1.0
+    assert history.mem_gb("x", 4.0) == 2.0  # not below half of the estimate
+
+
+def test_critical_path_lengths():
+    import networkx as nx
+
+    graph = nx.DiGraph()
+    graph.add_edges_from([("x", "y"), ("y", "z"), ("w", "z")])
+    nodes = list(nx.topological_sort(graph))
+
+    durations = dict(x=1.0, y=2.0, z=3.0, w=4.0)
+    lengths = critical_path_lengths(graph, nodes, durations.get)
+
+    assert lengths == dict(x=6.0, y=5.0, z=3.0, w=7.0)
@@ -20,3 +20,13 @@ def b32digest(obj):
     m = sha1()
     m.update(json.dumps(obj, sort_keys=True).encode())
     return b32encode(m.digest()).decode("utf-8").replace("=", "").lower()
+
+
+def filedigest(path, blocksize=2**20):
+    from hashlib import sha1
+
+    m = sha1()
+    with open(path, "rb") as fp:
+        for block in iter(lambda: fp.read(blocksize), b""):
+            m.update(block)
+    return m.hexdigest()
@@ -5,11 +5,13 @@
 
 def niftidim(input, idim):
     if isinstance(input, str):
-        import nibabel as nib
+        from halfpipe.io.metadata.cache import metadata_cache
 
-        input = nib.load(input)
-    if len(input.shape) > idim:
-        return input.shape[idim]
+        shape = metadata_cache.header(input).get_data_shape()
+    else:
+        shape = input.shape
+    if len(shape) > idim:
+        return shape[idim]
     else:
         return 1
 
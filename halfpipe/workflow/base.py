@@ -6,6 +6,8 @@ from uuid import uuid5
 import logging
 from pathlib import Path
 
+import numpy as np
+
 from nipype.pipeline import engine as pe
 from fmriprep import config
 
@@ -18,14 +20,17 @@ from .model import ModelFactory
 
 from .memory import MemoryCalculator
 from .constants import constants
+from ..interface import Merge, FLAME1, FixedEffects, ConnectivityMeasure, CalcMean, ALFF, DualRegression
+from ..interface.transformer import Transformer
 from ..io import Database, BidsDatabase, cacheobj, uncacheobj
+from ..io.metadata import metadata_cache
 from ..model import loadspec
 from ..utils import deepcopyfactory, nvol
 
 logger = logging.getLogger("halfpipe")
 
 
-def init_workflow(workdir):
+def init_workflow(workdir, precision=None):
     """
     initialize nipype workflow
 
@@ -34,9 +39,12 @@ def init_workflow(workdir):
 
     spec = loadspec(workdir=workdir)
     assert spec is not None, "A spec file could not be loaded"
+    if precision is not None:  # command line overrides spec
+        spec.global_settings["precision"] = precision
+    precision = spec.global_settings.get("precision", "float64")
     logger.info("Initializing file database")
-    database = Database(spec)
-    uuid = uuid5(spec.uuid, database.sha1)
+    database = Database(spec, cache_dir=Path(workdir) / "filecache")
+    uuid = uuid5(spec.uuid, database.sha1 + precision)  # the precision is set on the nodes below
 
     workflow = uncacheobj(workdir, "workflow", uuid)
     if workflow is not None:
@@ -63,6 +71,10 @@ def init_workflow(workdir):
     )
 
     # create factories
+    logger.info("Reading image headers and sidecars")
+    metadata_cache.load(Path(workdir) / "filecache" / "metadata.pickle")
+    database.prefetchmetadata()
+
     bidsdatabase = BidsDatabase(database)
     memcalc = MemoryCalculator(database)
     ctx = FactoryContext(workdir, spec, bidsdatabase, workflow, memcalc)
@@ -108,11 +120,21 @@ def init_workflow(workdir):
                 memcalc.volume_std_gb * 50 * config.nipype.omp_nthreads
             )  # decrease memory prediction
 
+        if isinstance(
+            node.interface, (Transformer, Merge, FLAME1, FixedEffects, ConnectivityMeasure, ALFF, DualRegression)
+        ):
+            node.inputs.dtype = precision
+            node._mem_gb *= np.dtype(precision).itemsize / 8  # memory estimates assume float64
+
+        if isinstance(node.interface, (ConnectivityMeasure, CalcMean)):
+            node.inputs.cache_dir = str(Path(workdir) / "labelmatrix")
+
         node.overwrite = None
         node.run_without_submitting = False  # run all nodes in multiproc
 
     logger.info(f"Finished workflow {uuidstr}")
 
+    metadata_cache.save()
     cacheobj(workdir, "workflow", workflow)
     return workflow
 
@@ -3,7 +3,6 @@
 # vi: set ft=python sts=4 ts=4 sw=4 et:
 
 import logging
-from itertools import islice
 from pathlib import Path
 from shutil import copyfile
 
@@ -14,7 +13,7 @@ import nipype.pipeline.engine as pe
 
 from ..interface import LoadResult
 from ..utils import b32digest
-from ..io import IndexedFile, DictListFile, cacheobj, uncacheobj
+from ..io import IndexedFile, DictListFile, cacheobj, uncacheobj, cachechunks, uncachechunks
 from ..resource import get as getresource
 from .constants import constants
 
@@ -28,6 +27,20 @@ class DontRunRunner:
         pass
 
 
+def materialize_reports(workdir):
+    """
+    write the pending report entries from the journals to the report files
+    """
+    reports_directory = Path(workdir) / "reports"
+
+    for ftype in ["imgs", "vals", "preproc"]:
+        report_fname = reports_directory / f"report{ftype}.js"
+        dlf = DictListFile.cached(report_fname)
+        if ftype in ["vals", "preproc"]:
+            dlf.to_table()
+        dlf.materialize()
+
+
 def init_execgraph(workdir, workflow, n_chunks=None, subject_chunks=None):
     logger = logging.getLogger("halfpipe")
 
@@ -56,54 +69,85 @@ def init_execgraph(workdir, workflow, n_chunks=None, subject_chunks=None):
         reportexec_fname, "report", allnodenames, 10
     )  # TODO read current values
 
-    for ftype in ["imgs", "vals", "preproc"]:
-        report_fname = reports_directory / f"report{ftype}.js"
-        with DictListFile.cached(report_fname) as dlf:
-            dlf.is_dirty = True  # force write
+    materialize_reports(workdir)  # also creates missing files
 
     # split workflow
-    subjectworkflows = dict()
-    for node in execgraph.nodes():
-        subjectname = None
-        hierarchy = node._hierarchy.split(".")
-        if hierarchy[1] in ["fmriprep_wf", "reports_wf", "settings_wf", "features_wf"]:
-            subjectname = hierarchy[2]
-        if subjectname is not None:
-            if subjectname not in subjectworkflows:
-                subjectworkflows[subjectname] = set()
-            subjectworkflows[subjectname].add(node)
+    n_subjects = len(set(map(_subjectname, execgraph.nodes())) - {None})
 
     if n_chunks is None:
-        n_chunks = -(-len(subjectworkflows) // max_chunk_size)
+        n_chunks = -(-n_subjects // max_chunk_size)
 
     if subject_chunks:
-        n_chunks = len(subjectworkflows)
+        n_chunks = n_subjects
 
     typestr = f"execgraph.{n_chunks:d}_chunks"
-    execgraphs = uncacheobj(workdir, typestr, uuid, typedisplaystr="execgraph split")
+    execgraphs = uncachechunks(workdir, typestr, uuid, typedisplaystr="execgraph split")
     if execgraphs is not None:
         return execgraphs
 
     logger.info(f"Initializing execgraph split with {n_chunks} chunks")
 
-    execgraphs = []
-    chunks = np.array_split(np.arange(len(subjectworkflows)), n_chunks)
-    partitioniter = iter(subjectworkflows.values())
-    for chunk in chunks:
-        nodes = set.union(
-            *islice(partitioniter, len(chunk))
-        )  # take len(chunk) subjects and create union
-        execgraphs.append(execgraph.subgraph(nodes).copy())
-
-    # make safe load
-    subjectlevelnodes = set.union(*subjectworkflows.values())
-    modelnodes = set(execgraph.nodes()) - subjectlevelnodes
-
     modeldir = Path(workdir) / constants.workflowdir / "models_wf"
     modeldir.mkdir(parents=True, exist_ok=True)
 
+    execgraphs = split_execgraph(execgraph, n_chunks, modeldir)
+    assert len(execgraphs) == n_chunks + 1
+
+    for execgraph in execgraphs:
+        execgraph.uuid = uuid
+
+    logger.info("Finished execgraph split")
+    cachechunks(workdir, typestr, execgraphs, uuid=uuid)  # one file per chunk
+
+    return execgraphs
+
+
+def _subjectname(node):
+    hierarchy = node._hierarchy.split(".")
+    if hierarchy[1] in ["fmriprep_wf", "reports_wf", "settings_wf", "features_wf"]:
+        return hierarchy[2]
+
+
+def split_execgraph(execgraph, n_chunks, modeldir):
+    """
+    split into n_chunks subject level graphs and one model graph, in one pass over the
+    nodes and one pass over the edges, the node objects are shared and not copied
+    """
+
+    # assign subjects to chunks in the order they appear
+    chunkindex = dict()  # by subject
+    nodechunkindex = dict()  # by node, None for model nodes
+    subjectnames = list()
+    for node in execgraph.nodes():
+        subjectname = _subjectname(node)
+        if subjectname is not None and subjectname not in chunkindex:
+            chunkindex[subjectname] = None
+            subjectnames.append(subjectname)
+        nodechunkindex[node] = subjectname
+
+    chunks = np.array_split(np.arange(len(subjectnames)), n_chunks)
+    for i, chunk in enumerate(chunks):
+        for j in chunk:
+            chunkindex[subjectnames[j]] = i
+
+    execgraphs = [nx.DiGraph() for _ in range(n_chunks + 1)]  # last one is the model chunk
+    for node, subjectname in nodechunkindex.items():
+        i = chunkindex[subjectname] if subjectname is not None else n_chunks
+        nodechunkindex[node] = i
+        execgraphs[i].add_node(node)
+
+    # make safe load
     newnodes = dict()
-    for (v, u, c) in nx.edge_boundary(execgraph.reverse(), modelnodes, data=True):
+    for u, v, c in execgraph.edges(data=True):
+        i = nodechunkindex[u]
+        j = nodechunkindex[v]
+        if i == j:
+            execgraphs[i].add_edge(u, v, **c)
+            continue
+
+        if j != n_chunks:  # dropped like in a subgraph
+            continue
+
         u.keep = True  # don't allow results to be deleted
 
         newu = newnodes.get(u.fullname)
@@ -113,22 +157,11 @@ def init_execgraph(workdir, workflow, n_chunks=None, subject_chunks=None):
             newu.config = u.config
             newnodes[u.fullname] = newu
 
-        execgraph.add_edge(newu, v, attr_dict=c)
+        execgraphs[j].add_edge(newu, v, **c)
 
         newuresultfile = Path(newu.output_dir()) / f"result_{newu.name}.pklz"
         for outattr, inattr in c["connect"]:
             newu.needed_outputs = [*newu.needed_outputs, outattr]
             v.input_source[inattr] = (newuresultfile, outattr)
 
-    execgraph.remove_nodes_from(subjectlevelnodes)
-
-    execgraphs.append(execgraph)
-    assert len(execgraphs) == n_chunks + 1
-
-    for execgraph in execgraphs:
-        execgraph.uuid = uuid
-
-    logger.info("Finished execgraph split")
-    cacheobj(workdir, typestr, execgraphs, uuid=uuid)
-
     return execgraphs
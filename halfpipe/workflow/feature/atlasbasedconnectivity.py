@@ -94,15 +94,14 @@ def init_atlasbasedconnectivity_wf(
     workflow.connect(inputnode, "atlas_spaces", resample, "input_space")
 
     #
-    connectivitymeasure = pe.MapNode(
+    connectivitymeasure = pe.Node(
         ConnectivityMeasure(background_label=0, min_region_coverage=min_region_coverage),
         name="connectivitymeasure",
-        iterfield=["atlas_file"],
         mem_gb=memcalc.series_std_gb,
     )
     workflow.connect(inputnode, "bold", connectivitymeasure, "in_file")
     workflow.connect(inputnode, "mask", connectivitymeasure, "mask_file")
-    workflow.connect(resample, "output_image", connectivitymeasure, "atlas_file")
+    workflow.connect(resample, "output_image", connectivitymeasure, "atlas_files")
 
     workflow.connect(connectivitymeasure, "time_series", make_resultdicts, "timeseries")
     workflow.connect(connectivitymeasure, "covariance", make_resultdicts, "covariance_matrix")
@@ -4,14 +4,32 @@
 
 import nipype.pipeline.engine as pe
 import nipype.interfaces.utility as niu
-from nipype.interfaces import afni
 
-from ...interface import MakeResultdicts, ResultdictDatasink, BlurInMask, ZScore
+from ...interface import ALFF, MakeResultdicts, ResultdictDatasink, BlurInMask, ZScore
 
 from ..memory import MemoryCalculator
 from ...utils import formatlikebids
 
 
+def _band(metadata):
+    """
+    frequency band of the bandpass filter of the setting in Hz, where gaussian filter
+    widths in seconds are converted to cutoff frequencies
+    """
+    low, high = 0.01, 0.1  # default band of the literature
+    bandpass_filter = metadata.get("bandpass_filter") if isinstance(metadata, dict) else None
+    if isinstance(bandpass_filter, dict):
+        if bandpass_filter.get("type") == "frequency_based":
+            low = bandpass_filter.get("low") or 0.0
+            high = bandpass_filter.get("high") or 0.0
+        elif bandpass_filter.get("type") == "gaussian":
+            hp_width = bandpass_filter.get("hp_width")
+            lp_width = bandpass_filter.get("lp_width")
+            low = 1.0 / hp_width if hp_width else 0.0
+            high = 1.0 / lp_width if lp_width else 0.0
+    return float(low), float(high)
+
+
 def init_falff_wf(workdir=None, feature=None, fwhm=None, memcalc=MemoryCalculator()):
     """
     Calculate Amplitude of low frequency oscillations(ALFF) and
@@ -42,7 +60,7 @@ def init_falff_wf(workdir=None, feature=None, fwhm=None, memcalc=MemoryCalculato
         niu.IdentityInterface(fields=["tags", "vals", "metadata", "bold", "mask", "fwhm"]), name="inputnode",
     )
     unfiltered_inputnode = pe.Node(
-        niu.IdentityInterface(fields=["bold", "mask"]), name="unfiltered_inputnode",
+        niu.IdentityInterface(fields=["bold", "mask", "repetition_time"]), name="unfiltered_inputnode",
     )
     outputnode = pe.Node(niu.IdentityInterface(fields=["resultdicts"]), name="outputnode")
 
@@ -70,34 +88,26 @@ def init_falff_wf(workdir=None, feature=None, fwhm=None, memcalc=MemoryCalculato
     )
     workflow.connect(make_resultdicts, "resultdicts", resultdict_datasink, "indicts")
 
-    # standard deviation of the filtered image
-    stddev_filtered = pe.Node(afni.TStat(), name="stddev_filtered", mem_gb=memcalc.series_std_gb)
-    stddev_filtered.inputs.outputtype = "NIFTI_GZ"
-    stddev_filtered.inputs.options = "-stdev"
-    workflow.connect(inputnode, "bold", stddev_filtered, "in_file")
-    workflow.connect(inputnode, "mask", stddev_filtered, "mask")
-
-    # standard deviation of the unfiltered image
-    stddev_unfiltered = pe.Node(
-        afni.TStat(), name="stddev_unfiltered", mem_gb=memcalc.series_std_gb
+    # the band is integrated in the spectrum of the unfiltered image, so that the
+    # standard deviations of the filtered and the unfiltered image are computed together
+    band = pe.Node(
+        niu.Function(input_names=["metadata"], output_names=["low", "high"], function=_band), name="band"
     )
-    stddev_unfiltered.inputs.outputtype = "NIFTI_GZ"
-    stddev_unfiltered.inputs.options = "-stdev"
-    workflow.connect(unfiltered_inputnode, "bold", stddev_unfiltered, "in_file")
-    workflow.connect(unfiltered_inputnode, "mask", stddev_unfiltered, "mask")
-
-    falff = pe.Node(afni.Calc(), name="falff", mem_gb=memcalc.volume_std_gb)
-    falff.inputs.args = "-float"
-    falff.inputs.expr = "(1.0*bool(a))*((1.0*b)/(1.0*c))"
-    falff.inputs.outputtype = "NIFTI_GZ"
-    workflow.connect(inputnode, "mask", falff, "in_file_a")
-    workflow.connect(stddev_filtered, "out_file", falff, "in_file_b")
-    workflow.connect(stddev_unfiltered, "out_file", falff, "in_file_c")
+    workflow.connect(inputnode, "metadata", band, "metadata")
+
+    alff = pe.Node(
+        ALFF(stream_mem_gb=0.25), name="alff", mem_gb=memcalc.volume_std_gb * 4 + 0.25
+    )  # the image is streamed, so memory does not scale with the number of volumes
+    workflow.connect(unfiltered_inputnode, "bold", alff, "in_file")
+    workflow.connect(inputnode, "mask", alff, "mask")
+    workflow.connect(unfiltered_inputnode, "repetition_time", alff, "repetition_time")
+    workflow.connect(band, "low", alff, "low")
+    workflow.connect(band, "high", alff, "high")
 
     #
     merge = pe.Node(niu.Merge(2), name="merge")
-    workflow.connect(stddev_filtered, "out_file", merge, "in1")
-    workflow.connect(falff, "out_file", merge, "in2")
+    workflow.connect(alff, "alff", merge, "in1")
+    workflow.connect(alff, "falff", merge, "in2")
 
     smooth = pe.MapNode(
         BlurInMask(preserve=True, float_out=True, out_file="blur.nii.gz"), iterfield="in_file", name="smooth"
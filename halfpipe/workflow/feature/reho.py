@@ -58,9 +58,9 @@ def init_reho_wf(workdir=None, feature=None, fwhm=None, memcalc=MemoryCalculator
 
     #
     reho = pe.Node(
-        interface=ReHo(neighborhood="vertices", out_file="reho.nii"),
+        interface=ReHo(neighborhood="vertices", out_file="reho.nii.gz"),
         name="reho",
-        mem_gb=memcalc.series_std_gb * 2,
+        mem_gb=memcalc.series_std_gb * 2.5,
     )
     workflow.connect(inputnode, "bold", reho, "in_file")
     workflow.connect(inputnode, "mask", reho, "mask_file")
@@ -4,22 +4,18 @@
 
 import numpy as np
 
-import nipype.algorithms.modelgen as model
-
 from nipype.pipeline import engine as pe
 from nipype.interfaces import utility as niu
-from nipype.interfaces import fsl
+
+from fmriprep import config
 
 from ...interface import (
     ParseConditionFile,
     MakeResultdicts,
-    FillNA,
     ResultdictDatasink,
-    MakeDofVolume,
-    MergeColumns,
-    Unvest
+    FirstLevelGLM,
 )
-from ...utils import firstfloat, firststr, formatlikebids, ravel
+from ...utils import firststr, formatlikebids
 
 from ..memory import MemoryCalculator
 
@@ -110,21 +106,6 @@ def init_taskbased_wf(
     workflow.connect(inputnode, "condition_names", parseconditionfile, "condition_names")
     workflow.connect(inputnode, "condition_files", parseconditionfile, "in_any")
 
-    fillna = pe.Node(FillNA(), name="fillna")
-    workflow.connect(inputnode, "confounds_selected", fillna, "in_tsv")
-
-    # first level model specification
-    modelspec = pe.Node(model.SpecifyModel(), name="modelspec")
-    if hasattr(feature, "high_pass_filter_cutoff"):
-        modelspec.inputs.high_pass_filter_cutoff = feature.high_pass_filter_cutoff
-    else:
-        modelspec.inputs.high_pass_filter_cutoff = np.inf
-    workflow.connect(inputnode, "bold", modelspec, "functional_runs")
-    workflow.connect(inputnode, "condition_units", modelspec, "input_units")
-    workflow.connect(inputnode, "repetition_time", modelspec, "time_repetition")
-    workflow.connect(fillna, "out_no_header", modelspec, "realignment_parameters")
-    workflow.connect(parseconditionfile, "subject_info", modelspec, "subject_info")
-
     # transform contrasts dictionary to nipype list data structure
     contrasts = []
     if feature is not None:
@@ -137,75 +118,34 @@ def init_taskbased_wf(
     contrast_names = list(map(firststr, contrasts))
     make_resultdicts_b.inputs.taskcontrast = contrast_names
 
-    # generate design from first level specification
-    level1design = pe.Node(
-        fsl.Level1Design(
+    # build the design and estimate the first level model in one step
+    firstlevelglm = pe.Node(
+        FirstLevelGLM(
             contrasts=contrasts,
-            model_serial_correlations=True,
-            bases={"dgamma": {"derivs": False}},
+            smooth_autocorr=True,
+            mask_size=5,
         ),
-        name="level1design",
-    )
-    workflow.connect(inputnode, "repetition_time", level1design, "interscan_interval")
-    workflow.connect(modelspec, "session_info", level1design, "session_info")
-
-    # generate required input files for FILMGLS from design
-    modelgen = pe.Node(fsl.FEATModel(), name="modelgen")
-    workflow.connect([(level1design, modelgen, [(("fsf_files", firststr), "fsf_file")])])
-    workflow.connect([(level1design, modelgen, [(("ev_files", ravel), "ev_files")])])
-
-    # calculate range of image values to determine cutoff value
-    stats = pe.Node(fsl.ImageStats(op_string="-R"), name="stats")
-    workflow.connect(inputnode, "bold", stats, "in_file")
-    cutoff = pe.Node(
-        niu.Function(input_names=["obj"], output_names=["min_val"], function=firstfloat),
-        name="cutoff",
-    )
-    workflow.connect(stats, "out_stat", cutoff, "obj")
-
-    # actually estimate the first level model
-    modelestimate = pe.Node(
-        fsl.FILMGLS(smooth_autocorr=True, mask_size=5),
-        name="modelestimate"
-    )
-    workflow.connect(inputnode, "bold", modelestimate, "in_file")
-    workflow.connect(cutoff, "min_val", modelestimate, "threshold")
-    workflow.connect(modelgen, "design_file", modelestimate, "design_file")
-    workflow.connect(modelgen, "con_file", modelestimate, "tcon_file")
-
-    # make dof volume
-    makedofvolume = pe.Node(
-        MakeDofVolume(), iterfield=["dof_file", "copes"], name="makedofvolume"
-    )
-    workflow.connect(modelestimate, "copes", makedofvolume, "copes")
-    workflow.connect(modelestimate, "dof_file", makedofvolume, "dof_file")
-
-    workflow.connect(modelestimate, "copes", make_resultdicts_b, "effect")
-    workflow.connect(modelestimate, "varcopes", make_resultdicts_b, "variance")
-    workflow.connect(modelestimate, "zstats", make_resultdicts_b, "z")
-    workflow.connect(makedofvolume, "out_file", make_resultdicts_b, "dof")
-
-    #
-    mergecolumnnames = pe.Node(niu.Merge(2), name="mergecolumnnames")
-    mergecolumnnames.inputs.in1 = condition_names
-    workflow.connect(fillna, "column_names", mergecolumnnames, "in2")
-
-    design_unvest = pe.Node(Unvest(), name="design_unvest")
-    workflow.connect(modelgen, "design_file", design_unvest, "in_vest")
-
-    design_tsv = pe.Node(MergeColumns(1), name="design_tsv")
-    workflow.connect(design_unvest, "out_no_header", design_tsv, "in1")
-    workflow.connect(mergecolumnnames, "out", design_tsv, "column_names1")
-
-    contrast_unvest = pe.Node(Unvest(), name="contrast_unvest")
-    workflow.connect(modelgen, "con_file", contrast_unvest, "in_vest")
-
-    contrast_tsv = pe.Node(MergeColumns(1), name="contrast_tsv")
-    contrast_tsv.inputs.row_index = contrast_names
-    workflow.connect(contrast_unvest, "out_no_header", contrast_tsv, "in1")
-    workflow.connect(mergecolumnnames, "out", contrast_tsv, "column_names1")
-
-    workflow.connect(design_tsv, "out_with_header", make_resultdicts_a, "design_matrix")
-    workflow.connect(contrast_tsv, "out_with_header", make_resultdicts_a, "contrast_matrix")
+        name="firstlevelglm",
+        n_procs=config.nipype.omp_nthreads,
+        mem_gb=memcalc.series_std_gb * 2 + 0.25 * config.nipype.omp_nthreads,
+    )  # the time series is loaded as float64, and each thread holds about four blocks of voxels
+    if hasattr(feature, "high_pass_filter_cutoff"):
+        firstlevelglm.inputs.high_pass_filter_cutoff = feature.high_pass_filter_cutoff
+    else:
+        firstlevelglm.inputs.high_pass_filter_cutoff = np.inf
+    workflow.connect(inputnode, "bold", firstlevelglm, "in_file")
+    workflow.connect(inputnode, "mask", firstlevelglm, "mask")
+    workflow.connect(inputnode, "repetition_time", firstlevelglm, "repetition_time")
+    workflow.connect(inputnode, "condition_units", firstlevelglm, "condition_units")
+    workflow.connect(inputnode, "confounds_selected", firstlevelglm, "confounds")
+    workflow.connect(parseconditionfile, "subject_info", firstlevelglm, "subject_info")
+
+    workflow.connect(firstlevelglm, "copes", make_resultdicts_b, "effect")
+    workflow.connect(firstlevelglm, "varcopes", make_resultdicts_b, "variance")
+    workflow.connect(firstlevelglm, "zstats", make_resultdicts_b, "z")
+    workflow.connect(firstlevelglm, "dof_file", make_resultdicts_b, "dof")
+
+    workflow.connect(firstlevelglm, "design_matrix", make_resultdicts_a, "design_matrix")
+    workflow.connect(firstlevelglm, "contrast_matrix", make_resultdicts_a, "contrast_matrix")
 
     return workflow
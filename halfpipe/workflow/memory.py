@@ -3,10 +3,10 @@
 # vi: set ft=python sts=4 ts=4 sw=4 et:
 
 import numpy as np
-import nibabel as nb
 
 from fmriprep.config import DEFAULT_MEMORY_MIN_GB
 
+from ..io.metadata import metadata_cache
 from ..utils import first
 
 
@@ -15,7 +15,7 @@ class MemoryCalculator:
         if database is not None:
             bold_file = first(database.get(datatype="func", suffix="bold"))
         if bold_file is not None:
-            bold_shape = nb.load(bold_file).shape
+            bold_shape = metadata_cache.header(bold_file).get_data_shape()
         self.volume_gb = np.product(bold_shape[:3]) * 8 / 2 ** 30
         if len(bold_shape) > 3:
             bold_tlen = bold_shape[3]
@@ -13,11 +13,9 @@ from fmriprep import config
 from ...interface import (
     InterceptOnlyModel,
     LinearModel,
-    Merge,
-    MergeMask,
     ExtractFromResultdict,
     MakeResultdicts,
-    FLAMEO as FSLFLAMEO,
+    FixedEffects,
     FLAME1,
     FilterResultdicts,
     AggregateResultdicts,
@@ -30,16 +28,6 @@ from ...utils import ravel, formatlikebids, lenforeach
 from ..memory import MemoryCalculator
 
 
-def _fe_run_mode(var_cope_file):
-    from pathlib import Path
-
-    if isinstance(var_cope_file, (Path, str)) and Path(var_cope_file).exists():
-        return "fe"
-
-    else:
-        return "ols"
-
-
 def _critical_z(resels=None, critical_p=0.05):
     from scipy.stats import norm
 
@@ -176,59 +164,29 @@ def init_model_wf(workdir=None, numinputs=1, model=None, variables=None, memcalc
     # run models
     if model.type in ["fe"]:
 
-        # need to merge
-        mergenodeargs = dict(iterfield="in_files", mem_gb=memcalc.volume_std_gb * numinputs)
-        mergemask = pe.MapNode(MergeMask(), name="mergemask", **mergenodeargs)
-        workflow.connect(extractfromresultdict, "mask", mergemask, "in_files")
-
-        mergeeffect = pe.MapNode(Merge(dimension="t"), name="mergeeffect", **mergenodeargs)
-        workflow.connect(extractfromresultdict, "effect", mergeeffect, "in_files")
-
-        mergevariance = pe.MapNode(Merge(dimension="t"), name="mergevariance", **mergenodeargs)
-        workflow.connect(extractfromresultdict, "variance", mergevariance, "in_files")
-
-        fe_run_mode = pe.MapNode(
-            niu.Function(input_names=["var_cope_file"], output_names=["run_mode"], function=_fe_run_mode),
-            iterfield=["var_cope_file"],
-            name="fe_run_mode",
-        )
-        workflow.connect(mergevariance, "merged_file", fe_run_mode, "var_cope_file")
-
-        # prepare design matrix
-        multipleregressdesign = pe.MapNode(
-            fsl.MultipleRegressDesign(),
-            name="multipleregressdesign",
-            iterfield=["regressors", "contrasts"],
-            mem_gb=memcalc.min_gb,
-        )
-        workflow.connect(modelspec, "regressors", multipleregressdesign, "regressors")
-        workflow.connect(modelspec, "contrasts", multipleregressdesign, "contrasts")
-
-        # use FSL implementation
+        # use closed form implementation, which runs ordinary least squares if
+        # there are no variances
         modelfit = pe.MapNode(
-            FSLFLAMEO(),
+            FixedEffects(),
             name="modelfit",
             mem_gb=memcalc.volume_std_gb * 100,
             iterfield=[
-                "run_mode",
-                "mask_file",
-                "cope_file",
-                "var_cope_file",
-                "design_file",
-                "t_con_file",
-                "cov_split_file",
+                "mask_files",
+                "cope_files",
+                "var_cope_files",
+                "regressors",
+                "contrasts",
             ],
         )
-        workflow.connect(fe_run_mode, "run_mode", modelfit, "run_mode")
-        workflow.connect(mergemask, "merged_file", modelfit, "mask_file")
-        workflow.connect(mergeeffect, "merged_file", modelfit, "cope_file")
-        workflow.connect(mergevariance, "merged_file", modelfit, "var_cope_file")
-        workflow.connect(multipleregressdesign, "design_mat", modelfit, "design_file")
-        workflow.connect(multipleregressdesign, "design_con", modelfit, "t_con_file")
-        workflow.connect(multipleregressdesign, "design_grp", modelfit, "cov_split_file")
+        workflow.connect(extractfromresultdict, "mask", modelfit, "mask_files")
+        workflow.connect(extractfromresultdict, "effect", modelfit, "cope_files")
+        workflow.connect(extractfromresultdict, "variance", modelfit, "var_cope_files")
+
+        workflow.connect(modelspec, "regressors", modelfit, "regressors")
+        workflow.connect(modelspec, "contrasts", modelfit, "contrasts")
 
         # mask output
-        workflow.connect(mergemask, "merged_file", make_resultdicts_b, "mask")
+        workflow.connect(modelfit, "masks", make_resultdicts_b, "mask")
 
     elif model.type in ["me", "lme"]:
 
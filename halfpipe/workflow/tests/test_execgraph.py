@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""
+"""
+
+import pytest
+
+from itertools import islice
+import logging
+from pathlib import Path
+from time import time
+
+import numpy as np
+import networkx as nx
+
+import nipype.interfaces.utility as niu
+import nipype.pipeline.engine as pe
+
+from ..execgraph import split_execgraph, _subjectname
+from ...interface import LoadResult
+from ...utils import b32digest
+
+nodes_per_subject = 8
+
+
+def make_synthetic_execgraph(n_subjects, base_dir):
+    execgraph = nx.DiGraph()
+
+    def make_node(name, hierarchy):
+        node = pe.Node(niu.IdentityInterface(fields=["x"]), name=name, base_dir=str(base_dir))
+        node._hierarchy = hierarchy
+        execgraph.add_node(node)
+        return node
+
+    model = make_node("model", "nipype.models_wf.model_wf")
+    group = make_node("group", "nipype.models_wf.model_wf")
+    execgraph.add_edge(model, group, connect=[("x", "x")])
+
+    for i in range(n_subjects):
+        previous = None
+        for j in range(nodes_per_subject):
+            node = make_node(f"node_{j}", f"nipype.features_wf.sub_{i:05d}_wf")
+            if previous is not None:
+                execgraph.add_edge(previous, node, connect=[("x", "x")])
+            previous = node
+        execgraph.add_edge(previous, model, connect=[("x", "x")])
+
+    return execgraph
+
+
+def split_execgraph_subgraph(execgraph, n_chunks, modeldir):
+    """
+    the previous implementation that copies a subgraph per chunk and reverses the graph
+    """
+    subjectworkflows = dict()
+    for node in execgraph.nodes():
+        subjectname = _subjectname(node)
+        if subjectname is not None:
+            subjectworkflows.setdefault(subjectname, set()).add(node)
+
+    execgraphs = list()
+    chunks = np.array_split(np.arange(len(subjectworkflows)), n_chunks)
+    partitioniter = iter(subjectworkflows.values())
+    for chunk in chunks:
+        nodes = set.union(*islice(partitioniter, len(chunk)))
+        execgraphs.append(execgraph.subgraph(nodes).copy())
+
+    subjectlevelnodes = set.union(*subjectworkflows.values())
+    modelnodes = set(execgraph.nodes()) - subjectlevelnodes
+
+    newnodes = dict()
+    for (v, u, c) in nx.edge_boundary(execgraph.reverse(), modelnodes, data=True):
+        newu = newnodes.get(u.fullname)
+        if newu is None:
+            newu = pe.Node(LoadResult(u), name=f"load_result_{b32digest(u.fullname)[:4]}", base_dir=modeldir)
+            newu.config = u.config
+            newnodes[u.fullname] = newu
+
+        execgraph.add_edge(newu, v, attr_dict=c)
+
+        newuresultfile = Path(newu.output_dir()) / f"result_{newu.name}.pklz"
+        for outattr, inattr in c["connect"]:
+            newu.needed_outputs = [*newu.needed_outputs, outattr]
+            v.input_source[inattr] = (newuresultfile, outattr)
+
+    execgraph.remove_nodes_from(subjectlevelnodes)
+    execgraphs.append(execgraph)
+
+    return execgraphs
+
+
+@pytest.mark.parametrize("n_subjects", [10, 1000])
+def test_split_execgraph(tmp_path, n_subjects):
+    logger = logging.getLogger("halfpipe")
+
+    execgraph = make_synthetic_execgraph(n_subjects, tmp_path)
+    n_chunks = n_subjects // 5
+
+    start = time()
+    reference_execgraphs = split_execgraph_subgraph(execgraph.copy(), n_chunks, tmp_path)
+    reference_time = time() - start
+
+    start = time()
+    execgraphs = split_execgraph(execgraph, n_chunks, tmp_path)
+    split_time = time() - start
+
+    assert len(execgraphs) == n_chunks + 1
+
+    logger.info(
+        f"Split synthetic execgraph with {n_subjects} subjects in {split_time:.3f}s "
+        f"(subgraph copies took {reference_time:.3f}s)"
+    )
+
+    def names(execgraph):
+        return set(node.fullname for node in execgraph.nodes())
+
+    def edgenames(execgraph):
+        return set((u.fullname, v.fullname) for u, v in execgraph.edges())
+
+    for a, b in zip(execgraphs, reference_execgraphs):
+        assert names(a) == names(b)
+        assert edgenames(a) == edgenames(b)
+
+    modelgraph = execgraphs[-1]
+    assert modelgraph.number_of_nodes() == 2 + n_subjects
+
+    model = next(node for node in modelgraph.nodes() if node.name == "model")
+    assert modelgraph.in_degree(model) == n_subjects
+    assert "x" in model.input_source
+
+    for node in execgraphs[0].nodes():
+        if node.name == f"node_{nodes_per_subject - 1}":
+            assert node.keep is True